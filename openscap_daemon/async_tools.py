@@ -19,9 +19,12 @@
 
 import threading
 import logging
+import math
 import time
+import os
 import sys
 import traceback
+import collections
 if sys.version_info < (3,):
     import Queue as queue
 else:
@@ -66,14 +69,87 @@ class AsyncAction(object):
     def __init__(self):
         self.token = -1
         self.status = Status.UNKNOWN
+        # Actions with the same lane are never run in parallel, None means
+        # the action can run alongside anything.
+        self.lane = None
+        # Set by AsyncManager.cancel, long running actions are supposed to
+        # check it and stop early.
+        self.cancelled = False
+        # Set by AsyncManager.enqueue
+        self.priority = 0
+        # Who asked for the action, pending actions are limited per caller.
+        # None means the daemon itself.
+        self.caller = None
+        # Identifies the content of actions the ResourceGovernor has to
+        # approve before they start, None means the action isn't governed.
+        self.resource_key = None
+        # Peak memory usage in bytes, set by the action once it's known
+        self.peak_memory = None
 
     def run(self):
         pass
 
+    def set_peak_memory(self, peak_memory):
+        """Meant to be passed as usage_callback to oscap_helpers.evaluate.
+        """
+
+        self.peak_memory = peak_memory
+
+    def interrupt(self):
+        """Called from AsyncManager.cancel when the action is already being
+        processed. Returns True if the action is going to stop early, False
+        if it can't be interrupted and will run to completion.
+
+        Must not block, it's typically called from the dbus thread.
+        """
+
+        return False
+
     def __str__(self):
         return "Unknown action"
 
 
+class QueueFull(RuntimeError):
+    """Raised by AsyncManager.enqueue when too many actions are pending.
+    retry_after is the estimated number of seconds until there is room.
+    """
+
+    def __init__(self, message, retry_after):
+        super(QueueFull, self).__init__(message)
+        self.retry_after = retry_after
+
+
+class RetireWorkerAction(AsyncAction):
+    """Marker put into the queue to wake up an idle worker after the worker
+    pool has been shrunk. It's never stored in AsyncManager.actions.
+    """
+
+    def __str__(self):
+        return "Retire worker"
+
+
+# Lower is more important, retiring workers goes before anything else.
+RETIRE_WORKER_PRIORITY = -1
+
+# Every this many seconds of waiting in the queue count as one priority level.
+# See AsyncManager.
+DEFAULT_PRIORITY_AGING = 60.0
+
+if hasattr(time, "monotonic"):
+    _monotonic_time = time.monotonic
+else:
+    _monotonic_time = time.time
+
+
+def get_cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+
+    except NotImplementedError:
+        return 4
+
+
 class AsyncManager(object):
     """Allows the user to enqueue asynchronous actions, gives the user a token
     they can poll as often as they like and check status of the actions.
@@ -83,11 +159,133 @@ class AsyncManager(object):
     to take hours to finish. The calls themselves need to finish in seconds.
     To make it work with OpenSCAP evaluations that regularly take tens of
     minutes we create a task by the dbus call and then poll it.
+
+    Actions are ordered by priority, lower values go first. Actions of the
+    same priority are processed in FIFO order. To avoid starvation of less
+    important actions under a steady stream of more important ones, waiting
+    ages actions. Every priority_aging seconds of waiting are worth one
+    priority level, an action enqueued with priority p is therefore never
+    overtaken by actions of priority 0 that were enqueued more than
+    p * priority_aging seconds after it. With priority_aging set to 0 the
+    ordering is by priority only.
+
+    Actions can be assigned a lane, at most one action per lane is processed
+    at any time. Actions that can't be started because their lane is busy
+    are parked and put back to the end of the queue when the lane frees up.
+    That way lanes take turns instead of one lane hogging all the workers.
+
+    The number of pending actions can be limited per priority and per caller,
+    enqueue raises QueueFull with an estimated wait once a limit is reached.
+
+    Actions with a resource_key only start once the governor, if any, finds
+    enough resources on the host for them.
     """
 
+    def _count_pending_locked(self, action, delta):
+        count = self.pending_by_priority.get(action.priority, 0) + delta
+        if count > 0:
+            self.pending_by_priority[action.priority] = count
+        else:
+            self.pending_by_priority.pop(action.priority, None)
+
+        if action.caller is None:
+            return
+
+        count = self.pending_by_caller.get(action.caller, 0) + delta
+        if count > 0:
+            self.pending_by_caller[action.caller] = count
+        else:
+            self.pending_by_caller.pop(action.caller, None)
+
+    def _release_lane_locked(self, action):
+        if action.lane is None:
+            return
+
+        lane = self.lanes.get(action.lane)
+        if lane is None or lane[0] != action.token:
+            return
+
+        _, waiting = lane
+        if not waiting:
+            del self.lanes[action.lane]
+            return
+
+        key, _, priority, next_action = waiting.popleft()
+        lane[0] = next_action.token
+        # keep the key the action has earned by waiting, it's not supposed to
+        # lose its place just because its lane was busy
+        self._put(key, priority, next_action)
+
+    def _release_lane(self, action):
+        with self.actions_lock:
+            self._release_lane_locked(action)
+
+    def _put(self, key, priority, action):
+        with self.sequence_lock:
+            self.last_sequence += 1
+            sequence = self.last_sequence
+
+        self.queue.put((key, sequence, priority, action))
+
+    def _start_action(self, entry):
+        """Returns True if the worker should run given action. Actions get
+        parked here if their lane is busy and dropped if they were cancelled.
+        """
+
+        action = entry[3]
+        with self.actions_lock:
+            if action.cancelled:
+                # cancelled action may have been handed a lane already
+                self._release_lane_locked(action)
+                return False
+
+            if action.lane is not None:
+                lane = self.lanes.get(action.lane)
+                if lane is None:
+                    self.lanes[action.lane] = \
+                        [action.token, collections.deque()]
+
+                elif lane[0] != action.token:
+                    # lane is busy, the action will be put back to the queue
+                    # when it's handed the lane
+                    lane[1].append(entry)
+                    return False
+
+            action.status = Status.PROCESSING
+            self._count_pending_locked(action, -1)
+            return True
+
+    def _retire_worker(self, worker_id):
+        with self.workers_lock:
+            if len(self.workers) <= self.target_workers:
+                return False
+
+            self.workers.remove(threading.current_thread())
+
+        logging.debug("Worker %i retired, %i workers left.",
+                      worker_id, len(self.workers))
+        return True
+
     def _worker_main(self, worker_id):
         while True:
-            priority, action = self.queue.get(True)
+            entry = self.queue.get(True)
+            _, _, priority, action = entry
+
+            if isinstance(action, RetireWorkerAction):
+                self.queue.task_done()
+                if self._retire_worker(worker_id):
+                    return
+
+                continue
+
+            if not self._start_action(entry):
+                logging.debug(
+                    "Worker %i skipped action with token=%i, it's been "
+                    "cancelled or its lane '%s' is busy.",
+                    worker_id, action.token, action.lane
+                )
+                self.queue.task_done()
+                continue
 
             logging.debug(
                 "Worker %i starting action from the priority queue. "
@@ -95,9 +293,33 @@ class AsyncManager(object):
                 worker_id, priority, action.token, action
             )
 
-            action.status = Status.PROCESSING
+            governor = self.governor
+            if action.resource_key is None:
+                governor = None
+            acquired = False
+            start_time = None
+
+            # The lane, the governor slot and the queue entry have to be
+            # released whatever happens, the worker keeps going.
             try:
-                action.run()
+                self._throttle()
+
+                if governor is not None:
+                    governor.acquire(action.resource_key)
+                    acquired = True
+
+                if action.cancelled:
+                    # cancelled while waiting for the governor, there is no
+                    # point in starting it just to interrupt it
+                    logging.debug(
+                        "Worker %i skipped action with token=%i, it's been "
+                        "cancelled while waiting for resources.",
+                        worker_id, action.token
+                    )
+
+                else:
+                    start_time = time.time()
+                    action.run()
 
             except BaseException as e:
                 logging.error("Action '%s' threw an exception that hasn't been "
@@ -106,60 +328,333 @@ class AsyncManager(object):
                 exc_type, exc_value, tb = sys.exc_info()
                 traceback.print_tb(tb, file=sys.stderr)
 
-            self.queue.task_done()
+            finally:
+                if start_time is not None:
+                    self._record_run_time(time.time() - start_time)
+                if acquired:
+                    governor.release(action.resource_key, action.peak_memory)
 
-            with self.actions_lock:
-                del self.actions[action.token]
+                self._release_lane(action)
 
-            time.sleep(self.sleep_time)
+                with self.actions_lock:
+                    # cancelled actions are already gone
+                    self.actions.pop(action.token, None)
 
-    def __init__(self, workers=0):
-        self.queue = queue.PriorityQueue()
+                self.queue.task_done()
 
-        self.sleep_time = 1
+    def __init__(self, workers=0, max_actions_per_second=0,
+                 priority_aging=DEFAULT_PRIORITY_AGING):
+        # (key, sequence, priority, action) tuples, key is derived from
+        # priority and enqueue time, see _get_key
+        self.queue = queue.PriorityQueue()
+        # sequence numbers keep FIFO order among equal keys, they also make
+        # sure actions themselves are never compared
+        self.last_sequence = 0
+        self.sequence_lock = threading.Lock()
+        self.priority_aging = priority_aging
+
+        # 0 means actions are started as soon as a worker is free
+        self.max_actions_per_second = max_actions_per_second
+        # see resource_governor.ResourceGovernor, None means actions are
+        # started regardless of host resources
+        self.governor = None
+        self.next_action_start = 0.0
+        self.throttle_lock = threading.Lock()
 
         if workers == 0:
-            try:
-                import multiprocessing
-                workers = multiprocessing.cpu_count()
+            workers = get_cpu_count()
+
+        self.last_token = 0
+        self.actions = {}
+        # lane -> [token of the action owning the lane, deque of parked
+        #          queue entries]
+        self.lanes = {}
+        self.actions_lock = threading.Lock()
 
-            except NotImplementedError:
-                workers = 4
+        # priority -> max number of pending actions, priorities that aren't
+        # listed are not limited
+        self.max_pending = {}
+        # 0 means pending actions are not limited per caller
+        self.max_pending_per_caller = 0
+        self.pending_by_priority = {}
+        self.pending_by_caller = {}
 
         self.workers = []
+        self.target_workers = 0
+        self.last_worker_id = -1
+        self.workers_lock = threading.Lock()
 
-        for i in range(workers):
-            worker = threading.Thread(
-                name="AsyncManager worker (%i out of %i)" % (i, workers),
-                target=AsyncManager._worker_main,
-                args=(self, i)
-            )
-            worker.daemon = True
-            self.workers.append(worker)
-            worker.start()
+        # exponential moving average of action run times in seconds
+        self.average_run_time = 0.0
 
-        self.last_token = 0
-        self.actions = {}
-        self.actions_lock = threading.Lock()
+        self.adaptive = False
+        self.adaptive_min_workers = 1
+        self.adaptive_max_workers = workers
+        # load average per CPU above which we shrink the worker pool
+        self.adaptive_high_load = 1.0
+        # load average per CPU under which we grow the pool if there is
+        # a backlog of actions
+        self.adaptive_low_load = 0.7
+        self.adaptive_thread = None
+
+        self._resize(workers)
 
         logging.debug("Initialized AsyncManager, %i workers",
                       len(self.workers))
 
-    def _allocate_token(self):
-        with self.actions_lock:
-            ret = self.last_token + 1
-            self.last_token = ret
-            assert(ret not in self.actions)
+    def _resize(self, workers):
+        if workers < 1:
+            raise RuntimeError(
+                "AsyncManager needs at least 1 worker, %i requested." %
+                (workers)
+            )
+
+        with self.workers_lock:
+            self.target_workers = workers
+
+            while len(self.workers) < workers:
+                self.last_worker_id += 1
+                worker = threading.Thread(
+                    name="AsyncManager worker %i" % (self.last_worker_id),
+                    target=AsyncManager._worker_main,
+                    args=(self, self.last_worker_id)
+                )
+                worker.daemon = True
+                self.workers.append(worker)
+                worker.start()
+
+            surplus = len(self.workers) - workers
+
+        # Busy workers retire after finishing their current action, idle
+        # workers need to be woken up.
+        for _ in range(surplus):
+            self._put(
+                float("-inf"), RETIRE_WORKER_PRIORITY, RetireWorkerAction()
+            )
+
+    def get_workers(self):
+        """Returns the number of workers the pool is supposed to have.
+        Retiring workers may still be finishing their last action.
+        """
+
+        with self.workers_lock:
+            return self.target_workers
+
+    def set_workers(self, workers):
+        """Grows or shrinks the worker pool. This disables the adaptive mode,
+        the user knows better.
+        """
+
+        if workers == 0:
+            workers = get_cpu_count()
+
+        self._resize(workers)
+
+        if self.adaptive:
+            logging.info("Worker count set explicitly, disabling adaptive "
+                         "worker count.")
+            self.adaptive = False
+
+        logging.info("AsyncManager worker pool resized to %i workers.",
+                     workers)
+
+    def _throttle(self):
+        """Delays the calling worker so that actions are started at most
+        max_actions_per_second times per second across all workers.
+        """
+
+        if self.max_actions_per_second <= 0:
+            return
+
+        with self.throttle_lock:
+            now = time.time()
+            start = max(now, self.next_action_start)
+            self.next_action_start = start + 1.0 / self.max_actions_per_second
+
+        if start > now:
+            time.sleep(start - now)
+
+    def _record_run_time(self, run_time):
+        with self.workers_lock:
+            if self.average_run_time == 0.0:
+                self.average_run_time = run_time
+            else:
+                self.average_run_time = \
+                    0.8 * self.average_run_time + 0.2 * run_time
+
+    def _adapt(self):
+        try:
+            load = os.getloadavg()[0] / get_cpu_count()
+
+        except OSError:
+            logging.warning("Can't read the load average, adaptive worker "
+                            "count has no effect.")
+            return
+
+        workers = self.get_workers()
+        backlog = self.queue.qsize()
+
+        if load > self.adaptive_high_load and \
+           workers > self.adaptive_min_workers:
+            logging.info(
+                "Load %.2f per CPU is too high, shrinking AsyncManager to %i "
+                "workers.", load, workers - 1
+            )
+            self._resize(workers - 1)
+
+        elif load < self.adaptive_low_load and backlog > 0 and \
+                workers < self.adaptive_max_workers:
+            logging.info(
+                "Load %.2f per CPU with %i actions waiting, growing "
+                "AsyncManager to %i workers.", load, backlog, workers + 1
+            )
+            self._resize(workers + 1)
+
+    def _adaptive_main(self):
+        while self.adaptive:
+            # Don't react faster than actions finish, the load caused by
+            # a new worker only shows after it has been running for a while.
+            time.sleep(min(max(10.0, self.average_run_time), 5 * 60.0))
+            if not self.adaptive:
+                break
+
+            self._adapt()
+
+    def enable_adaptive(self, min_workers, max_workers):
+        """Periodically adjusts the worker count between min_workers and
+        max_workers. The pool shrinks when the host is overloaded and grows
+        when there is a backlog of actions and the host has spare capacity.
+        """
+
+        if min_workers < 1 or max_workers < min_workers:
+            raise RuntimeError(
+                "Invalid adaptive worker range %i - %i." %
+                (min_workers, max_workers)
+            )
+
+        self.adaptive_min_workers = min_workers
+        self.adaptive_max_workers = max_workers
+
+        workers = self.get_workers()
+        if workers < min_workers or workers > max_workers:
+            self._resize(min(max(workers, min_workers), max_workers))
+
+        self.adaptive = True
+        if self.adaptive_thread is None or \
+           not self.adaptive_thread.is_alive():
+            self.adaptive_thread = threading.Thread(
+                name="AsyncManager adaptive worker count",
+                target=AsyncManager._adaptive_main,
+                args=(self,)
+            )
+            self.adaptive_thread.daemon = True
+            self.adaptive_thread.start()
+
+        logging.info("Enabled adaptive worker count, %i - %i workers.",
+                     min_workers, max_workers)
+
+    def _allocate_token_locked(self):
+        ret = self.last_token + 1
+        self.last_token = ret
+        assert(ret not in self.actions)
 
         return ret
 
-    def enqueue(self, action, priority=0):
-        action.token = self._allocate_token()
-        action.status = Status.PENDING
+    def _get_key(self, priority):
+        if self.priority_aging <= 0:
+            return priority
+
+        return _monotonic_time() + priority * self.priority_aging
+
+    def get_max_queue_delay(self, priority):
+        """Returns for how many seconds at most an action of given priority
+        can be overtaken by more important actions enqueued after it. The
+        time needed to process actions that were already in the queue comes
+        on top of this. None means there is no such bound.
+        """
+
+        if self.priority_aging <= 0:
+            return None
+
+        return max(0, priority) * self.priority_aging
+
+    def set_max_pending(self, priority, max_pending):
+        """Limits how many actions of given priority can be pending, 0 means
+        no limit.
+        """
+
+        with self.actions_lock:
+            if max_pending > 0:
+                self.max_pending[priority] = max_pending
+            else:
+                self.max_pending.pop(priority, None)
+
+    def _estimate_wait_locked(self, priority):
+        # Actions of the same or higher importance go first, each worker
+        # takes one of them every average_run_time seconds.
+        ahead = sum(count for p, count in self.pending_by_priority.items()
+                    if p <= priority)
+        ahead += len(self.actions) - sum(self.pending_by_priority.values())
+
+        with self.workers_lock:
+            workers = max(1, self.target_workers)
+            # we have no idea yet, assume a typical evaluation
+            run_time = self.average_run_time or 60.0
+
+        return int(math.ceil(max(1.0, ahead * run_time / workers)))
+
+    def _check_admission_locked(self, priority, caller):
+        """Raises QueueFull if too many actions of given priority or from
+        given caller are pending.
+        """
+
+        max_pending = self.max_pending.get(priority, 0)
+        if max_pending > 0 and \
+                self.pending_by_priority.get(priority, 0) >= max_pending:
+            retry_after = self._estimate_wait_locked(priority)
+            raise QueueFull(
+                "Busy, %i actions of priority %i are pending. Retry "
+                "after %i seconds." % (max_pending, priority, retry_after),
+                retry_after
+            )
+
+        if caller is not None and self.max_pending_per_caller > 0 and \
+                self.pending_by_caller.get(caller, 0) >= \
+                self.max_pending_per_caller:
+            retry_after = self._estimate_wait_locked(priority)
+            raise QueueFull(
+                "Busy, %i actions of '%s' are pending. Retry after %i "
+                "seconds." %
+                (self.max_pending_per_caller, caller, retry_after),
+                retry_after
+            )
+
+    def enqueue(self, action, priority=0, caller=None, token=None):
+        """Enqueues action and returns its token. Raises QueueFull if too
+        many actions of given priority or from given caller are pending.
+
+        token is only given when resuming actions that were enqueued before
+        the daemon was restarted. The action gets that token back and isn't
+        subject to the limits, it has been admitted already.
+        """
+
+        action.priority = priority
+        action.caller = caller
 
         with self.actions_lock:
+            if token is None:
+                self._check_admission_locked(priority, caller)
+                token = self._allocate_token_locked()
+
+            else:
+                assert(token not in self.actions)
+                self.last_token = max(self.last_token, token)
+
+            action.token = token
+            action.status = Status.PENDING
             self.actions[action.token] = action
-            self.queue.put((priority, action))
+            self._count_pending_locked(action, 1)
+            self._put(self._get_key(priority), priority, action)
 
         logging.debug("AsyncManager enqueued action '%s' with token %i",
                       action, action.token)
@@ -172,5 +667,47 @@ class AsyncManager(object):
 
         return ret
 
+    def get_action(self, token):
+        with self.actions_lock:
+            return self.actions.get(token)
+
     def cancel(self, token):
-        raise NotImplementedError()
+        """Cancels action with given token. Pending actions are removed right
+        away and will never run. Actions that are being processed are asked
+        to stop, see AsyncAction.interrupt.
+
+        Returns True if the action won't run to completion.
+        """
+
+        with self.actions_lock:
+            action = self.actions.get(token)
+            if action is None:
+                return False
+
+            action.cancelled = True
+            if action.status == Status.PENDING:
+                del self.actions[token]
+                self._count_pending_locked(action, -1)
+
+                if action.lane is not None and action.lane in self.lanes:
+                    waiting = self.lanes[action.lane][1]
+                    for entry in waiting:
+                        if entry[3] is action:
+                            waiting.remove(entry)
+                            break
+
+                # If the action is in the priority queue the worker that gets
+                # it will drop it.
+                logging.info("Cancelled pending action '%s' with token %i.",
+                             action, token)
+                return True
+
+        ret = action.interrupt()
+        if ret:
+            logging.info("Interrupting action '%s' with token %i.",
+                         action, token)
+        else:
+            logging.warning("Action '%s' with token %i can't be interrupted, "
+                            "it will run to completion.", action, token)
+
+        return ret
@@ -0,0 +1,141 @@
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import io
+import time
+import hashlib
+import tempfile
+import threading
+import logging
+
+
+class BlobStore(object):
+    """Content-addressed storage for SCAP content embedded in tasks and specs.
+
+    Every blob is a file named by the sha256 of its contents, placed in
+    a subdirectory named by the first two hex digits of the hash. Identical
+    content embedded in many tasks is only stored once and tasks reference it
+    by hash instead of inlining it in their definition.
+
+    Blobs are never modified once written. Unreferenced blobs are removed by
+    collect_garbage, putting a blob again refreshes its mtime so that blobs
+    that have just been put are never collected.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def is_valid_digest(digest):
+        if len(digest) != 64:
+            return False
+
+        try:
+            int(digest, 16)
+
+        except ValueError:
+            return False
+
+        return digest == digest.lower()
+
+    def get_path(self, digest):
+        if not BlobStore.is_valid_digest(digest):
+            raise ValueError("Invalid blob digest '%s'." % (digest))
+
+        return os.path.join(self.path, digest[:2], digest)
+
+    def __contains__(self, digest):
+        return BlobStore.is_valid_digest(digest) and \
+            os.path.isfile(self.get_path(digest))
+
+    def put(self, contents):
+        """Stores given bytes and returns their sha256 hex digest.
+        """
+
+        digest = hashlib.sha256(contents).hexdigest()
+        path = self.get_path(digest)
+
+        with self.lock:
+            if os.path.isfile(path):
+                os.utime(path, None)
+                return digest
+
+            parent_dir = os.path.dirname(path)
+            if not os.path.isdir(parent_dir):
+                os.makedirs(parent_dir)
+
+            fd, temp_path = tempfile.mkstemp(
+                prefix=".", suffix=".tmp", dir=parent_dir
+            )
+            try:
+                with io.open(fd, "wb") as f:
+                    f.write(contents)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                # oscap runs as root but other tools may read the content
+                os.chmod(temp_path, 0o644)
+                os.rename(temp_path, path)
+
+            except:
+                os.remove(temp_path)
+                raise
+
+        return digest
+
+    def collect_garbage(self, referenced, min_age=60 * 60):
+        """Removes blobs whose digest is not in referenced. Blobs put within
+        the last min_age seconds are kept, they may belong to specs that are
+        about to be evaluated. Returns how many blobs have been removed.
+        """
+
+        threshold = time.time() - min_age
+        removed = 0
+
+        with self.lock:
+            if not os.path.isdir(self.path):
+                return 0
+
+            for subdir in os.listdir(self.path):
+                subdir_path = os.path.join(self.path, subdir)
+                if not os.path.isdir(subdir_path):
+                    continue
+
+                for name in os.listdir(subdir_path):
+                    if name in referenced:
+                        continue
+
+                    path = os.path.join(subdir_path, name)
+                    try:
+                        if os.path.getmtime(path) >= threshold:
+                            continue
+
+                        os.remove(path)
+                        removed += 1
+
+                    except OSError as e:
+                        logging.warning(
+                            "Failed to remove unreferenced blob '%s'. %s",
+                            path, e
+                        )
+
+        return removed
+
+
+__all__ = ["BlobStore"]
@@ -0,0 +1,117 @@
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import threading
+
+
+class ChunkReader(object):
+    """Serves reads of large files in chunks at given offsets, clients
+    don't have to hold the whole file in memory and neither does the daemon.
+
+    Streams are kept open between reads, keyed by what the caller chooses.
+    A read that continues where the previous read of the same key ended
+    doesn't have to reopen the file or skip through it, which is what makes
+    sequential chunked reads of compressed files linear. At most max_streams
+    streams are kept open, the least recently used are closed first.
+    """
+
+    def __init__(self, max_streams=8):
+        self.max_streams = max_streams
+        # key -> (stream, position), least recently used first
+        self.streams = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def _take(self, key):
+        with self.lock:
+            return self.streams.pop(key, None)
+
+    def _put_back(self, key, stream, position):
+        evicted = []
+        with self.lock:
+            old = self.streams.pop(key, None)
+            if old is not None:
+                # another read of the same key ran meanwhile
+                evicted.append(old[0])
+
+            self.streams[key] = (stream, position)
+            while len(self.streams) > self.max_streams:
+                evicted.append(self.streams.popitem(last=False)[1][0])
+
+        for evicted_stream in evicted:
+            evicted_stream.close()
+
+    def read(self, key, opener, offset, length):
+        """Returns up to length bytes of the stream starting at offset.
+        opener is called to open the stream if there isn't one for key
+        already, it has to return a binary file-like object. An empty result
+        means offset is at or past the end of the stream.
+        """
+
+        entry = self._take(key)
+        if entry is not None and entry[1] != offset and \
+           not entry[0].seekable() and entry[1] > offset:
+            # can't go back in the stream
+            entry[0].close()
+            entry = None
+
+        if entry is None:
+            stream, position = opener(), 0
+        else:
+            stream, position = entry
+
+        try:
+            if position != offset:
+                if stream.seekable():
+                    stream.seek(offset)
+                    position = offset
+
+                while position < offset:
+                    skipped = stream.read(min(offset - position, 1024 * 1024))
+                    if not skipped:
+                        break
+                    position += len(skipped)
+
+            data = stream.read(length) if position == offset else b""
+            position += len(data)
+
+        except Exception:
+            stream.close()
+            raise
+
+        if not data:
+            stream.close()
+        else:
+            self._put_back(key, stream, position)
+
+        return data
+
+    def close(self, key_filter=None):
+        """Closes streams whose keys key_filter returns True for, all streams
+        if key_filter is None.
+        """
+
+        closed = []
+        with self.lock:
+            for key in list(self.streams.keys()):
+                if key_filter is None or key_filter(key):
+                    closed.append(self.streams.pop(key)[0])
+
+        for stream in closed:
+            stream.close()
+
+
+__all__ = ["ChunkReader"]
@@ -17,6 +17,8 @@
 # Authors:
 #   Martin Preisler <mpreisle@redhat.com>
 
+import os
+import sys
 import subprocess
 
 
@@ -45,4 +47,12 @@ if hasattr(subprocess, "check_output"):
     # if available we just use the real function
     subprocess_check_output = subprocess.check_output
 
-__all__ = ["subprocess_check_output"]
+# Popen keyword arguments that start the child in its own session and process
+# group. preexec_fn runs Python code between fork and exec which may deadlock
+# in a threaded process, it's only used where start_new_session is missing.
+if sys.version_info >= (3, 2):
+    new_session_popen_kwargs = {"start_new_session": True}
+else:
+    new_session_popen_kwargs = {"preexec_fn": os.setsid}
+
+__all__ = ["subprocess_check_output", "new_session_popen_kwargs"]
@@ -0,0 +1,216 @@
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import io
+import errno
+import gzip
+import shutil
+import tempfile
+import contextlib
+import logging
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+METHODS = ["none", "gzip", "xz", "zstd"]
+
+_EXTENSIONS = {
+    "gzip": ".gz",
+    "xz": ".xz",
+    "zstd": ".zst"
+}
+
+# files of a result that are worth compressing, exit_code is tiny and read
+# all the time
+RESULT_FILES = ["results.xml", "results-stig.xml", "stdout", "stderr"]
+
+
+def is_available(method):
+    """Returns True if the modules needed to compress and decompress using
+    given method can be imported.
+    """
+
+    if method == "xz":
+        return lzma is not None
+    if method == "zstd":
+        return zstandard is not None
+
+    return method in METHODS
+
+
+def find(path):
+    """Returns (actual_path, method) of the file stored under path, either
+    uncompressed or with the extension of one of the compression methods.
+    Raises IOError if no such file exists.
+    """
+
+    if os.path.exists(path):
+        return path, "none"
+
+    for method in METHODS[1:]:
+        compressed_path = path + _EXTENSIONS[method]
+        if os.path.exists(compressed_path):
+            return compressed_path, method
+
+    raise IOError(errno.ENOENT, "No such file, compressed or not", path)
+
+
+def exists(path):
+    try:
+        find(path)
+        return True
+    except IOError:
+        return False
+
+
+def open_file(path):
+    """Opens the file stored under path for reading in binary mode,
+    decompressing it on the fly if needed.
+    """
+
+    actual_path, method = find(path)
+    if method == "gzip":
+        return gzip.open(actual_path, "rb")
+
+    if not is_available(method):
+        raise RuntimeError(
+            "Can't decompress '%s', support for '%s' is not available." %
+            (actual_path, method)
+        )
+
+    if method == "xz":
+        return lzma.open(actual_path, "rb")
+    if method == "zstd":
+        return zstandard.ZstdDecompressor().stream_reader(
+            io.open(actual_path, "rb"), closefd=True
+        )
+
+    return io.open(actual_path, "rb")
+
+
+def read_text(path):
+    """Reads the whole file stored under path as UTF-8 text.
+    """
+
+    with open_file(path) as f:
+        return f.read().decode("utf-8")
+
+
+def _compress_stream(source, target, method):
+    if method == "gzip":
+        with gzip.GzipFile(fileobj=target, mode="wb") as f:
+            shutil.copyfileobj(source, f, 1024 * 1024)
+
+    elif method == "xz":
+        with lzma.LZMAFile(target, "wb") as f:
+            shutil.copyfileobj(source, f, 1024 * 1024)
+
+    elif method == "zstd":
+        zstandard.ZstdCompressor().copy_stream(source, target)
+
+
+def compress_file(path, method):
+    """Replaces the file at path with its compressed version, path with
+    the extension of the method appended. The original is only removed once
+    the compressed file is complete. Returns the path of the file.
+    """
+
+    if method == "none":
+        return path
+
+    if not is_available(method):
+        raise RuntimeError(
+            "Can't compress '%s', support for '%s' is not available." %
+            (path, method)
+        )
+
+    target_path = path + _EXTENSIONS[method]
+    temp_path = target_path + ".tmp"
+    try:
+        with io.open(path, "rb") as source:
+            with io.open(temp_path, "wb") as target:
+                _compress_stream(source, target, method)
+
+        shutil.copymode(path, temp_path)
+        os.rename(temp_path, target_path)
+
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    os.remove(path)
+    return target_path
+
+
+def compress_result(result_dir, method):
+    """Compresses the large files of a result stored in result_dir.
+    """
+
+    if method == "none":
+        return
+
+    for name in RESULT_FILES:
+        path = os.path.join(result_dir, name)
+        if os.path.exists(path):
+            compress_file(path, method)
+
+    logging.debug("Compressed result '%s' using %s.", result_dir, method)
+
+
+@contextlib.contextmanager
+def uncompressed_path(path, temp_dir):
+    """Yields a path of the file stored under path that tools like oscap can
+    read. Compressed files are decompressed into a temporary file in
+    temp_dir, which is removed afterwards. Uncompressed files are used as
+    they are.
+    """
+
+    actual_path, method = find(path)
+    if method == "none":
+        yield actual_path
+        return
+
+    fd, temp_path = tempfile.mkstemp(
+        prefix=os.path.basename(path) + ".", dir=temp_dir
+    )
+    try:
+        with io.open(fd, "wb") as target:
+            with open_file(path) as source:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+
+        yield temp_path
+
+    finally:
+        os.remove(temp_path)
+
+
+__all__ = ["METHODS", "RESULT_FILES", "is_available", "find", "exists",
+           "open_file", "read_text", "compress_file", "compress_result",
+           "uncompressed_path"]
@@ -30,6 +30,7 @@ import shutil
 import inspect
 
 from openscap_daemon import cve_feed_manager
+from openscap_daemon import compression
 
 
 class Configuration(object):
@@ -43,9 +44,63 @@ class Configuration(object):
             os.path.join("/", "var", "lib", "oscapd", "work_in_progress")
         self.cve_feeds_dir = \
             os.path.join("/", "var", "lib", "oscapd", "cve_feeds")
+        # SCAP content embedded in tasks and specs, stored by its sha256
+        self.blobs_dir = os.path.join("/", "var", "lib", "oscapd", "blobs")
+        # 0 means one job per CPU
         self.jobs = 4
+        # adjust the number of jobs between min_jobs and max_jobs depending
+        # on host load
+        self.adaptive_jobs = False
+        self.min_jobs = 1
+        # 0 means one job per CPU
+        self.max_jobs = 0
+        # 0 means jobs are started as soon as there is a free slot
+        self.max_jobs_per_second = 0
         # -2 means never prune old results
         self.max_results_to_keep = -2
+        # results.xml, stdout and stderr of new results are compressed
+        # using this method, one of compression.METHODS
+        self.results_compression = "none"
+        # runs of repeated tasks are spread over this many minutes, tasks can
+        # override it, 0 means run exactly at not_before
+        self.schedule_spread = 0
+        # how many missed runs of a no_slip task are run after downtime,
+        # tasks can override it, -2 means run all of them
+        self.max_catch_up_runs = -2
+        # how many catch-up runs may be evaluated at the same time,
+        # 0 means no limit
+        self.catch_up_jobs = 1
+        # evaluations are not started while the load average per CPU or the
+        # memory pressure in percent are higher, 0 means don't check
+        self.dispatch_max_load = 0.0
+        self.dispatch_max_memory_pressure = 0.0
+        # evaluations are not started unless the available memory covers
+        # their learned memory footprint plus dispatch_min_free_memory bytes
+        self.dispatch_check_memory = False
+        self.dispatch_min_free_memory = 0
+        # tasks with equivalent evaluation specs that are due at the same
+        # time share one evaluation
+        self.coalesce_evaluations = True
+        # how many evaluations requested by clients can wait in the queue,
+        # 0 means no limit
+        self.max_pending_evaluations = 256
+        # how many of them can come from one client, 0 means no limit
+        self.max_pending_evaluations_per_caller = 64
+        # seconds changes of tasks are collected before the task definition
+        # is written, 0 writes every change right away
+        self.task_save_delay = 2.0
+        # pick up task definitions added, changed or removed in tasks_dir
+        # while the daemon is running
+        self.watch_tasks_dir = True
+        # how often tasks_dir is checked if inotify is not available,
+        # in seconds
+        self.tasks_dir_poll_interval = 30.0
+        # results of async evaluations waiting to be collected, in bytes
+        self.async_results_memory_budget = 64 * 1024 * 1024
+        # larger results are always kept on disk, in bytes
+        self.async_results_spill_threshold = 1024 * 1024
+        # uncollected results are thrown away after this many seconds
+        self.async_results_ttl = 24 * 60 * 60
 
         # Tools section
         self.oscap_path = ""
@@ -228,16 +283,146 @@ class Configuration(object):
         except (configparser.NoOptionError, configparser.NoSectionError):
             pass
 
+        try:
+            self.blobs_dir = absolutize(config.get("General", "blobs-dir"))
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            pass
+
         try:
             self.jobs = config.getint("General", "jobs")
         except (configparser.NoOptionError, configparser.NoSectionError):
             pass
 
+        try:
+            self.adaptive_jobs = config.get("General", "adaptive-jobs") not in \
+                ["no", "0", "false", "False"]
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            pass
+
+        try:
+            self.min_jobs = config.getint("General", "min-jobs")
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            pass
+
+        try:
+            self.max_jobs = config.getint("General", "max-jobs")
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            pass
+
+        try:
+            self.max_jobs_per_second = \
+                config.getfloat("General", "max-jobs-per-second")
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            pass
+
         try:
             self.max_results_to_keep = config.getint("General", "max-results-to-keep")
         except (configparser.NoOptionError, configparser.NoSectionError):
             pass
 
+        try:
+            self.results_compression = \
+                config.get("General", "results-compression")
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            pass
+
+        try:
+            self.schedule_spread = config.getint("General", "schedule-spread")
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            pass
+
+        try:
+            self.max_catch_up_runs = \
+                config.getint("General", "max-catch-up-runs")
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            pass
+
+        try:
+            self.catch_up_jobs = config.getint("General", "catch-up-jobs")
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            pass
+
+        try:
+            self.dispatch_max_load = \
+                config.getfloat("General", "dispatch-max-load")
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            pass
+
+        try:
+            self.dispatch_max_memory_pressure = \
+                config.getfloat("General", "dispatch-max-memory-pressure")
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            pass
+
+        try:
+            self.dispatch_check_memory = \
+                config.get("General", "dispatch-check-memory") not in \
+                ["no", "0", "false", "False"]
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            pass
+
+        try:
+            self.dispatch_min_free_memory = \
+                config.getint("General", "dispatch-min-free-memory")
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            pass
+
+        try:
+            self.coalesce_evaluations = \
+                config.get("General", "coalesce-evaluations") not in \
+                ["no", "0", "false", "False"]
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            pass
+
+        try:
+            self.max_pending_evaluations = \
+                config.getint("General", "max-pending-evaluations")
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            pass
+
+        try:
+            self.max_pending_evaluations_per_caller = \
+                config.getint("General", "max-pending-evaluations-per-caller")
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            pass
+
+        try:
+            self.task_save_delay = \
+                config.getfloat("General", "task-save-delay")
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            pass
+
+        try:
+            self.watch_tasks_dir = \
+                config.get("General", "watch-tasks-dir") not in \
+                ["no", "0", "false", "False"]
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            pass
+
+        try:
+            self.tasks_dir_poll_interval = \
+                config.getfloat("General", "tasks-dir-poll-interval")
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            pass
+
+        try:
+            self.async_results_memory_budget = \
+                config.getint("General", "async-results-memory-budget")
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            pass
+
+        try:
+            self.async_results_spill_threshold = \
+                config.getint("General", "async-results-spill-threshold")
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            pass
+
+        try:
+            self.async_results_ttl = \
+                config.getint("General", "async-results-ttl")
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            pass
+
         # Tools section
         try:
             self.oscap_path = absolutize(config.get("Tools", "oscap"))
@@ -331,8 +516,44 @@ class Configuration(object):
         config.set("General", "results-dir", str(self.results_dir))
         config.set("General", "work-in-progress-dir", str(self.work_in_progress_dir))
         config.set("General", "cve-feeds-dir", str(self.cve_feeds_dir))
+        config.set("General", "blobs-dir", str(self.blobs_dir))
         config.set("General", "jobs", str(self.jobs))
+        config.set("General", "adaptive-jobs",
+                   "yes" if self.adaptive_jobs else "no")
+        config.set("General", "min-jobs", str(self.min_jobs))
+        config.set("General", "max-jobs", str(self.max_jobs))
+        config.set("General", "max-jobs-per-second",
+                   str(self.max_jobs_per_second))
         config.set("General", "max-results-to-keep", str(self.max_results_to_keep))
+        config.set("General", "results-compression",
+                   str(self.results_compression))
+        config.set("General", "schedule-spread", str(self.schedule_spread))
+        config.set("General", "max-catch-up-runs", str(self.max_catch_up_runs))
+        config.set("General", "catch-up-jobs", str(self.catch_up_jobs))
+        config.set("General", "dispatch-max-load",
+                   str(self.dispatch_max_load))
+        config.set("General", "dispatch-max-memory-pressure",
+                   str(self.dispatch_max_memory_pressure))
+        config.set("General", "dispatch-check-memory",
+                   "yes" if self.dispatch_check_memory else "no")
+        config.set("General", "dispatch-min-free-memory",
+                   str(self.dispatch_min_free_memory))
+        config.set("General", "coalesce-evaluations",
+                   "yes" if self.coalesce_evaluations else "no")
+        config.set("General", "max-pending-evaluations",
+                   str(self.max_pending_evaluations))
+        config.set("General", "max-pending-evaluations-per-caller",
+                   str(self.max_pending_evaluations_per_caller))
+        config.set("General", "task-save-delay", str(self.task_save_delay))
+        config.set("General", "watch-tasks-dir",
+                   "yes" if self.watch_tasks_dir else "no")
+        config.set("General", "tasks-dir-poll-interval",
+                   str(self.tasks_dir_poll_interval))
+        config.set("General", "async-results-memory-budget",
+                   str(self.async_results_memory_budget))
+        config.set("General", "async-results-spill-threshold",
+                   str(self.async_results_spill_threshold))
+        config.set("General", "async-results-ttl", str(self.async_results_ttl))
 
         config.add_section("Tools")
         config.set("Tools", "oscap", str(self.oscap_path))
@@ -402,9 +623,20 @@ class Configuration(object):
             )
             os.makedirs(self.cve_feeds_dir)
 
+        if not os.path.exists(self.blobs_dir):
+            logging.info(
+                "Creating blobs directory at '%s' because it didn't exist.",
+                self.blobs_dir
+            )
+            os.makedirs(self.blobs_dir, 0o750)
+
         if cleanup_allowed:
             for dir_ in os.listdir(self.work_in_progress_dir):
                 full_path = os.path.join(self.work_in_progress_dir, dir_)
+                if dir_ in ["journal", "tasks.index"]:
+                    # the journal of unfinished work and the task index,
+                    # see System
+                    continue
 
                 logging.info(
                     "Found '%s' in work_in_progress results directory, full "
@@ -413,7 +645,10 @@ class Configuration(object):
                 )
 
                 try:
-                    shutil.rmtree(full_path)
+                    if os.path.isdir(full_path):
+                        shutil.rmtree(full_path)
+                    else:
+                        os.remove(full_path)
 
                 except OSError as e:
                     if e.errno == 13:  # permission denied
@@ -462,10 +697,102 @@ class Configuration(object):
                          "work-in-progress-dir")
         sanity_check_dir(self.cve_feeds_dir,
                          "CVE feeds storage", "cve-feeds-dir")
+        sanity_check_dir(self.blobs_dir,
+                         "Embedded SCAP content storage", "blobs-dir")
+
+        if self.jobs < 0:
+            raise RuntimeError(
+                "Invalid number of jobs %i (config file entry: jobs)." %
+                (self.jobs)
+            )
+
+        if self.adaptive_jobs and \
+           (self.min_jobs < 1 or
+            (self.max_jobs != 0 and self.max_jobs < self.min_jobs)):
+            raise RuntimeError(
+                "Invalid adaptive jobs range %i - %i (config file entries: "
+                "min-jobs, max-jobs)." % (self.min_jobs, self.max_jobs)
+            )
 
-        # self.jobs
         # self.max_results_to_keep
 
+        if self.results_compression not in compression.METHODS:
+            raise RuntimeError(
+                "Invalid results compression method '%s', expected one of "
+                "%s (config file entry: results-compression)." %
+                (self.results_compression, ", ".join(compression.METHODS))
+            )
+
+        if not compression.is_available(self.results_compression):
+            raise RuntimeError(
+                "Results compression method '%s' is not available, the "
+                "Python module it needs can't be imported (config file "
+                "entry: results-compression)." % (self.results_compression)
+            )
+
+        if self.dispatch_max_load < 0 or \
+           self.dispatch_max_memory_pressure < 0 or \
+           self.dispatch_min_free_memory < 0:
+            raise RuntimeError(
+                "Invalid dispatch thresholds, load %f, memory pressure %f, "
+                "free memory %i (config file entries: dispatch-max-load, "
+                "dispatch-max-memory-pressure, dispatch-min-free-memory)." %
+                (self.dispatch_max_load, self.dispatch_max_memory_pressure,
+                 self.dispatch_min_free_memory)
+            )
+
+        if self.max_pending_evaluations < 0 or \
+           self.max_pending_evaluations_per_caller < 0:
+            raise RuntimeError(
+                "Invalid pending evaluations limits %i, %i (config file "
+                "entries: max-pending-evaluations, "
+                "max-pending-evaluations-per-caller)." %
+                (self.max_pending_evaluations,
+                 self.max_pending_evaluations_per_caller)
+            )
+
+        if self.task_save_delay < 0:
+            raise RuntimeError(
+                "Invalid task save delay %f (config file entry: "
+                "task-save-delay)." % (self.task_save_delay)
+            )
+
+        if self.async_results_memory_budget < 0 or \
+           self.async_results_spill_threshold < 0 or \
+           self.async_results_ttl < 0:
+            raise RuntimeError(
+                "Invalid async results limits, memory budget %i, spill "
+                "threshold %i, TTL %i (config file entries: "
+                "async-results-memory-budget, async-results-spill-threshold, "
+                "async-results-ttl)." %
+                (self.async_results_memory_budget,
+                 self.async_results_spill_threshold, self.async_results_ttl)
+            )
+
+        if self.tasks_dir_poll_interval <= 0:
+            raise RuntimeError(
+                "Invalid tasks dir poll interval %f (config file entry: "
+                "tasks-dir-poll-interval)." % (self.tasks_dir_poll_interval)
+            )
+
+        if self.schedule_spread < 0:
+            raise RuntimeError(
+                "Invalid schedule spread %i minutes (config file entry: "
+                "schedule-spread)." % (self.schedule_spread)
+            )
+
+        if self.max_catch_up_runs < 0 and self.max_catch_up_runs != -2:
+            raise RuntimeError(
+                "Invalid number of catch-up runs %i (config file entry: "
+                "max-catch-up-runs)." % (self.max_catch_up_runs)
+            )
+
+        if self.catch_up_jobs < 0:
+            raise RuntimeError(
+                "Invalid number of catch-up jobs %i (config file entry: "
+                "catch-up-jobs)." % (self.catch_up_jobs)
+            )
+
         # self.oscap_path = ""
         # self.oscap_ssh_path = ""
         # self.oscap_vm_path = ""
@@ -0,0 +1,175 @@
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import io
+import hashlib
+import threading
+import collections
+
+
+class LRUCache(object):
+    """Keeps the most recently used values, bounded by the number of entries
+    and optionally by the total size of the values. Thread-safe.
+    """
+
+    def __init__(self, max_entries, max_size=0):
+        self.max_entries = max_entries
+        # 0 means no limit
+        self.max_size = max_size
+
+        # key -> (value, size), least recently used first
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return default
+
+            # move to the most recently used end
+            self.entries[key] = entry
+            return entry[0]
+
+    def put(self, key, value, size=0):
+        """Stores value under key. Values larger than max_size are not
+        stored at all.
+        """
+
+        with self.lock:
+            old_entry = self.entries.pop(key, None)
+            if old_entry is not None:
+                self.size -= old_entry[1]
+
+            if self.max_size > 0 and size > self.max_size:
+                return
+
+            self.entries[key] = (value, size)
+            self.size += size
+
+            while len(self.entries) > self.max_entries or \
+                    (self.max_size > 0 and self.size > self.max_size):
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def remove(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+class SingleFlight(object):
+    """Makes sure an expensive computation runs at most once at a time for
+    each key. Callers asking for a key that is being computed wait for
+    the running computation and get its result, or its exception.
+    """
+
+    class _Call(object):
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        # key -> _Call
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, function):
+        """Returns what function() returns. If another thread is running
+        do() with the same key already, waits for it instead.
+        """
+
+        with self.lock:
+            call = self.calls.get(key)
+            running = call is not None
+            if not running:
+                call = SingleFlight._Call()
+                self.calls[key] = call
+
+        if running:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+
+            return call.result
+
+        try:
+            call.result = function()
+
+        except Exception as e:
+            call.error = e
+            raise
+
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+        return call.result
+
+
+def _compute_file_digest(path):
+    ret = hashlib.sha256()
+    with io.open(path, "rb") as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+
+            ret.update(chunk)
+
+    return ret.hexdigest()
+
+
+# path -> (inode, mtime, size, sha256)
+_file_digests = LRUCache(4096)
+
+
+def get_file_digest(path):
+    """Returns sha256 hex digest of the file at given path. Digests are
+    cached, they are only computed again if the inode, mtime or size of the
+    file change. Raises OSError or IOError if the file can't be read.
+    """
+
+    stat = os.stat(path)
+    entry = _file_digests.get(path)
+    if entry is not None and \
+       entry[:3] == (stat.st_ino, stat.st_mtime, stat.st_size):
+        return entry[3]
+
+    digest = _compute_file_digest(path)
+    _file_digests.put(path, (stat.st_ino, stat.st_mtime, stat.st_size, digest))
+    return digest
+
+
+__all__ = ["LRUCache", "SingleFlight", "get_file_digest"]
@@ -0,0 +1,91 @@
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import io
+import tempfile
+import threading
+import logging
+
+
+class PersistentCounter(object):
+    """Monotonic counter stored in a file, hands out IDs in O(1).
+
+    The new value is written and fsynced before it is handed out. A crash
+    can leave a gap in the IDs but never hands out the same ID twice. If
+    the file is missing or unreadable, recover is called to find the highest
+    ID in use from what is on disk.
+    """
+
+    def __init__(self, path, recover):
+        self.path = path
+        self.recover = recover
+        # None until the file has been read
+        self.last = None
+        self.lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with io.open(self.path, "r", encoding="utf-8") as f:
+                return int(f.read().strip())
+
+        except (IOError, OSError, ValueError):
+            ret = self.recover()
+            if os.path.exists(self.path):
+                logging.warning(
+                    "Counter '%s' is corrupted, recovered last ID %i from "
+                    "disk.", self.path, ret
+                )
+            return ret
+
+    def _store(self, value):
+        dir_ = os.path.dirname(self.path)
+        fd, temp_path = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=dir_)
+        try:
+            with io.open(fd, "w", encoding="utf-8") as f:
+                f.write(u"%i\n" % (value))
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.rename(temp_path, self.path)
+
+        except:
+            os.remove(temp_path)
+            raise
+
+    def allocate(self, minimum=0):
+        """Returns the next ID, never lower than minimum + 1.
+        """
+
+        with self.lock:
+            if self.last is None:
+                self.last = self._load()
+
+            ret = max(self.last, minimum) + 1
+            self._store(ret)
+            self.last = ret
+            return ret
+
+    def get_last(self):
+        with self.lock:
+            if self.last is None:
+                self.last = self._load()
+
+            return self.last
+
+
+__all__ = ["PersistentCounter"]
@@ -22,10 +22,12 @@ from openscap_daemon import dbus_utils
 from openscap_daemon.cve_scanner.cve_scanner import Worker
 from openscap_daemon import version
 from openscap_daemon.system import ResultsNotAvailable
+from openscap_daemon.async_tools import QueueFull
 
 import dbus
 import dbus.service
 import threading
+import os
 from datetime import datetime
 import json
 
@@ -35,12 +37,24 @@ import json
 # "2^63-1 IDs should be enough for everyone."
 
 
+class BusyException(dbus.DBusException):
+    """Too many evaluations are pending, the message says after how many
+    seconds the caller should retry.
+    """
+
+    _dbus_error_name = dbus_utils.DBUS_INTERFACE + ".Busy"
+
+
 class OpenSCAPDaemonDbus(dbus.service.Object):
     def __init__(self, bus, system_instance):
         super(OpenSCAPDaemonDbus, self).__init__(bus, dbus_utils.OBJECT_PATH)
 
         self.system = system_instance
         self.system.load_tasks()
+        self.system.resume_journal()
+        self.system.collect_blobs()
+        if self.system.config.watch_tasks_dir:
+            self.system.watch_tasks_dir()
 
         self.system_worker_thread = threading.Thread(
             target=lambda: self.system.schedule_tasks_worker()
@@ -83,6 +97,26 @@ class OpenSCAPDaemonDbus(dbus.service.Object):
     def GetAsyncActionsStatus(self):
         return self.system.async_manager.get_status()
 
+    @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE,
+                         in_signature="", out_signature="x")
+    def GetAsyncWorkers(self):
+        """Retrieves how many async actions (evaluations, task updates, ...)
+        can run in parallel.
+        """
+        return self.system.get_async_workers()
+
+    @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE,
+                         in_signature="x", out_signature="")
+    def SetAsyncWorkers(self, workers):
+        """Sets how many async actions can run in parallel, 0 means one per
+        CPU. Actions that are already running are not interrupted. Disables
+        the adaptive worker count if it was enabled in the config file.
+
+        The change is not persistent, the daemon uses the config file value
+        after restart.
+        """
+        return self.system.set_async_workers(workers)
+
     @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE,
                          in_signature="s", out_signature="(sssn)")
     def EvaluateSpecXML(self, xml_source):
@@ -91,15 +125,28 @@ class OpenSCAPDaemonDbus(dbus.service.Object):
 
         spec = EvaluationSpec()
         spec.load_from_xml_source(xml_source)
-        arf, stdout, stderr, exit_code = spec.evaluate(self.system.config)
+        arf, stdout, stderr, exit_code = self.system.evaluate_spec(spec)
         return (arf, stdout, stderr, exit_code)
 
     @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE,
-                         in_signature="s", out_signature="n")
-    def EvaluateSpecXMLAsync(self, xml_source):
+                         in_signature="s", out_signature="n",
+                         sender_keyword="sender")
+    def EvaluateSpecXMLAsync(self, xml_source, sender=None):
+        """Enqueues evaluation of given spec and returns a token to collect
+        the results with.
+
+        Fails with org.OpenSCAP.daemon.Interface.Busy if too many evaluations
+        are pending, the error message says when to retry.
+        """
+
         spec = EvaluationSpec()
         spec.load_from_xml_source(xml_source)
-        token = self.system.evaluate_spec_async(spec)
+        try:
+            token = self.system.evaluate_spec_async(spec, sender)
+
+        except QueueFull as e:
+            raise BusyException(str(e))
+
         return token
 
     @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE,
@@ -116,8 +163,10 @@ class OpenSCAPDaemonDbus(dbus.service.Object):
     @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE,
                          in_signature="n", out_signature="")
     def CancelEvaluateSpecXMLAsync(self, token):
-        # TODO
-        pass
+        """Cancels evaluation started by EvaluateSpecXMLAsync. A running
+        oscap process is terminated.
+        """
+        self.system.cancel_evaluate_spec_async(token)
 
     @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE,
                          in_signature="", out_signature="ax")
@@ -132,7 +181,8 @@ class OpenSCAPDaemonDbus(dbus.service.Object):
     def SetTaskTitle(self, task_id, title):
         """Set title of existing task with given ID.
 
-        The change is persistent after the function returns.
+        The change is persistent at most task-save-delay seconds after the
+        function returns.
         """
         return self.system.set_task_title(task_id, title)
 
@@ -143,6 +193,28 @@ class OpenSCAPDaemonDbus(dbus.service.Object):
         """
         return self.system.get_task_title(task_id)
 
+    @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE,
+                         in_signature="xas", out_signature="")
+    def SetTaskPostEvaluation(self, task_id, artifacts):
+        """Set which artifacts of new results of given task are generated
+        in the background right after evaluation. Any of "report", "summary",
+        "bash_fix", "ansible_fix" and "puppet_fix".
+
+        The change is persistent at most task-save-delay seconds after the
+        function returns.
+        """
+        return self.system.set_task_post_evaluation(
+            task_id, [str(artifact) for artifact in artifacts]
+        )
+
+    @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE,
+                         in_signature="x", out_signature="as")
+    def GetTaskPostEvaluation(self, task_id):
+        """Retrieves which artifacts of new results of given task are
+        generated right after evaluation.
+        """
+        return self.system.get_task_post_evaluation(task_id)
+
     @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE,
                          in_signature="x", out_signature="s")
     def GenerateGuideForTask(self, task_id):
@@ -183,7 +255,8 @@ class OpenSCAPDaemonDbus(dbus.service.Object):
         """Removes task with given ID and deletes its config file. The task has
         to be disabled, else the operation fails.
 
-        The change is persistent after the function returns.
+        The change is persistent at most task-save-delay seconds after the
+        function returns.
         """
         return self.system.remove_task(task_id, remove_results)
 
@@ -192,7 +265,8 @@ class OpenSCAPDaemonDbus(dbus.service.Object):
     def SetTaskEnabled(self, task_id, enabled):
         """Sets enabled flag of an existing task with given ID.
 
-        The change is persistent after the function returns.
+        The change is persistent at most task-save-delay seconds after the
+        function returns.
         """
         return self.system.set_task_enabled(task_id, enabled)
 
@@ -208,7 +282,8 @@ class OpenSCAPDaemonDbus(dbus.service.Object):
     def SetTaskTarget(self, task_id, target):
         """Set target of existing task with given ID.
 
-        The change is persistent after the function returns.
+        The change is persistent at most task-save-delay seconds after the
+        function returns.
         """
         return self.system.set_task_target(task_id, target)
 
@@ -241,7 +316,8 @@ class OpenSCAPDaemonDbus(dbus.service.Object):
         input can be absolute file path or the XML source itself, this is
         is autodetected.
 
-        The change is persistent after the function returns.
+        The change is persistent at most task-save-delay seconds after the
+        function returns.
         """
         return self.system.set_task_input(
             task_id, input_ if input_ != "" else None
@@ -255,7 +331,8 @@ class OpenSCAPDaemonDbus(dbus.service.Object):
         tailoring can be absolute file path or the XML source itself, this is
         is autodetected.
 
-        The change is persistent after the function returns.
+        The change is persistent at most task-save-delay seconds after the
+        function returns.
         """
         return self.system.set_task_tailoring(
             task_id, tailoring if tailoring != "" else None
@@ -266,7 +343,8 @@ class OpenSCAPDaemonDbus(dbus.service.Object):
     def SetTaskProfileID(self, task_id, profile_id):
         """Set profile ID of existing task with given ID.
 
-        The change is persistent after the function returns.
+        The change is persistent at most task-save-delay seconds after the
+        function returns.
         """
         return self.system.set_task_profile_id(task_id, profile_id)
 
@@ -276,7 +354,8 @@ class OpenSCAPDaemonDbus(dbus.service.Object):
         """Sets whether online remediation of existing task with given ID
         is enabled.
 
-        The change is persistent after the function returns.
+        The change is persistent at most task-save-delay seconds after the
+        function returns.
         """
         return self.system.set_task_online_remediation(
             task_id, online_remediation
@@ -289,7 +368,8 @@ class OpenSCAPDaemonDbus(dbus.service.Object):
         as a string in format YYYY-MM-DDTHH:MM in UTC with no timezone info!
         Example: 2015-05-14T13:49
 
-        The change is persistent after the function returns.
+        The change is persistent at most task-save-delay seconds after the
+        function returns.
         """
         schedule_not_before = datetime.strptime(
             schedule_not_before_str,
@@ -307,13 +387,63 @@ class OpenSCAPDaemonDbus(dbus.service.Object):
 
         For example 24 for daily tasks, 24*7 for weekly tasks, ...
 
-        The change is persistent after the function returns.
+        The change is persistent at most task-save-delay seconds after the
+        function returns.
         """
 
         return self.system.set_task_schedule_repeat_after(
             task_id, schedule_repeat_after
         )
 
+    @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE,
+                         in_signature="xx", out_signature="")
+    def SetTaskScheduleSpread(self, task_id, schedule_spread):
+        """Sets number of minutes over which runs of repeated tasks are
+        spread. Each task gets its own offset within this window, tasks with
+        the same schedule then don't all run at the same time.
+
+        -1 means use the default from config, 0 disables spreading.
+
+        The change is persistent at most task-save-delay seconds after the
+        function returns.
+        """
+
+        return self.system.set_task_schedule_spread(task_id, schedule_spread)
+
+    @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE,
+                         in_signature="x", out_signature="x")
+    def GetTaskScheduleSpread(self, task_id):
+        """Retrieves number of minutes over which runs of given task are
+        spread, -1 means the default from config is used.
+        """
+
+        return self.system.get_task_schedule_spread(task_id)
+
+    @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE,
+                         in_signature="xx", out_signature="")
+    def SetTaskScheduleMaxCatchUp(self, task_id, max_catch_up):
+        """Sets how many missed runs of a no_slip task are evaluated after
+        the daemon has been down. Older missed runs are skipped.
+
+        -1 means use the default from config, -2 means run all missed runs.
+
+        The change is persistent at most task-save-delay seconds after the
+        function returns.
+        """
+
+        return self.system.set_task_schedule_max_catch_up(
+            task_id, max_catch_up
+        )
+
+    @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE,
+                         in_signature="x", out_signature="x")
+    def GetTaskScheduleMaxCatchUp(self, task_id):
+        """Retrieves how many missed runs of given task are evaluated after
+        the daemon has been down, -1 means the default from config is used.
+        """
+
+        return self.system.get_task_schedule_max_catch_up(task_id)
+
     @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE,
                          in_signature="x", out_signature="ax")
     def GetTaskResultIDs(self, task_id):
@@ -321,6 +451,34 @@ class OpenSCAPDaemonDbus(dbus.service.Object):
         """
         return self.system.get_task_result_ids(task_id)
 
+    @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE,
+                         in_signature="x", out_signature="a(xxixxxx)")
+    def GetTaskResultsMetadata(self, task_id):
+        """Retrieves metadata of all task results in one call, newest first.
+        Each item is (result ID, created timestamp, exit code, duration in
+        seconds, number of passed rules, number of failed rules, total size
+        in bytes). -1 means the value is not known.
+        """
+
+        ret = []
+        for result_id, metadata in \
+                self.system.get_task_results_metadata(task_id):
+            duration = metadata.get("duration")
+            rule_results = metadata.get("rule_results")
+            ret.append((
+                int(result_id),
+                int(metadata["created"]),
+                metadata["exit_code"],
+                int(duration) if duration is not None else -1,
+                rule_results.get("pass", 0)
+                if rule_results is not None else -1,
+                rule_results.get("fail", 0)
+                if rule_results is not None else -1,
+                metadata["size"]
+            ))
+
+        return ret
+
     @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE,
                          in_signature="xx", out_signature="x")
     def GetResultCreatedTimestamp(self, task_id, result_id):
@@ -347,6 +505,35 @@ class OpenSCAPDaemonDbus(dbus.service.Object):
         """
         return self.system.get_xml_of_task_result(task_id, result_id)
 
+    @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE,
+                         in_signature="xxxx", out_signature="ay")
+    def GetXMLOfTaskResultChunk(self, task_id, result_id, offset, length):
+        """Retrieves up to length bytes of XML of result of given task
+        starting at offset, at most 16 MiB at once. An empty array means
+        offset is past the end of the XML.
+
+        Unlike GetXMLOfTaskResult this works for XMLs of any size, reading
+        them chunk after chunk from the start is cheap.
+        """
+        return dbus.ByteArray(
+            self.system.read_xml_of_task_result(
+                task_id, result_id, offset, length
+            )
+        )
+
+    @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE,
+                         in_signature="xx", out_signature="h")
+    def OpenXMLOfTaskResult(self, task_id, result_id):
+        """Returns a file descriptor the XML of result of given task can be
+        read from. Needs a bus that supports passing file descriptors.
+        """
+        fd = self.system.open_xml_of_task_result(task_id, result_id)
+        try:
+            # UnixFd keeps its own duplicate of the descriptor
+            return dbus.types.UnixFd(fd)
+        finally:
+            os.close(fd)
+
     @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE,
                          in_signature="x", out_signature="")
     def RemoveTaskResults(self, task_id):
@@ -396,6 +583,14 @@ class OpenSCAPDaemonDbus(dbus.service.Object):
         """
         return self.system.generate_fix_for_task_result(task_id, result_id, fix_type)
 
+    @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE,
+                         in_signature="xx", out_signature="s")
+    def GenerateSummaryForTaskResult(self, task_id, result_id):
+        """Generates and returns JSON summary of result of given task, its
+        exit code and the result of every rule.
+        """
+        return self.system.generate_summary_for_task_result(task_id, result_id)
+
     @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE, in_signature='s',
                          out_signature='s')
     def inspect_container(self, cid):
@@ -519,14 +714,26 @@ class OpenSCAPDaemonDbus(dbus.service.Object):
         return json.dumps(return_json)
 
     @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE,
-                         in_signature='asiy', out_signature='n')
-    def CVEScanListAsync(self, scan_list, number, fetch_cve):
+                         in_signature='asiy', out_signature='n',
+                         sender_keyword="sender")
+    def CVEScanListAsync(self, scan_list, number, fetch_cve, sender=None):
+        """Enqueues a CVE scan and returns a token to collect the results
+        with. Fails with org.OpenSCAP.daemon.Interface.Busy if too many
+        evaluations are pending, see EvaluateSpecXMLAsync.
+        """
+
         worker = Worker(
             scan=scan_list, number=number,
             fetch_cve=self._parse_only_cache(self.system.config, int(fetch_cve)),
             fetch_cve_url=self.system.config.fetch_cve_url
         )
-        return self.system.evaluate_cve_scanner_worker_async(worker)
+        try:
+            return self.system.evaluate_cve_scanner_worker_async(
+                worker, sender
+            )
+
+        except QueueFull as e:
+            raise BusyException(str(e))
 
     @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE,
                          in_signature="n", out_signature="(bs)")
@@ -542,5 +749,7 @@ class OpenSCAPDaemonDbus(dbus.service.Object):
     @dbus.service.method(dbus_interface=dbus_utils.DBUS_INTERFACE,
                          in_signature="n", out_signature="")
     def CancelCVEScanListAsync(self, token):
-        # TODO
-        pass
+        """Cancels CVE scan started by CVEScanListAsync. Scans that are
+        already running can't be interrupted, their results are discarded.
+        """
+        self.system.cancel_evaluate_cve_scanner_worker_async(token)
@@ -20,6 +20,7 @@
 
 from openscap_daemon import et_helpers
 from openscap_daemon import oscap_helpers
+from openscap_daemon import content_cache
 
 try:
     import xml.etree.cElementTree as ElementTree
@@ -31,6 +32,57 @@ import shutil
 import io
 
 
+# Embedded content is stored here instead of a temporary file per spec if
+# set, see set_blob_store
+_blob_store = None
+
+
+def set_blob_store(blob_store):
+    """Makes SCAPInput and SCAPTailoring keep embedded contents in given
+    BlobStore. Specs serialized afterwards reference the contents by their
+    sha256 instead of inlining them. None goes back to temporary files.
+    """
+
+    global _blob_store
+    _blob_store = blob_store
+
+
+def get_blob_store():
+    return _blob_store
+
+
+def _load_blob(content, digest):
+    if _blob_store is None or digest not in _blob_store:
+        raise RuntimeError(
+            "Embedded content with sha256 '%s' is not available in the blob "
+            "store." % (digest)
+        )
+
+    content.set_blob(digest)
+
+
+def _get_content_digest(content):
+    """Returns an identifier of the contents of SCAPInput or SCAPTailoring,
+    their sha256 if the file can be read. Digests of files are cached, see
+    content_cache.get_file_digest, comparing large datastreams doesn't have to
+    read them.
+    """
+
+    if content.blob is not None:
+        return content.blob
+
+    if content.file_path is None:
+        return None
+
+    try:
+        return content_cache.get_file_digest(content.file_path)
+
+    except (IOError, OSError):
+        # Contents that can't be read are only equivalent to the same path,
+        # evaluating them will fail anyway.
+        return "unreadable:" + content.file_path
+
+
 class SCAPInput(object):
     """Encapsulates all sorts of SCAP input, either embedded in the spec
     itself or separate in a file installed via RPM or other means.
@@ -42,6 +94,8 @@ class SCAPInput(object):
     def __init__(self):
         self.file_path = None
         self.temp_file = None
+        # sha256 of embedded contents kept in the blob store
+        self.blob = None
         self.datastream_id = None
         self.xccdf_id = None
 
@@ -55,9 +109,12 @@ class SCAPInput(object):
         with io.open(self.file_path, "r", encoding="utf-8") as f:
             return f.read()
 
+    def get_digest(self):
+        return _get_content_digest(self)
+
     def is_equivalent_to(self, other):
         return \
-            self.get_xml_source() == other.get_xml_source() and \
+            self.get_digest() == other.get_digest() and \
             self.datastream_id == other.datastream_id and \
             self.xccdf_id == other.xccdf_id
 
@@ -68,6 +125,7 @@ class SCAPInput(object):
         """
 
         self.temp_file = None
+        self.blob = None
         if file_path is not None:
             self.file_path = \
                 os.path.abspath(file_path) if file_path is not None else None
@@ -76,12 +134,18 @@ class SCAPInput(object):
             self.file_path = None
 
     def set_contents(self, input_contents):
-        """Sets given input_contents XML to be the input source. This method
+        """Sets given input_contents XML to be the input source. The contents
+        are put to the blob store if there is one, otherwise this method
         allocates a temporary file that exists for the lifetime of this
         instance.
         """
 
-        if input_contents is not None:
+        self.temp_file = None
+        self.blob = None
+        if input_contents is not None and _blob_store is not None:
+            self.set_blob(_blob_store.put(input_contents.encode("utf-8")))
+
+        elif input_contents is not None:
             self.temp_file = tempfile.NamedTemporaryFile()
             self.temp_file.write(input_contents.encode("utf-8"))
             self.temp_file.flush()
@@ -91,11 +155,27 @@ class SCAPInput(object):
         else:
             self.file_path = None
 
+    def set_blob(self, digest):
+        """Sets contents already kept in the blob store to be the input
+        source.
+        """
+
+        self.temp_file = None
+        self.blob = digest
+        self.file_path = _blob_store.get_path(digest)
+
+    def is_bundled(self):
+        return self.temp_file is not None or self.blob is not None
+
     def load_from_xml_element(self, element):
         input_file = element.get("href")
+        blob = element.get("sha256")
         if input_file is not None:
             self.set_file_path(input_file)
 
+        elif blob is not None:
+            _load_blob(self, blob)
+
         else:
             input_file_contents = element.text
             self.set_contents(input_file_contents)
@@ -108,7 +188,9 @@ class SCAPInput(object):
             return None
 
         ret = ElementTree.Element("input")
-        if self.temp_file is None:
+        if self.blob is not None:
+            ret.set("sha256", self.blob)
+        elif self.temp_file is None:
             ret.set("href", self.file_path)
         else:
             with io.open(self.temp_file.name, "r", encoding="utf-8") as f:
@@ -131,6 +213,8 @@ class SCAPTailoring(object):
     def __init__(self):
         self.file_path = None
         self.temp_file = None
+        # sha256 of embedded contents kept in the blob store
+        self.blob = None
 
     def get_xml_source(self):
         if self.file_path is None:
@@ -139,9 +223,11 @@ class SCAPTailoring(object):
         with io.open(self.file_path, "r", encoding="utf-8") as f:
             return f.read()
 
+    def get_digest(self):
+        return _get_content_digest(self)
+
     def is_equivalent_to(self, other):
-        return \
-            self.get_xml_source() == other.get_xml_source()
+        return self.get_digest() == other.get_digest()
 
     def set_file_path(self, file_path):
         """Sets given file_path to be the input file. If you use this method
@@ -150,6 +236,7 @@ class SCAPTailoring(object):
         """
 
         self.temp_file = None
+        self.blob = None
         if file_path is not None:
             self.file_path = \
                 os.path.abspath(file_path) if file_path is not None else None
@@ -158,12 +245,18 @@ class SCAPTailoring(object):
             self.file_path = None
 
     def set_contents(self, input_contents):
-        """Sets given input_contents XML to be the input source. This method
+        """Sets given input_contents XML to be the input source. The contents
+        are put to the blob store if there is one, otherwise this method
         allocates a temporary file that exists for the lifetime of this
         instance.
         """
 
-        if input_contents is not None:
+        self.temp_file = None
+        self.blob = None
+        if input_contents is not None and _blob_store is not None:
+            self.set_blob(_blob_store.put(input_contents.encode("utf-8")))
+
+        elif input_contents is not None:
             self.temp_file = tempfile.NamedTemporaryFile()
             self.temp_file.write(input_contents.encode("utf-8"))
             self.temp_file.flush()
@@ -173,11 +266,26 @@ class SCAPTailoring(object):
         else:
             self.file_path = None
 
+    def set_blob(self, digest):
+        """Sets contents already kept in the blob store to be the tailoring.
+        """
+
+        self.temp_file = None
+        self.blob = digest
+        self.file_path = _blob_store.get_path(digest)
+
+    def is_bundled(self):
+        return self.temp_file is not None or self.blob is not None
+
     def load_from_xml_element(self, element):
         input_file = element.get("href")
+        blob = element.get("sha256")
         if input_file is not None:
             self.set_file_path(input_file)
 
+        elif blob is not None:
+            _load_blob(self, blob)
+
         else:
             input_file_contents = element.text
             self.set_contents(input_file_contents)
@@ -187,7 +295,9 @@ class SCAPTailoring(object):
             return None
 
         ret = ElementTree.Element("tailoring")
-        if self.temp_file is None:
+        if self.blob is not None:
+            ret.set("sha256", self.blob)
+        elif self.temp_file is None:
             ret.set("href", self.file_path)
         else:
             with io.open(self.temp_file.name, "r", encoding="utf-8") as f:
@@ -222,12 +332,12 @@ class EvaluationSpec(object):
         ret += "- result format: \t%s\n" % (self.result_format)
         ret += "- input:\n"
         ret += "  - file: \t%s\n" % (self.input_.file_path)
-        if self.input_.temp_file is not None:
+        if self.input_.is_bundled():
             ret += "    - bundled"
         ret += "  - datastream_id: \t%s\n" % (self.input_.datastream_id)
         ret += "  - xccdf_id: \t%s\n" % (self.input_.xccdf_id)
         ret += "- tailoring file: \t%s\n" % (self.tailoring.file_path)
-        if self.tailoring.temp_file is not None:
+        if self.tailoring.is_bundled():
             ret += "  - bundled"
         ret += "- profile ID: \t%s\n" % (self.profile_id)
         ret += "- online remediation: \t%s\n" % \
@@ -237,6 +347,14 @@ class EvaluationSpec(object):
 
         return ret
 
+    def get_blobs(self):
+        """Returns digests of embedded contents this spec keeps in the blob
+        store.
+        """
+
+        return [content.blob for content in (self.input_, self.tailoring)
+                if content.blob is not None]
+
     def is_valid(self):
         if self.mode == oscap_helpers.EvaluationMode.UNKNOWN:
             return False
@@ -266,6 +384,29 @@ class EvaluationSpec(object):
             self.online_remediation == other.online_remediation and \
             self.cpe_hints == other.cpe_hints
 
+    def get_content_key(self):
+        """Returns a hashable key identifying the content this spec evaluates
+        and how, digests of input and tailoring included. Specs with the same
+        key generate the same guides and profile choices.
+        """
+
+        return (
+            self.mode,
+            self.input_.get_digest(),
+            self.input_.datastream_id,
+            self.input_.xccdf_id,
+            self.tailoring.get_digest(),
+            self.profile_id
+        )
+
+    def get_resource_key(self):
+        """Returns a hashable key identifying content of this spec for
+        ResourceGovernor. Memory usage of oscap mostly depends on the content
+        and the profile.
+        """
+
+        return self.get_content_key()
+
     def load_from_xml_element(self, element):
         self.mode = oscap_helpers.EvaluationMode.from_string(
             et_helpers.get_element_text(element, "mode", "sds")
@@ -518,11 +659,16 @@ class EvaluationSpec(object):
 
         return ret
 
-    def evaluate_into_dir(self, config):
-        return oscap_helpers.evaluate(self, config)
+    def evaluate_into_dir(self, config, process_callback=None,
+                          usage_callback=None):
+        return oscap_helpers.evaluate(
+            self, config, process_callback, usage_callback
+        )
 
-    def evaluate(self, config):
-        wip_result = self.evaluate_into_dir(config)
+    def evaluate(self, config, process_callback=None, usage_callback=None):
+        wip_result = self.evaluate_into_dir(
+            config, process_callback, usage_callback
+        )
         try:
             exit_code = -1
             with io.open(os.path.join(wip_result, "exit_code"), "r",
@@ -0,0 +1,188 @@
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import io
+import json
+import threading
+import logging
+
+
+class Journal(object):
+    """Append-only log of work the daemon has accepted but not finished yet.
+
+    Every line is a JSON record. "enqueued" records carry whatever is needed
+    to redo the work, "started" and "finished" records refer to them by key.
+    Records are flushed and fsynced before the call returns, a crash loses
+    nothing that has been acknowledged to the caller.
+
+    After a crash, load() returns the enqueued records that never finished,
+    in the order they were enqueued. The file is compacted to just those
+    records on load and whenever finished records start to dominate it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # key -> enqueued record, in insertion order
+        self.entries = {}
+        self.order = []
+        self.started = set()
+        self.records_written = 0
+        self.lock = threading.Lock()
+        self.file_ = None
+
+    def _write_locked(self, record):
+        self.file_.write(
+            (json.dumps(record, sort_keys=True) + "\n").encode("utf-8")
+        )
+        self.file_.flush()
+        os.fsync(self.file_.fileno())
+        self.records_written += 1
+
+    def _compact_locked(self):
+        self.order = [key for key in self.order if key in self.entries]
+
+        temp_path = self.path + ".new"
+        with io.open(temp_path, "wb") as f:
+            for key in self.order:
+                f.write((json.dumps(self.entries[key], sort_keys=True) +
+                         "\n").encode("utf-8"))
+                if key in self.started:
+                    f.write((json.dumps({"event": "started", "key": key},
+                                        sort_keys=True) +
+                             "\n").encode("utf-8"))
+
+            f.flush()
+            os.fsync(f.fileno())
+
+        if self.file_ is not None:
+            self.file_.close()
+
+        os.rename(temp_path, self.path)
+        self.file_ = io.open(self.path, "ab")
+        self.records_written = len(self.order) + len(self.started)
+
+    def load(self):
+        """Reads the journal and returns unfinished enqueued records as
+        a list of (record, started) tuples. started is True if the work was
+        in progress when the daemon went down.
+        """
+
+        with self.lock:
+            self.entries = {}
+            self.order = []
+            self.started = set()
+
+            if os.path.exists(self.path):
+                with io.open(self.path, "rb") as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line.decode("utf-8"))
+                            event = record["event"]
+                            key = record["key"]
+
+                        except (ValueError, KeyError, TypeError):
+                            # a crash in the middle of a write leaves the
+                            # last line truncated
+                            logging.warning(
+                                "Skipping corrupted record in journal '%s'.",
+                                self.path
+                            )
+                            continue
+
+                        if event == "enqueued":
+                            self.entries[key] = record
+                            self.order.append(key)
+
+                        elif event == "started":
+                            self.started.add(key)
+
+                        elif event == "finished":
+                            self.entries.pop(key, None)
+                            self.started.discard(key)
+
+            self.started.intersection_update(self.entries.keys())
+            self._compact_locked()
+
+            return [(self.entries[key], key in self.started)
+                    for key in self.order]
+
+    def record_enqueued(self, key, record):
+        """Records new work under given key, record is a dict with JSON
+        serializable values describing the work.
+        """
+
+        record = dict(record)
+        record["event"] = "enqueued"
+        record["key"] = key
+
+        with self.lock:
+            if self.file_ is None:
+                self.file_ = io.open(self.path, "ab")
+
+            if key in self.entries:
+                self.order.remove(key)
+            self.entries[key] = record
+            self.order.append(key)
+            self.started.discard(key)
+            self._write_locked(record)
+
+    def record_started(self, key):
+        with self.lock:
+            if key not in self.entries or key in self.started:
+                return
+
+            self.started.add(key)
+            self._write_locked({"event": "started", "key": key})
+
+    def record_finished(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return
+
+            del self.entries[key]
+            self.started.discard(key)
+            self._write_locked({"event": "finished", "key": key})
+
+            if self.records_written > 2 * len(self.entries) + 1024:
+                self._compact_locked()
+
+    def get_records(self):
+        """Returns enqueued records that haven't finished yet, in the order
+        they were enqueued.
+        """
+
+        with self.lock:
+            return [self.entries[key] for key in self.order
+                    if key in self.entries]
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def close(self):
+        with self.lock:
+            if self.file_ is not None:
+                self.file_.close()
+                self.file_ = None
+
+
+__all__ = ["Journal"]
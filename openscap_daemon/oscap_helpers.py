@@ -20,8 +20,13 @@
 
 import subprocess
 import tempfile
+import os
 import os.path
+import errno
+import signal
+import threading
 import logging
+import time
 import io
 
 try:
@@ -29,7 +34,10 @@ try:
 except ImportError:
     import xml.etree.ElementTree as ElementTree
 from openscap_daemon import et_helpers
+from openscap_daemon import content_cache
+from openscap_daemon import compression
 from openscap_daemon.compat import subprocess_check_output
+from openscap_daemon.compat import new_session_popen_kwargs
 
 
 class EvaluationMode(object):
@@ -69,7 +77,33 @@ class EvaluationMode(object):
             return EvaluationMode.UNKNOWN
 
 
+# (input digest, tailoring digest, xccdf_id) -> profile choices
+_profile_choices_cache = content_cache.LRUCache(64)
+# (oscap path, EvaluationSpec.get_content_key()) -> HTML guide
+_guide_cache = content_cache.LRUCache(16, 64 * 1024 * 1024)
+
+
 def get_profile_choices_for_input(input_file, tailoring_file, xccdf_id):
+    """Returns a dict of IDs and titles of profiles in input_file, including
+    profiles from tailoring_file. Choices are cached by digests of both
+    files, scraping a large datastream takes a while.
+    """
+
+    key = (
+        content_cache.get_file_digest(input_file),
+        content_cache.get_file_digest(tailoring_file)
+        if tailoring_file else None,
+        xccdf_id
+    )
+    ret = _profile_choices_cache.get(key)
+    if ret is None:
+        ret = _scrape_profile_choices(input_file, tailoring_file, xccdf_id)
+        _profile_choices_cache.put(key, ret)
+
+    return dict(ret)
+
+
+def _scrape_profile_choices(input_file, tailoring_file, xccdf_id):
     # Ideally oscap would have a command line to do this, but as of now it
     # doesn't so we have to implement it ourselves. Importing openscap Python
     # bindings is nasty and overkill for this.
@@ -191,6 +225,12 @@ def generate_guide(spec, config):
             "Can't generate guide for an invalid EvaluationSpec."
         )
 
+    key = (config.oscap_path, spec.get_content_key())
+    ret = _guide_cache.get(key)
+    if ret is not None:
+        logging.debug("Using cached guide for evaluation spec.")
+        return ret
+
     args = get_generate_guide_args(spec, config)
 
     logging.debug(
@@ -205,6 +245,7 @@ def generate_guide(spec, config):
 
     logging.info("Generated guide for evaluation spec.")
 
+    _guide_cache.put(key, ret, len(ret))
     return ret
 
 
@@ -310,11 +351,141 @@ def get_evaluation_args(spec, config):
     return ret
 
 
-def evaluate(spec, config):
+# Reaping a process and signalling it have to be serialized, once a process
+# has been reaped its pid may be reused by an unrelated process.
+_reap_lock = threading.Lock()
+
+
+def _signal_process(process, signal_number):
+    with _reap_lock:
+        # returncode is set as soon as the process has been reaped
+        if process.returncode is not None:
+            return
+
+        try:
+            # oscap-ssh, oscap-docker, ... are wrapper scripts, we have to
+            # signal the whole process group or their children would be left
+            # behind
+            os.killpg(process.pid, signal_number)
+
+        except OSError:
+            # the process doesn't lead a process group
+            try:
+                os.kill(process.pid, signal_number)
+            except OSError:
+                pass
+
+
+def _poll_process(process):
+    """Returns exit code of given subprocess.Popen instance or None if it's
+    still running. Processes waited for in _wait_for_process are left for it
+    to reap.
+    """
+
+    with _reap_lock:
+        if getattr(process, "reaped_by_wait4", False):
+            return process.returncode
+
+        return process.poll()
+
+
+def terminate_process(process, timeout=10):
+    """Sends SIGTERM to given subprocess.Popen instance and SIGKILL if it
+    doesn't exit within timeout seconds. Blocks until the process is gone.
+
+    If the process leads a process group the whole group is signalled.
+    """
+
+    if _poll_process(process) is not None:
+        return
+
+    logging.info("Terminating process %i.", process.pid)
+    _signal_process(process, signal.SIGTERM)
+
+    deadline = time.time() + timeout
+    killed = False
+    while _poll_process(process) is None:
+        if not killed and time.time() > deadline:
+            logging.warning(
+                "Process %i didn't exit %i seconds after SIGTERM, killing it.",
+                process.pid, timeout
+            )
+            _signal_process(process, signal.SIGKILL)
+            killed = True
+
+        time.sleep(0.1)
+
+
+def _wait_for_exit(process):
+    """Blocks until given process exits without reaping it."""
+
+    if hasattr(os, "waitid"):
+        try:
+            os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        except OSError as e:
+            if e.errno != errno.EINTR:
+                raise
+
+    else:
+        time.sleep(0.1)
+
+
+def _wait_for_process(process):
+    """Waits for given subprocess.Popen instance to exit. Returns its exit
+    code and peak resident memory of the process and its children in bytes,
+    None if that isn't known.
+    """
+
+    if not hasattr(os, "wait4"):
+        return process.wait(), None
+
+    with _reap_lock:
+        if process.returncode is not None:
+            # already reaped by Popen.poll, e.g. in terminate_process
+            return process.returncode, None
+
+        process.reaped_by_wait4 = True
+
+    while True:
+        try:
+            _wait_for_exit(process)
+
+            with _reap_lock:
+                pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+                if pid == 0:
+                    continue
+
+                if os.WIFSIGNALED(status):
+                    process.returncode = -os.WTERMSIG(status)
+                else:
+                    process.returncode = os.WEXITSTATUS(status)
+
+                break
+
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+
+            if e.errno == errno.ECHILD:
+                # reaped by somebody calling Popen.wait directly
+                return process.wait(), None
+
+            raise
+
+    # ru_maxrss is in kilobytes on Linux
+    return process.returncode, rusage.ru_maxrss * 1024
+
+
+def evaluate(spec, config, process_callback=None, usage_callback=None):
     """Calls oscap to evaluate given task, creates a uniquely named directory
     in given results_dir for it. Returns absolute path to that directory in
     case of success.
 
+    process_callback is called with the subprocess.Popen instance of oscap
+    right after it has been started, this allows the caller to terminate it.
+    usage_callback is called with peak memory usage of oscap in bytes after
+    it exits, if it's known.
+
     Throws exception in case of failure.
     """
 
@@ -341,13 +512,21 @@ def evaluate(spec, config):
     exit_code = 1
 
     try:
-        exit_code = subprocess.call(
+        process = subprocess.Popen(
             args,
             cwd=working_directory,
             stdout=stdout_file,
             stderr=stderr_file,
-            shell=False
+            shell=False,
+            # own process group so that terminate_process gets all of it
+            **new_session_popen_kwargs
         )
+        if process_callback is not None:
+            process_callback(process)
+
+        exit_code, peak_memory = _wait_for_process(process)
+        if usage_callback is not None and peak_memory is not None:
+            usage_callback(peak_memory)
 
     except:
         logging.exception(
@@ -385,6 +564,12 @@ def evaluate(spec, config):
         )
         # TODO: Assert that arf was NOT generated
 
+    elif exit_code < 0:
+        logging.warning(
+            "Evaluation of EvaluationSpec was terminated by signal %i.",
+            -exit_code
+        )
+
     else:
         logging.error(
             "Evaluated EvaluationSpec, unknown exit code %i!.", exit_code
@@ -427,22 +612,26 @@ def generate_report_for_result(spec, results_dir, result_id, config):
 
     results_path = os.path.join(results_dir, str(result_id), "results.xml")
 
-    if not os.path.exists(results_path):
+    if not compression.exists(results_path):
         raise RuntimeError("Can't generate report for result '%s'. Expected "
                            "results XML at '%s' but the file doesn't exist."
                            % (result_id, results_path))
 
-    args = get_generate_report_args_for_results(spec, results_path, config)
+    # oscap can't read compressed results, they are decompressed into
+    # a temporary file
+    with compression.uncompressed_path(
+            results_path, config.work_in_progress_dir) as path:
+        args = get_generate_report_args_for_results(spec, path, config)
 
-    logging.debug(
-        "Generating report for result %i of EvaluationSpec with command '%s'.",
-        result_id, " ".join(args)
-    )
+        logging.debug(
+            "Generating report for result %i of EvaluationSpec with command "
+            "'%s'.", result_id, " ".join(args)
+        )
 
-    ret = subprocess_check_output(
-        args,
-        shell=False
-    ).decode("utf-8")
+        ret = subprocess_check_output(
+            args,
+            shell=False
+        ).decode("utf-8")
 
     logging.info(
         "Generated report for result %i of EvaluationSpec.", result_id
@@ -564,6 +753,7 @@ __all__ = [
     "generate_guide",
     "generate_fix",
     "evaluate",
+    "terminate_process",
     "generate_report_for_result",
     "get_status_from_exit_code",
     "generate_fix_for_result",
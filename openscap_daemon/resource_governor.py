@@ -0,0 +1,195 @@
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import io
+import threading
+import logging
+
+from openscap_daemon import async_tools
+
+
+def read_available_memory():
+    """Returns MemAvailable from /proc/meminfo in bytes, None if it can't be
+    read.
+    """
+
+    try:
+        with io.open("/proc/meminfo", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    # the value is always in kB
+                    return int(line.split()[1]) * 1024
+
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+
+    return None
+
+
+def read_memory_pressure():
+    """Returns the "some" avg10 memory pressure stall information, the share
+    of the last 10 seconds in percent some tasks were stalled waiting for
+    memory. None if the kernel doesn't provide PSI.
+    """
+
+    try:
+        with io.open("/proc/pressure/memory", "r", encoding="utf-8") as f:
+            for line in f:
+                fields = line.split()
+                if not fields or fields[0] != "some":
+                    continue
+
+                for field in fields[1:]:
+                    if field.startswith("avg10="):
+                        return float(field[len("avg10="):])
+
+    except (IOError, OSError, ValueError):
+        pass
+
+    return None
+
+
+def read_load():
+    """Returns 1 minute load average per CPU, None if it can't be read.
+    """
+
+    try:
+        return os.getloadavg()[0] / async_tools.get_cpu_count()
+
+    except OSError:
+        return None
+
+
+class ResourceGovernor(object):
+    """Decides whether the host has room for another evaluation.
+
+    AsyncManager asks the governor before starting actions that have
+    a resource_key. The action is delayed while the load average per CPU
+    is above max_load or the memory pressure is above max_memory_pressure,
+    0 disables either check. If check_memory is set it is also delayed until
+    the available memory minus min_free_memory covers the memory footprint of
+    the new action. Memory used by running actions is already missing from
+    the available memory, it isn't counted again.
+
+    Footprints are learned per resource_key, which identifies the content,
+    from the peak memory usage of past runs. Actions with unknown footprint
+    only need min_free_memory to start.
+
+    If no governed action is running the action is always started, waiting
+    wouldn't free any resources.
+    """
+
+    def __init__(self, max_load=0.0, max_memory_pressure=0.0,
+                 min_free_memory=0, poll_interval=5.0, check_memory=False):
+        self.max_load = max_load
+        self.max_memory_pressure = max_memory_pressure
+        self.check_memory = check_memory
+        self.min_free_memory = min_free_memory
+        self.poll_interval = poll_interval
+
+        # resource_key -> peak memory usage in bytes
+        self.footprints = {}
+        # resource_keys of running governed actions, one item per action
+        self.running = []
+        self.cond = threading.Condition()
+
+    def get_footprint(self, resource_key):
+        with self.cond:
+            return self.footprints.get(resource_key, 0)
+
+    def _record_footprint_locked(self, resource_key, peak_memory):
+        # Footprints follow increases right away and decay slowly,
+        # underestimating is what hurts.
+        old = self.footprints.get(resource_key)
+        if old is None:
+            self.footprints[resource_key] = peak_memory
+        else:
+            self.footprints[resource_key] = \
+                max(peak_memory, (old + peak_memory) // 2)
+
+    def record_footprint(self, resource_key, peak_memory):
+        with self.cond:
+            self._record_footprint_locked(resource_key, peak_memory)
+
+    def _get_blocker_locked(self, resource_key):
+        """Returns why an action with given resource_key can't start right
+        now, None if it can.
+        """
+
+        if not self.running:
+            return None
+
+        if self.max_load > 0:
+            load = read_load()
+            if load is not None and load > self.max_load:
+                return "load %.2f per CPU" % (load)
+
+        if self.max_memory_pressure > 0:
+            pressure = read_memory_pressure()
+            if pressure is not None and pressure > self.max_memory_pressure:
+                return "memory pressure %.2f%%" % (pressure)
+
+        available = read_available_memory() if self.check_memory else None
+        if available is not None:
+            needed = self.min_free_memory + \
+                self.footprints.get(resource_key, 0)
+
+            if available < needed:
+                return "%i MiB available, %i MiB needed" % \
+                    (available // (1024 * 1024), needed // (1024 * 1024))
+
+        return None
+
+    def acquire(self, resource_key):
+        """Blocks until an action with given resource_key can start.
+        """
+
+        with self.cond:
+            logged = False
+            while True:
+                blocker = self._get_blocker_locked(resource_key)
+                if blocker is None:
+                    break
+
+                if not logged:
+                    logging.info(
+                        "Delaying evaluation, %s. %i evaluations running.",
+                        blocker, len(self.running)
+                    )
+                    logged = True
+
+                # woken up early when a governed action finishes
+                self.cond.wait(self.poll_interval)
+
+            self.running.append(resource_key)
+
+    def release(self, resource_key, peak_memory=None):
+        """Called once the action has finished, peak_memory in bytes is
+        remembered as footprint of the content if known.
+        """
+
+        with self.cond:
+            self.running.remove(resource_key)
+
+            if peak_memory is not None:
+                self._record_footprint_locked(resource_key, peak_memory)
+
+            self.cond.notify_all()
+
+
+__all__ = ["ResourceGovernor", "read_available_memory",
+           "read_memory_pressure", "read_load"]
@@ -23,7 +23,7 @@ import os
 
 from openscap_daemon import oscap_helpers
 from datetime import datetime
-from flask import Flask, request
+from flask import Flask, Response, request
 
 
 class OpenSCAPRestApi(object):
@@ -62,6 +62,9 @@ class OpenSCAPRestApi(object):
         self.app.add_url_rule("/tasks/<int:task_id>/result/<int:result_id>/",
                               "get_task_result", self.get_task_result,
                               methods=['GET'])
+        self.app.add_url_rule("/tasks/<int:task_id>/result/<int:result_id>/xml/",
+                              "get_task_result_xml", self.get_task_result_xml,
+                              methods=['GET'])
         self.app.add_url_rule("/tasks/<int:task_id>/result/",
                               "remove_all_task_results", self.remove_task_result,
                               methods=['DELETE'])
@@ -83,6 +86,12 @@ class OpenSCAPRestApi(object):
         self.app.add_url_rule("/ssgs/",
                               "get_ssg", self.get_ssg,
                               methods=['GET', 'POST'])
+        self.app.add_url_rule("/workers/",
+                              "get_workers", self.get_workers,
+                              methods=['GET'])
+        self.app.add_url_rule("/workers/",
+                              "set_workers", self.set_workers,
+                              methods=['PUT'])
         if self.system.config.rest_debug:
             self.app.debug = True
 
@@ -129,6 +138,24 @@ class OpenSCAPRestApi(object):
         ssgs_json = '{"ssgs":' + json.dumps(ssgs, indent=4) + '}'
         return ssgs_json
 
+    def get_workers(self):
+        """Returns how many async actions can run in parallel"""
+        workers = {'workers': self.system.get_async_workers()}
+        return json.dumps(workers, indent=4)
+
+    def set_workers(self):
+        """Resizes the pool of workers running async actions"""
+        content = request.get_json(silent=True)
+        if content is None:
+            return '{"Error" : "json data required"}', 400
+        elif 'workers' not in content:
+            return '{"Error": "There are missing fields in the request"}', 400
+        try:
+            self.system.set_async_workers(int(content['workers']))
+        except (ValueError, RuntimeError) as err:
+            return json.dumps({'Error': str(err)}), 400
+        return self.get_workers()
+
     def task_schedule(self, task_id, schedule):
         """Updates the task schedule"""
         status = []
@@ -199,6 +226,24 @@ class OpenSCAPRestApi(object):
             result_html = '{"Error" : "HTML Report could not been generated. Please, check that task and result ids exists"}'
         return result_html
 
+    def get_task_result_xml(self, task_id, result_id):
+        """Returns the task Result XML (ARF), streamed in chunks so that large
+        results are never held in memory as a whole"""
+        try:
+            fd = self.system.open_xml_of_task_result(task_id, result_id)
+        except (IOError, OSError, RuntimeError, KeyError):
+            return '{"Error" : "Result XML could not been read. Please, check that task and result ids exists"}'
+
+        def generate():
+            with os.fdopen(fd, "rb") as f:
+                while True:
+                    chunk = f.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    yield chunk
+
+        return Response(generate(), mimetype="application/xml")
+
     def get_task_guide(self, task_id):
         """Returns the task Guide information in html format"""
         guide_html = None
@@ -333,11 +378,11 @@ class OpenSCAPRestApi(object):
                 modified_timestamp = self.system.get_task_modified_timestamp(task)
                 modified = datetime.fromtimestamp(modified_timestamp)
                 enabled = self.system.get_task_enabled(task)
-                task_results_ids = self.system.get_task_result_ids(task)
+                task_results_metadata = self.system.get_task_results_metadata(task)
                 task_results = []
-                for task_result_id in task_results_ids:
-                    exit_code = self.system.get_exit_code_of_task_result(task, task_result_id)
-                    timestamp = self.system.get_task_result_created_timestamp(task, task_result_id)
+                for task_result_id, metadata in task_results_metadata:
+                    exit_code = metadata["exit_code"]
+                    timestamp = metadata["created"]
                     # Exit code 0 means evaluation was successful and machine is compliant.
                     # Exit code 1 means there was an error while evaluating.
                     # Exit code 2 means there were no errors but the machine is not compliant.
@@ -349,7 +394,10 @@ class OpenSCAPRestApi(object):
                         status = "Evaluation Error"
                     else:
                         status = "Unknow status for exit_code " + exit_code
-                    task_results.append({'taskResultId': str(task_result_id), 'taskResulttimestamp': timestamp, 'taskResultStatus': status})
+                    rule_results = metadata["rule_results"] or {}
+                    task_results.append({'taskResultId': str(task_result_id), 'taskResulttimestamp': timestamp, 'taskResultStatus': status,
+                                         'taskResultDuration': metadata["duration"], 'taskResultPassed': rule_results.get("pass"),
+                                         'taskResultFailed': rule_results.get("fail"), 'taskResultSize': metadata["size"]})
                 tasks.append({'id': str(task), 'title': title, 'target': target, 'modified': str(modified), 'enabled': enabled, 'results': task_results})
             except KeyError:
                 return '{"Error" : "Task not found"}'
@@ -0,0 +1,95 @@
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import io
+import logging
+
+from openscap_daemon import compression
+from openscap_daemon import content_cache
+
+
+# Results never change once they are stored, neither do artifacts generated
+# from them. The most recently used ones are kept in memory, all of them are
+# kept on disk next to their results.
+_memory_cache = content_cache.LRUCache(32, 128 * 1024 * 1024)
+_single_flight = content_cache.SingleFlight()
+# names of artifacts that have been cached, see forget
+_names = set()
+
+
+def _store(path, text, compression_method):
+    temp_path = path + ".tmp"
+    try:
+        with io.open(temp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.rename(temp_path, path)
+        compression.compress_file(path, compression_method)
+
+    except (IOError, OSError, RuntimeError) as e:
+        # the artifact is generated again next time
+        logging.warning("Failed to store '%s'. %s", path, e)
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def get(result_dir, name, generate, compression_method="none"):
+    """Returns artifact called name of the result stored in result_dir,
+    for example its HTML report. The artifact is generated by calling
+    generate() the first time it is needed and stored next to the result,
+    compressed using compression_method. Concurrent requests for the same
+    artifact wait for one generate() call.
+    """
+
+    path = os.path.join(result_dir, name)
+    key = (result_dir, name)
+
+    ret = _memory_cache.get(key)
+    if ret is not None:
+        return ret
+
+    def load_or_generate():
+        ret = _memory_cache.get(key)
+        if ret is not None:
+            # generated by the call we waited for
+            return ret
+
+        if compression.exists(path):
+            logging.debug("Using stored artifact '%s'.", path)
+            ret = compression.read_text(path)
+
+        else:
+            ret = generate()
+            _store(path, ret, compression_method)
+
+        _names.add(name)
+        _memory_cache.put(key, ret, len(ret))
+        return ret
+
+    return _single_flight.do(key, load_or_generate)
+
+
+def forget(result_dir):
+    """Drops artifacts of the result in result_dir from memory, called when
+    the result is removed.
+    """
+
+    for name in list(_names):
+        _memory_cache.remove((result_dir, name))
+
+
+__all__ = ["get", "forget"]
@@ -0,0 +1,237 @@
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import io
+import json
+import time
+import tempfile
+import threading
+import logging
+
+
+def _estimate_size(value):
+    """Rough estimate of memory taken by a JSON-like value in bytes. Only
+    strings matter, we store ARFs, stdout and stderr.
+    """
+
+    if isinstance(value, (list, tuple)):
+        return sum(_estimate_size(item) for item in value)
+
+    if isinstance(value, dict):
+        return sum(_estimate_size(key) + _estimate_size(item)
+                   for key, item in value.items())
+
+    if hasattr(value, "__len__"):
+        return len(value)
+
+    return 8
+
+
+class MemoryBudget(object):
+    """Memory budget that can be shared by several AsyncResultStores so that
+    together they don't keep more than limit bytes of results in memory.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def reserve(self, size):
+        with self.lock:
+            if self.used + size > self.limit:
+                return False
+
+            self.used += size
+            return True
+
+    def release(self, size):
+        with self.lock:
+            self.used -= size
+
+
+class AsyncResultStore(object):
+    """Keeps results of async actions until the caller collects them.
+
+    Results are kept in memory as long as they are smaller than
+    spill_threshold and all results in memory fit into memory_budget. Other
+    results are serialized to JSON files in spill_dir and only the path is
+    kept in memory. Results that haven't been collected within ttl seconds
+    are thrown away, callers that never come back don't make us leak memory
+    or disk space.
+
+    memory_budget is either a number of bytes or a MemoryBudget shared with
+    other stores.
+
+    Values have to be JSON serializable. Tuples come back as lists when they
+    have been spilled to disk.
+    """
+
+    def __init__(self, spill_dir, memory_budget=64 * 1024 * 1024,
+                 spill_threshold=1024 * 1024, ttl=24 * 60 * 60):
+        self.spill_dir = spill_dir
+        if not isinstance(memory_budget, MemoryBudget):
+            memory_budget = MemoryBudget(memory_budget)
+        self.memory_budget = memory_budget
+        self.spill_threshold = spill_threshold
+        self.ttl = ttl
+
+        # token -> (timestamp, value, size) for results in memory
+        #          (timestamp, path, None) for results spilled to disk
+        self.entries = {}
+        # token -> marker of the put() that is currently spilling its result,
+        # discard() or another put() for the same token invalidate it
+        self.spilling = {}
+        self.memory_used = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def __contains__(self, token):
+        with self.lock:
+            return token in self.entries
+
+    def _remove_locked(self, token):
+        _, value, size = self.entries.pop(token)
+        if size is None:
+            try:
+                os.remove(value)
+            except OSError:
+                logging.warning("Failed to remove spilled async result '%s'.",
+                                value)
+
+        else:
+            self.memory_used -= size
+            self.memory_budget.release(size)
+
+    def _evict_expired_locked(self):
+        if self.ttl <= 0:
+            return
+
+        threshold = time.time() - self.ttl
+        expired = [token for token, (timestamp, _, _) in self.entries.items()
+                   if timestamp < threshold]
+
+        for token in expired:
+            logging.info(
+                "Results of async action with token %i haven't been "
+                "collected for %i seconds, throwing them away.",
+                token, self.ttl
+            )
+            self._remove_locked(token)
+
+    def _spill(self, value):
+        if not os.path.isdir(self.spill_dir):
+            os.makedirs(self.spill_dir)
+
+        fd, path = tempfile.mkstemp(
+            prefix="", suffix=".json", dir=self.spill_dir
+        )
+        with io.open(fd, "wb") as f:
+            f.write(json.dumps(value).encode("utf-8"))
+
+        return path
+
+    def put(self, token, value):
+        size = _estimate_size(value)
+
+        with self.lock:
+            self._evict_expired_locked()
+
+            if token in self.entries:
+                self._remove_locked(token)
+
+            if size <= self.spill_threshold and \
+               self.memory_budget.reserve(size):
+                self.spilling.pop(token, None)
+                self.entries[token] = (time.time(), value, size)
+                self.memory_used += size
+                return
+
+            marker = object()
+            self.spilling[token] = marker
+
+        # Writing large results takes a while, don't hold the lock meanwhile.
+        path = None
+        stored = False
+        try:
+            path = self._spill(value)
+            logging.debug(
+                "Spilled results of async action with token %i (%i bytes) to "
+                "'%s'.", token, size, path
+            )
+
+        finally:
+            with self.lock:
+                if self.spilling.get(token) is marker:
+                    del self.spilling[token]
+
+                    if path is not None:
+                        if token in self.entries:
+                            self._remove_locked(token)
+
+                        self.entries[token] = (time.time(), path, None)
+                        stored = True
+
+        if not stored:
+            # The results were discarded or replaced while we were writing
+            # them.
+            try:
+                os.remove(path)
+            except OSError:
+                logging.warning("Failed to remove spilled async result '%s'.",
+                                path)
+
+    def take(self, token):
+        """Returns results stored for given token and removes them from the
+        store. Raises KeyError if there are no such results.
+        """
+
+        with self.lock:
+            self._evict_expired_locked()
+
+            _, value, size = self.entries[token]
+            if size is not None:
+                self._remove_locked(token)
+                return value
+
+            # The file stays on disk until we read it, take it out of the
+            # entries so that it isn't evicted meanwhile.
+            del self.entries[token]
+
+        try:
+            with io.open(value, "rb") as f:
+                return json.loads(f.read().decode("utf-8"))
+
+        finally:
+            os.remove(value)
+
+    def discard(self, token):
+        with self.lock:
+            self.spilling.pop(token, None)
+            if token in self.entries:
+                self._remove_locked(token)
+
+    def evict_expired(self):
+        with self.lock:
+            self._evict_expired_locked()
+
+
+__all__ = ["MemoryBudget", "AsyncResultStore"]
@@ -0,0 +1,226 @@
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import io
+import json
+import threading
+import logging
+
+from openscap_daemon import compression
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+
+def iter_rule_results(arf_path):
+    """Yields (rule ID, result) tuples of all XCCDF rule results in the ARF,
+    result is e.g. "pass" or "fail". The ARF is parsed incrementally, it can
+    be hundreds of MB, and may be compressed.
+    """
+
+    with compression.open_file(arf_path) as f:
+        # Elements that are being parsed. Finished elements are removed from
+        # their parent right away, only the path to the current element is
+        # kept in memory.
+        stack = []
+        rule_result_depth = 0
+
+        for event, element in ElementTree.iterparse(f, ("start", "end")):
+            is_rule_result = element.tag.endswith("}rule-result")
+
+            if event == "start":
+                stack.append(element)
+                if is_rule_result:
+                    rule_result_depth += 1
+
+                continue
+
+            stack.pop()
+            if is_rule_result:
+                rule_result_depth -= 1
+                for child in element:
+                    if child.tag.endswith("}result"):
+                        yield element.get("idref"), child.text
+                        break
+
+            elif rule_result_depth > 0:
+                # the rule-result needs its children until it ends
+                continue
+
+            if stack:
+                stack[-1].remove(element)
+
+
+def count_rule_results(arf_path):
+    """Returns a dict of XCCDF rule result values and how many rules ended up
+    with them. Returns None if the ARF can't be parsed.
+    """
+
+    ret = {}
+    try:
+        for _, result in iter_rule_results(arf_path):
+            ret[result] = ret.get(result, 0) + 1
+
+    except (IOError, OSError, SyntaxError, RuntimeError) as e:
+        logging.warning(
+            "Failed to count rule results in '%s'. %s", arf_path, e
+        )
+        return None
+
+    return ret
+
+
+def get_result_metadata(result_dir, started=None, finished=None,
+                        count_rules=True):
+    """Gathers metadata of the result stored in result_dir. started and
+    finished are timestamps of the evaluation if known, rule results are
+    only counted if count_rules is True, that needs to parse the ARF.
+    """
+
+    exit_code_path = os.path.join(result_dir, "exit_code")
+    with io.open(exit_code_path, "r", encoding="utf-8") as f:
+        exit_code = int(f.read())
+
+    sizes = {}
+    for name in os.listdir(result_dir):
+        sizes[name] = os.path.getsize(os.path.join(result_dir, name))
+
+    rule_results = None
+    if count_rules:
+        arf_path = os.path.join(result_dir, "results.xml")
+        if compression.exists(arf_path):
+            rule_results = count_rule_results(arf_path)
+
+    return {
+        "exit_code": exit_code,
+        "created": os.path.getctime(exit_code_path),
+        "started": started,
+        "finished": finished,
+        "duration": finished - started
+        if started is not None and finished is not None else None,
+        "rule_results": rule_results,
+        "sizes": sizes,
+        "size": sum(sizes.values())
+    }
+
+
+class ResultsIndex(object):
+    """Metadata of all results of one task, lets clients list results without
+    opening every result directory.
+
+    The index is an append-only file of JSON records, "added" records carry
+    the metadata, "removed" records refer to them by result ID. It is
+    compacted on load and whenever removed results start to dominate it.
+    The index is only a cache of what is on disk, results missing in it
+    are added when results are listed, see Task.get_results_metadata.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # result ID -> metadata, None until the index has been loaded
+        self.entries = None
+        self.records_written = 0
+        self.lock = threading.Lock()
+
+    def _load_locked(self):
+        if self.entries is not None:
+            return
+
+        self.entries = {}
+        if os.path.exists(self.path):
+            with io.open(self.path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line.decode("utf-8"))
+                        event = record.pop("event")
+                        result_id = record.pop("id")
+
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        logging.warning(
+                            "Skipping corrupted record in results index "
+                            "'%s'.", self.path
+                        )
+                        continue
+
+                    if event == "added":
+                        self.entries[result_id] = record
+                    elif event == "removed":
+                        self.entries.pop(result_id, None)
+
+        self._compact_locked()
+
+    def _compact_locked(self):
+        temp_path = self.path + ".new"
+        with io.open(temp_path, "wb") as f:
+            for result_id in sorted(self.entries.keys()):
+                record = dict(self.entries[result_id])
+                record["event"] = "added"
+                record["id"] = result_id
+                f.write((json.dumps(record, sort_keys=True) + "\n")
+                        .encode("utf-8"))
+
+        os.rename(temp_path, self.path)
+        self.records_written = len(self.entries)
+
+    def _append_locked(self, record):
+        with io.open(self.path, "ab") as f:
+            f.write((json.dumps(record, sort_keys=True) + "\n")
+                    .encode("utf-8"))
+        self.records_written += 1
+
+    def add(self, result_id, metadata):
+        with self.lock:
+            self._load_locked()
+            self.entries[result_id] = dict(metadata)
+
+            record = dict(metadata)
+            record["event"] = "added"
+            record["id"] = result_id
+            self._append_locked(record)
+
+    def remove(self, result_id):
+        with self.lock:
+            self._load_locked()
+            if self.entries.pop(result_id, None) is None:
+                return
+
+            self._append_locked({"event": "removed", "id": result_id})
+            if self.records_written > 2 * len(self.entries) + 64:
+                self._compact_locked()
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+            self._compact_locked()
+
+    def get(self, result_id):
+        with self.lock:
+            self._load_locked()
+            metadata = self.entries.get(result_id)
+            return dict(metadata) if metadata is not None else None
+
+    def get_result_ids(self):
+        with self.lock:
+            self._load_locked()
+            return set(self.entries.keys())
+
+
+__all__ = ["ResultsIndex", "get_result_metadata", "iter_rule_results",
+           "count_rule_results"]
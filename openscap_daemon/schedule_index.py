@@ -0,0 +1,150 @@
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import heapq
+import threading
+
+
+class ScheduleIndex(object):
+    """Min-heap of next update times of tasks, keyed by task ID.
+
+    Changing the time of a task pushes a new heap entry, the old entry stays
+    in the heap and is discarded lazily once it gets to the top. Each entry
+    carries a version number, an entry is only valid if its version matches
+    the last version recorded for its task.
+
+    The index has its own lock so that the scheduler never has to walk all
+    tasks while holding System.tasks_lock.
+    """
+
+    def __init__(self):
+        self.heap = []
+        # task_id -> (next_update_time, version)
+        self.entries = {}
+        self.last_version = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def _compact(self):
+        # Stale entries are only removed when they get to the top of the
+        # heap. Rebuild the heap if they start to dominate it.
+        if len(self.heap) <= 2 * len(self.entries) + 64:
+            return
+
+        self.heap = [
+            (next_update_time, version, task_id)
+            for task_id, (next_update_time, version) in self.entries.items()
+        ]
+        heapq.heapify(self.heap)
+
+    def _purge_stale(self):
+        while self.heap:
+            next_update_time, version, task_id = self.heap[0]
+            entry = self.entries.get(task_id)
+            if entry is not None and entry[1] == version:
+                return
+
+            heapq.heappop(self.heap)
+
+    def update(self, task_id, next_update_time):
+        """Sets next update time of given task. None removes the task from the
+        index, which is what we want for disabled tasks and tasks without
+        a schedule.
+        """
+
+        with self.lock:
+            if next_update_time is None:
+                self.entries.pop(task_id, None)
+
+            else:
+                self.last_version += 1
+                self.entries[task_id] = (next_update_time, self.last_version)
+                heapq.heappush(
+                    self.heap, (next_update_time, self.last_version, task_id)
+                )
+
+            self._compact()
+
+    def update_many(self, next_update_times):
+        """Sets next update times of many tasks at once, takes a list of
+        (task_id, next_update_time) tuples. The heap is rebuilt in linear time,
+        this is much faster than calling update() for each task after all
+        tasks have been loaded.
+        """
+
+        with self.lock:
+            for task_id, next_update_time in next_update_times:
+                if next_update_time is None:
+                    self.entries.pop(task_id, None)
+
+                else:
+                    self.last_version += 1
+                    self.entries[task_id] = \
+                        (next_update_time, self.last_version)
+
+            self.heap = [
+                (next_update_time, version, task_id)
+                for task_id, (next_update_time, version)
+                in self.entries.items()
+            ]
+            heapq.heapify(self.heap)
+
+    def remove(self, task_id):
+        self.update(task_id, None)
+
+    def peek(self):
+        """Returns (next_update_time, task_id) of the task that should be
+        updated first or None if no task is in the index.
+        """
+
+        with self.lock:
+            self._purge_stale()
+            if not self.heap:
+                return None
+
+            next_update_time, _, task_id = self.heap[0]
+            return next_update_time, task_id
+
+    def pop_due(self, reference_datetime):
+        """Removes all tasks that should be updated at reference_datetime or
+        earlier from the index and returns their IDs, earliest first.
+
+        Callers are expected to put the tasks back using update() after they
+        have been updated.
+        """
+
+        ret = []
+        with self.lock:
+            while True:
+                self._purge_stale()
+                if not self.heap:
+                    break
+
+                next_update_time, _, task_id = self.heap[0]
+                if next_update_time > reference_datetime:
+                    break
+
+                heapq.heappop(self.heap)
+                del self.entries[task_id]
+                ret.append(task_id)
+
+        return ret
+
+
+__all__ = ["ScheduleIndex"]
@@ -20,13 +20,28 @@
 import os
 import os.path
 from datetime import datetime
+import collections
 import threading
 import logging
+import io
+import shutil
 
-from openscap_daemon.task import Task
+from openscap_daemon.task import Task, POST_EVALUATION_ARTIFACTS
+from openscap_daemon.evaluation_spec import EvaluationSpec
+from openscap_daemon import evaluation_spec
 from openscap_daemon.config import Configuration
 from openscap_daemon import oscap_helpers
 from openscap_daemon import async_tools
+from openscap_daemon.schedule_index import ScheduleIndex
+from openscap_daemon.result_store import MemoryBudget, AsyncResultStore
+from openscap_daemon.resource_governor import ResourceGovernor
+from openscap_daemon.journal import Journal
+from openscap_daemon.task_index import TaskIndex
+from openscap_daemon.blob_store import BlobStore
+from openscap_daemon.task_watcher import TaskDirWatcher
+from openscap_daemon.counter import PersistentCounter
+from openscap_daemon.chunk_reader import ChunkReader
+from openscap_daemon import compression
 
 
 class ResultsNotAvailable(Exception):
@@ -34,14 +49,20 @@ class ResultsNotAvailable(Exception):
         super(ResultsNotAvailable, self).__init__()
 
 
+# With the default priority aging of AsyncManager a scheduled task update is
+# overtaken by evaluations enqueued at most 10 minutes after it.
 EVALUATION_PRIORITY = 0
 TASK_ACTION_PRIORITY = 10
+# reports and fixes of new results are generated after waiting evaluations
+# and task updates, with priority aging they overtake them eventually
+POST_EVALUATION_PRIORITY = 20
+
+# largest chunk of a result served by one read_xml_of_task_result call
+MAX_RESULT_CHUNK_LENGTH = 16 * 1024 * 1024
 
 
 class System(object):
     def __init__(self, config_file):
-        self.async_manager = async_tools.AsyncManager()
-
         logging.info("Loading configuration from '%s'.", config_file)
         self.config = Configuration()
         self.config.load(config_file)
@@ -50,19 +71,117 @@ class System(object):
         self.config.prepare_dirs()
         self.config.sanity_check()
 
-        self.async_eval_spec_results = dict()
-        self.async_eval_spec_results_lock = threading.Lock()
+        self.async_manager = async_tools.AsyncManager(
+            self.config.jobs, self.config.max_jobs_per_second
+        )
+        if self.config.adaptive_jobs:
+            max_jobs = self.config.max_jobs
+            if max_jobs == 0:
+                max_jobs = async_tools.get_cpu_count()
+
+            self.async_manager.enable_adaptive(self.config.min_jobs, max_jobs)
+
+        self.async_manager.governor = ResourceGovernor(
+            self.config.dispatch_max_load,
+            self.config.dispatch_max_memory_pressure,
+            self.config.dispatch_min_free_memory,
+            check_memory=self.config.dispatch_check_memory
+        )
+
+        # Only evaluations requested by clients are limited, task updates
+        # are enqueued by the scheduler which never floods the queue.
+        self.async_manager.set_max_pending(
+            EVALUATION_PRIORITY, self.config.max_pending_evaluations
+        )
+        self.async_manager.max_pending_per_caller = \
+            self.config.max_pending_evaluations_per_caller
+
+        # results of async actions waiting for the caller to collect them
+        async_results_dir = os.path.join(
+            self.config.work_in_progress_dir, "async_results"
+        )
+        # both result stores share one memory budget
+        self.async_results_memory_budget = \
+            MemoryBudget(self.config.async_results_memory_budget)
+        self.async_eval_spec_results = AsyncResultStore(
+            async_results_dir,
+            self.async_results_memory_budget,
+            self.config.async_results_spill_threshold,
+            self.config.async_results_ttl
+        )
+
+        # streams of results read in chunks by clients
+        self.result_chunk_reader = ChunkReader()
 
         self.tasks = dict()
         self.tasks_lock = threading.Lock()
         # a set of tasks that have already been scheduled, we keep this so that
         # we don't schedule a task twice in a row
         self.tasks_scheduled = set()
+        # catch-up runs of no_slip tasks being evaluated and (task_id,
+        # reference_datetime) of the ones waiting for a free catch-up slot,
+        # see Configuration.catch_up_jobs
+        self.catch_up_running = 0
+        self.catch_up_pending = collections.deque()
+        # next update times of all tasks that may need an update, this lets
+        # us find due tasks without walking all of them
+        self.schedule_index = ScheduleIndex()
 
         self.update_wait_cond = threading.Condition()
 
-        self.async_eval_cve_scanner_worker_results = dict()
-        self.async_eval_cve_scanner_worker_results_lock = threading.Lock()
+        # pending evaluations and one-off task runs that should survive
+        # a restart, see resume_journal
+        self.journal = Journal(
+            os.path.join(self.config.work_in_progress_dir, "journal")
+        )
+        self.journal_resumed = False
+
+        # contents embedded in tasks and specs, shared by all tasks with
+        # the same contents
+        self.blob_store = BlobStore(self.config.blobs_dir)
+        evaluation_spec.set_blob_store(self.blob_store)
+        # digests of blobs used by running evaluate_spec calls, one item per
+        # spec and blob, they are not in any task or in the journal
+        self.blobs_in_use = []
+        self.blobs_in_use_lock = threading.Lock()
+
+        # IDs of tasks with changes that haven't been written yet and
+        # the timer that writes them, see _save_task_later
+        self.tasks_to_save = set()
+        self.tasks_to_save_timer = None
+        self.tasks_to_save_lock = threading.Lock()
+
+        # scalar fields and schedules of tasks, lets load_tasks skip parsing
+        # task definitions that haven't changed
+        self.task_index = TaskIndex(
+            os.path.join(self.config.work_in_progress_dir, "tasks.index")
+        )
+        # hands out IDs of new tasks, IDs of removed tasks are never reused
+        self.task_id_counter = PersistentCounter(
+            os.path.join(self.config.tasks_dir, ".last_task_id"),
+            self._get_last_task_id_on_disk
+        )
+
+        # picks up changes of task definitions made by other tools, see
+        # watch_tasks_dir
+        self.tasks_dir_watcher = None
+
+        self.async_eval_cve_scanner_worker_results = AsyncResultStore(
+            async_results_dir,
+            self.async_results_memory_budget,
+            self.config.async_results_spill_threshold,
+            self.config.async_results_ttl
+        )
+
+    def get_async_workers(self):
+        return self.async_manager.get_workers()
+
+    def set_async_workers(self, workers):
+        """Resizes the pool of workers evaluating tasks and specs. Doesn't
+        affect actions that are already running. 0 means one worker per CPU.
+        """
+
+        self.async_manager.set_workers(workers)
 
     def get_ssg_choices(self):
         ret = []
@@ -96,38 +215,131 @@ class System(object):
 
             self.system = system
             self.spec = spec
+            # never evaluate the same target twice in parallel
+            self.lane = spec.target
+            self.resource_key = spec.get_resource_key()
+
+            # oscap process of the evaluation, we need it for interrupt
+            self.process = None
+            self.process_lock = threading.Lock()
+
+            # held until the evaluation has been written to the journal,
+            # a quick evaluation must not finish before that
+            self.journal_lock = threading.Lock()
+
+        def _set_process(self, process):
+            with self.process_lock:
+                self.process = process
+                cancelled = self.cancelled
+
+            if cancelled:
+                # interrupt came before oscap started
+                oscap_helpers.terminate_process(process)
+
+        def interrupt(self):
+            with self.process_lock:
+                process = self.process
+
+            if process is not None:
+                # SIGTERM and SIGKILL may take a while, don't block the caller
+                terminate_thread = threading.Thread(
+                    target=oscap_helpers.terminate_process, args=(process,)
+                )
+                terminate_thread.daemon = True
+                terminate_thread.start()
+
+            return True
 
         def run(self):
-            all_results, stdout, stderr, exit_code = \
-                self.spec.evaluate(self.system.config)
+            with self.journal_lock:
+                journal_key = System._get_spec_journal_key(self.token)
+
+            self.system.journal.record_started(journal_key)
+            try:
+                self._evaluate()
+
+            finally:
+                self.system.journal.record_finished(journal_key)
+
+        def _evaluate(self):
+            try:
+                all_results, stdout, stderr, exit_code = \
+                    self.spec.evaluate(self.system.config, self._set_process,
+                                       self.set_peak_memory)
+
+            except RuntimeError:
+                if self.cancelled:
+                    # an interrupted oscap leaves no results behind, that's
+                    # expected
+                    logging.info("Evaluation of spec '%s' was cancelled.",
+                                 self.spec)
+                    return
+
+                raise
+
+            if self.cancelled:
+                # nobody is going to collect the results
+                return
 
             arf = None
             if all_results is not None:
                 arf = all_results["arf"]
 
-            with self.system.async_eval_spec_results_lock:
-                self.system.async_eval_spec_results[self.token] = \
-                    (arf, stdout, stderr, exit_code)
+            self.system.async_eval_spec_results.put(
+                self.token, (arf, stdout, stderr, exit_code)
+            )
 
         def __str__(self):
             return "Evaluate Spec '%s'" % (self.spec)
 
-    def evaluate_spec_async(self, spec):
-        return self.async_manager.enqueue(
-            System.AsyncEvaluateSpecAction(
-                self,
-                spec
-            ),
-            EVALUATION_PRIORITY
-        )
+    def evaluate_spec_async(self, spec, caller=None):
+        """Enqueues evaluation of given spec and returns a token to collect
+        its results with. Raises async_tools.QueueFull if too many
+        evaluations, or too many evaluations requested by caller, are pending.
+        """
+
+        action = System.AsyncEvaluateSpecAction(self, spec)
+        with action.journal_lock:
+            token = self.async_manager.enqueue(
+                action, EVALUATION_PRIORITY, caller
+            )
+            self.journal.record_enqueued(
+                System._get_spec_journal_key(token),
+                {"kind": "evaluate_spec", "token": token,
+                 "spec": spec.to_xml_source().decode("utf-8")}
+            )
+
+        return token
+
+    @staticmethod
+    def _get_spec_journal_key(token):
+        return "spec-%i" % (token)
+
+    @staticmethod
+    def _get_task_journal_key(task_id):
+        return "task-%i" % (task_id)
+
+    def cancel_evaluate_spec_async(self, token):
+        """Cancels evaluation started by evaluate_spec_async. Pending
+        evaluations never start, running oscap is terminated and its work in
+        progress directory is removed. Results that haven't been collected yet
+        are thrown away.
+        """
+
+        action = self.async_manager.get_action(token)
+        if isinstance(action, System.AsyncEvaluateSpecAction):
+            self.async_manager.cancel(token)
+            self.journal.record_finished(System._get_spec_journal_key(token))
+
+        self.async_eval_spec_results.discard(token)
 
     def get_evaluate_spec_async_results(self, token):
-        with self.async_eval_spec_results_lock:
-            if token not in self.async_eval_spec_results:
-                raise ResultsNotAvailable()
+        try:
+            arf, stdout, stderr, exit_code = \
+                self.async_eval_spec_results.take(token)
 
-            arf, stdout, stderr, exit_code = self.async_eval_spec_results[token]
-            del self.async_eval_spec_results[token]
+        except KeyError:
+            raise ResultsNotAvailable()
 
         return arf, stdout, stderr, exit_code
 
@@ -135,9 +347,16 @@ class System(object):
         logging.info("Loading task definitions from '%s'...",
                      self.config.tasks_dir)
         task_files = os.listdir(self.config.tasks_dir)
+        self.task_index.load()
 
         task_count = 0
+        parsed_count = 0
+        next_update_times = []
         for task_file in task_files:
+            if task_file.startswith("."):
+                # the task ID counter and temporary files of Task.save_as
+                continue
+
             if not task_file.endswith(".xml"):
                 logging.warning(
                     "Found '%s' in task definitions directory '%s'. Paths "
@@ -157,21 +376,175 @@ class System(object):
                 continue
 
             id_ = Task.get_task_id_from_filepath(full_path)
+            summary = self.task_index.lookup(task_file, os.stat(full_path))
 
             with self.tasks_lock:
                 if id_ not in self.tasks:
                     self.tasks[id_] = Task()
 
-                self.tasks[id_].load(full_path)
+                task = self.tasks[id_]
+                if summary is not None:
+                    task.load_from_summary(summary, full_path)
+                else:
+                    task.load(full_path)
+                    parsed_count += 1
                 task_count += 1
 
+            # The default spread might have changed since the task was saved
+            with task.update_lock:
+                if task.schedule.apply_spread(
+                        task.id_, self.config.schedule_spread):
+                    task.save()
+                    summary = None
+
+                if summary is None:
+                    self.task_index.store(
+                        task_file, os.stat(full_path), task.to_summary()
+                    )
+
+            next_update_times.append(
+                (id_, System._get_schedule_index_time(task))
+            )
+
+        self.schedule_index.update_many(next_update_times)
+
+        self.task_index.prune(task_files)
+        try:
+            self.task_index.save()
+
+        except (IOError, OSError) as e:
+            logging.warning(
+                "Failed to save task index '%s', task definitions will be "
+                "parsed again on next start. %s", self.task_index.path, e
+            )
+
         with self.update_wait_cond:
             self.update_wait_cond.notify_all()
 
         logging.info(
-            "Successfully loaded %i task definitions.", task_count
+            "Successfully loaded %i task definitions, %i of them had to be "
+            "parsed.", task_count, parsed_count
         )
 
+    def reload_task_files(self, task_files=None):
+        """Loads task definitions that have been added or changed in tasks_dir
+        since they were loaded and forgets tasks whose definitions have been
+        removed. Takes names of the task files, None checks all of them.
+        Definitions written by the daemon itself are skipped.
+        """
+
+        if task_files is None:
+            task_files = set(task_file for task_file
+                             in os.listdir(self.config.tasks_dir)
+                             if task_file.endswith(".xml"))
+            with self.tasks_lock:
+                task_files.update(
+                    os.path.basename(task.config_file)
+                    for task in self.tasks.values()
+                    if task.file_stat is not None
+                )
+
+        changed = False
+        for task_file in sorted(task_files):
+            full_path = os.path.join(self.config.tasks_dir, task_file)
+            try:
+                id_ = Task.get_task_id_from_filepath(full_path)
+
+            except (ValueError, AssertionError):
+                logging.warning(
+                    "Found '%s' in task definitions directory '%s'. Its name "
+                    "is not a task ID.", task_file, self.config.tasks_dir
+                )
+                continue
+
+            with self.tasks_lock:
+                task = self.tasks.get(id_)
+
+            try:
+                file_stat = Task.get_file_stat(full_path)
+
+            except OSError:
+                file_stat = None
+
+            if file_stat is None:
+                # Tasks that have never been saved have no file yet
+                if task is not None and task.file_stat is not None:
+                    self._forget_task(task)
+                    changed = True
+
+                continue
+
+            if task is not None and task.file_stat == file_stat:
+                continue
+
+            new_task = task is None
+            if new_task:
+                task = Task()
+
+            with task.update_lock:
+                try:
+                    task.load(full_path)
+
+                except Exception as e:
+                    logging.error(
+                        "Failed to load task definition '%s'. %s",
+                        full_path, e
+                    )
+                    continue
+
+                if task.schedule.apply_spread(
+                        task.id_, self.config.schedule_spread):
+                    task.save()
+
+            if new_task:
+                with self.tasks_lock:
+                    if id_ in self.tasks:
+                        # created by a client meanwhile, the client wins
+                        continue
+
+                    self.tasks[id_] = task
+
+            self._update_schedule_index(task)
+            changed = True
+            logging.info(
+                "%s task with ID %i from '%s'.",
+                "Loaded new" if new_task else "Reloaded", id_, full_path
+            )
+
+        if changed:
+            with self.update_wait_cond:
+                self.update_wait_cond.notify_all()
+
+    def _forget_task(self, task):
+        with self.tasks_lock:
+            if self.tasks.get(task.id_) is not task:
+                return
+
+            del self.tasks[task.id_]
+
+        self.schedule_index.remove(task.id_)
+        self._cancel_task_save(task.id_)
+        logging.info(
+            "Definition of task with ID %i has been removed from '%s', "
+            "forgetting the task. Its results are kept.",
+            task.id_, self.config.tasks_dir
+        )
+
+    def watch_tasks_dir(self):
+        """Starts reloading task definitions when they change in tasks_dir,
+        see reload_task_files. Uses inotify if available and polls tasks_dir
+        otherwise.
+        """
+
+        if self.tasks_dir_watcher is not None:
+            return
+
+        self.tasks_dir_watcher = TaskDirWatcher(
+            self.config.tasks_dir, self.reload_task_files,
+            self.config.tasks_dir_poll_interval
+        )
+        self.tasks_dir_watcher.start()
+
     def save_tasks(self):
         logging.info("Saving task definitions to '%s'...",
                      self.config.tasks_dir)
@@ -185,6 +558,91 @@ class System(object):
             "Successfully saved %i task definitions.", task_count
         )
 
+    def _save_task_later(self, task):
+        """Writes the task definition after Configuration.task_save_delay
+        seconds. Clients usually set several properties of a task in a row,
+        this way the definition is only written once.
+        """
+
+        if self.config.task_save_delay <= 0:
+            task.save()
+            return
+
+        with self.tasks_to_save_lock:
+            self.tasks_to_save.add(task.id_)
+            if self.tasks_to_save_timer is None:
+                self.tasks_to_save_timer = threading.Timer(
+                    self.config.task_save_delay, self._save_tasks_worker
+                )
+                self.tasks_to_save_timer.daemon = True
+                self.tasks_to_save_timer.start()
+
+    def _save_tasks_worker(self):
+        with self.tasks_to_save_lock:
+            self.tasks_to_save_timer = None
+
+        self.flush_task_saves(retry_busy=True)
+
+    def flush_task_saves(self, retry_busy=False):
+        """Writes definitions of all tasks with unsaved changes, call this
+        before shutting down.
+
+        Tasks that are being updated are retried after another delay if
+        retry_busy is True. Otherwise they are written right away, waiting for
+        the evaluation to finish could take minutes.
+        """
+
+        with self.tasks_to_save_lock:
+            task_ids = self.tasks_to_save
+            self.tasks_to_save = set()
+
+        for task_id in sorted(task_ids):
+            self._save_pending_task(task_id, retry_busy)
+
+    def _save_pending_task(self, task_id, retry_busy):
+        with self.tasks_lock:
+            task = self.tasks.get(task_id)
+
+        if task is None:
+            # removed meanwhile
+            return
+
+        locked = task.update_lock.acquire(False)
+        if not locked and retry_busy:
+            self._save_task_later(task)
+            return
+
+        try:
+            task.save()
+
+        except (IOError, OSError) as e:
+            logging.error(
+                "Failed to save definition of task '%i'. %s", task_id, e
+            )
+            if retry_busy:
+                self._save_task_later(task)
+
+        finally:
+            if locked:
+                task.update_lock.release()
+
+    def _flush_task_save(self, task_id):
+        """Writes definition of given task right away if it has unsaved
+        changes, for callers that need the file itself.
+        """
+
+        with self.tasks_to_save_lock:
+            if task_id not in self.tasks_to_save:
+                return
+
+            self.tasks_to_save.discard(task_id)
+
+        self._save_pending_task(task_id, False)
+
+    def _cancel_task_save(self, task_id):
+        with self.tasks_to_save_lock:
+            self.tasks_to_save.discard(task_id)
+
     def list_task_ids(self):
         ret = []
         with self.tasks_lock:
@@ -192,12 +650,34 @@ class System(object):
 
         return ret
 
+    def _get_last_task_id_on_disk(self):
+        ret = 0
+        with self.tasks_lock:
+            if self.tasks:
+                ret = max(self.tasks.keys())
+
+        # results may outlive the definition of their task, don't reuse
+        # the IDs of such tasks either
+        for dir_ in [self.config.tasks_dir, self.config.results_dir]:
+            for name in os.listdir(dir_):
+                try:
+                    ret = max(ret, int(os.path.splitext(name)[0]))
+                except ValueError:
+                    pass
+
+        return ret
+
     def create_task(self):
-        task_id = 1
+        # The counter reads the disk only if its file is missing, do that
+        # before taking tasks_lock.
+        self.task_id_counter.get_last()
 
         with self.tasks_lock:
-            while task_id in self.tasks:
-                task_id += 1
+            task_id = self.task_id_counter.allocate()
+            # Definitions may have been dropped into tasks_dir by other tools
+            while task_id in self.tasks or \
+                    os.path.exists(self._get_task_file_path(task_id)):
+                task_id = self.task_id_counter.allocate()
 
             task = Task()
             task.id_ = task_id
@@ -242,15 +722,34 @@ class System(object):
                     )
             else:
                 logging.debug("Remove task results before.")
-                task.remove_results(self.config)
+
+            # also removes the result ID counter, the task ID is never reused
+            task.remove_results(self.config, keep_result_ids=False)
             del self.tasks[task_id]
 
-        os.remove(self._get_task_file_path(task_id))
+        self.schedule_index.remove(task_id)
+        self._cancel_task_save(task_id)
+        self.result_chunk_reader.close(lambda key: key[0] == task_id)
+        task_file_path = self._get_task_file_path(task_id)
+        if os.path.exists(task_file_path):
+            # tasks that never had any property set were never written
+            os.remove(task_file_path)
         logging.info("Removed task '%i'.", task_id)
 
     def _get_task_file_path(self, task_id):
         return os.path.join(self.config.tasks_dir, "%i.xml" % (task_id))
 
+    @staticmethod
+    def _get_schedule_index_time(task):
+        # Tasks that should be run once outside their schedule are due right
+        # away, datetime.min makes sure they end up first in the index.
+        return task.get_next_update_time(datetime.min)
+
+    def _update_schedule_index(self, task):
+        self.schedule_index.update(
+            task.id_, System._get_schedule_index_time(task)
+        )
+
     def remove_task_results(self, task_id):
         task = None
 
@@ -260,6 +759,8 @@ class System(object):
         with task.update_lock:
             task.remove_results(self.config)
 
+        self.result_chunk_reader.close(lambda key: key[0] == task_id)
+
     def remove_task_result(self, task_id, result_id):
         task = None
 
@@ -269,6 +770,10 @@ class System(object):
         with task.update_lock:
             task.remove_result(result_id, self.config)
 
+        self.result_chunk_reader.close(
+            lambda key: key == (task_id, int(result_id))
+        )
+
     def set_task_enabled(self, task_id, enabled):
         task = None
 
@@ -277,7 +782,9 @@ class System(object):
 
         with task.update_lock:
             task.enabled = bool(enabled)
-            task.save()
+            self._save_task_later(task)
+
+        self._update_schedule_index(task)
 
         logging.info(
             "%s task with ID %i.",
@@ -302,7 +809,7 @@ class System(object):
 
         with task.update_lock:
             task.title = title
-            task.save()
+            self._save_task_later(task)
 
         logging.info("Set title of task with ID %i to '%s'.", task_id, title)
 
@@ -320,7 +827,7 @@ class System(object):
 
         with task.update_lock:
             task.evaluation_spec.target = target
-            task.save()
+            self._save_task_later(task)
 
         logging.info("Set target of task with ID %i to '%s'.", task_id, target)
 
@@ -331,11 +838,46 @@ class System(object):
 
         return task.evaluation_spec.target
 
+    def set_task_post_evaluation(self, task_id, artifacts):
+        """Sets which artifacts of new results of given task are generated
+        right after the evaluation, see POST_EVALUATION_ARTIFACTS.
+        """
+
+        for artifact in artifacts:
+            if artifact not in POST_EVALUATION_ARTIFACTS:
+                raise RuntimeError(
+                    "Unknown post evaluation artifact '%s', expected one of "
+                    "%s." % (artifact, ", ".join(POST_EVALUATION_ARTIFACTS))
+                )
+
+        task = None
+        with self.tasks_lock:
+            task = self.tasks[task_id]
+
+        with task.update_lock:
+            task.post_evaluation = list(artifacts)
+            self._save_task_later(task)
+
+        logging.info(
+            "Set post evaluation artifacts of task with ID %i to '%s'.",
+            task_id, ", ".join(artifacts)
+        )
+
+    def get_task_post_evaluation(self, task_id):
+        task = None
+        with self.tasks_lock:
+            task = self.tasks[task_id]
+
+        return list(task.post_evaluation)
+
     def get_task_created_timestamp(self, task_id):
+        # the definition may not have been written yet, see _save_task_later
+        self._flush_task_save(task_id)
         task_path = self._get_task_file_path(task_id)
         return os.path.getctime(task_path)
 
     def get_task_modified_timestamp(self, task_id):
+        self._flush_task_save(task_id)
         task_path = self._get_task_file_path(task_id)
         return os.path.getmtime(task_path)
 
@@ -366,7 +908,7 @@ class System(object):
                     task_id
                 )
 
-            task.save()
+            self._save_task_later(task)
 
     def set_task_tailoring(self, task_id, tailoring):
         """tailoring can be an absolute file path or the XML source itself.
@@ -395,7 +937,7 @@ class System(object):
                     task_id
                 )
 
-            task.save()
+            self._save_task_later(task)
 
     def set_task_profile_id(self, task_id, profile_id):
         task = None
@@ -408,7 +950,7 @@ class System(object):
 
         with task.update_lock:
             task.evaluation_spec.profile_id = profile_id
-            task.save()
+            self._save_task_later(task)
 
         logging.info(
             "Set profile ID of task with ID %i to '%s'.", task_id, profile_id
@@ -422,7 +964,7 @@ class System(object):
 
         with task.update_lock:
             task.evaluation_spec.online_remediation = bool(remediation_enabled)
-            task.save()
+            self._save_task_later(task)
 
         logging.info(
             "%s online remediation of task with ID %i.",
@@ -437,7 +979,12 @@ class System(object):
 
         with task.update_lock:
             task.schedule.not_before = schedule_not_before
-            task.save()
+            # the new not_before hasn't been moved yet
+            task.schedule.spread_offset = 0
+            task.schedule.apply_spread(task.id_, self.config.schedule_spread)
+            self._save_task_later(task)
+
+        self._update_schedule_index(task)
 
         logging.info(
             "Set schedule not before of task with ID %i to %s.",
@@ -458,7 +1005,10 @@ class System(object):
 
         with task.update_lock:
             task.schedule.repeat_after = schedule_repeat_after
-            task.save()
+            task.schedule.apply_spread(task.id_, self.config.schedule_spread)
+            self._save_task_later(task)
+
+        self._update_schedule_index(task)
 
         logging.info(
             "Set schedule repeat after of task with ID %i to %s.",
@@ -471,45 +1021,319 @@ class System(object):
             with self.update_wait_cond:
                 self.update_wait_cond.notify_all()
 
-    def get_closest_datetime(self, reference_datetime):
-        ret = None
+    def set_task_schedule_spread(self, task_id, schedule_spread):
+        task = None
 
         with self.tasks_lock:
-            for task in self.tasks.values():
-                if task.id_ in self.tasks_scheduled:
-                    continue
+            task = self.tasks[task_id]
 
-                next_update_time = task.get_next_update_time(reference_datetime)
-                if next_update_time is None:
-                    continue
+        with task.update_lock:
+            # negative values mean use the default from config
+            task.schedule.spread = \
+                schedule_spread if schedule_spread >= 0 else None
+            task.schedule.apply_spread(task.id_, self.config.schedule_spread)
+            self._save_task_later(task)
 
-                if ret is None or next_update_time < ret:
-                    ret = next_update_time
+        self._update_schedule_index(task)
 
-        return ret
+        logging.info(
+            "Set schedule spread of task with ID %i to %s.",
+            task_id, task.schedule.spread
+        )
+
+        if task.enabled:
+            with self.update_wait_cond:
+                self.update_wait_cond.notify_all()
+
+    def get_task_schedule_spread(self, task_id):
+        task = None
+        with self.tasks_lock:
+            task = self.tasks[task_id]
+
+        if task.schedule.spread is None:
+            return -1
+
+        return task.schedule.spread
+
+    def set_task_schedule_max_catch_up(self, task_id, max_catch_up):
+        task = None
+
+        with self.tasks_lock:
+            task = self.tasks[task_id]
+
+        with task.update_lock:
+            task.schedule.max_catch_up = max_catch_up
+            self._save_task_later(task)
+
+        logging.info(
+            "Set schedule max catch up of task with ID %i to %i.",
+            task_id, max_catch_up
+        )
+
+    def get_task_schedule_max_catch_up(self, task_id):
+        task = None
+        with self.tasks_lock:
+            task = self.tasks[task_id]
+
+        return task.schedule.max_catch_up
+
+    def get_closest_datetime(self, reference_datetime):
+        closest = self.schedule_index.peek()
+        if closest is None:
+            return None
+
+        next_update_time, _ = closest
+        return next_update_time
 
     class AsyncUpdateTaskAction(async_tools.AsyncAction):
-        def __init__(self, system, task_id, reference_datetime):
+        def __init__(self, system, task_id, reference_datetime, target,
+                     catch_up=False, equivalent_task_ids=()):
             super(System.AsyncUpdateTaskAction, self).__init__()
 
             self.system = system
             self.task_id = task_id
             self.reference_datetime = reference_datetime
+            # tasks with the same target are never updated in parallel
+            self.lane = target
+            # catch-up runs take a slot of the catch-up budget
+            self.catch_up = catch_up
+            # tasks that get results of this evaluation instead of running
+            # their own
+            self.equivalent_task_ids = list(equivalent_task_ids)
 
         def run(self):
             task = None
-            with self.system.tasks_lock:
-                task = self.system.tasks[self.task_id]
+            equivalent_tasks = []
+            try:
+                with self.system.tasks_lock:
+                    task = self.system.tasks[self.task_id]
+                    for task_id in self.equivalent_task_ids:
+                        # may have been removed meanwhile
+                        if task_id in self.system.tasks:
+                            equivalent_tasks.append(
+                                self.system.tasks[task_id]
+                            )
+
+                journal = self.system.journal
+                for updated_task in [task] + equivalent_tasks:
+                    journal.record_started(
+                        System._get_task_journal_key(updated_task.id_)
+                    )
+
+                stored = task.update(
+                    self.reference_datetime, self.system.config,
+                    self.set_peak_memory, equivalent_tasks
+                )
 
-            task.update(self.reference_datetime, self.system.config)
+                # one-off runs are done once the flag is gone
+                for updated_task in [task] + equivalent_tasks:
+                    if not updated_task.run_outside_schedule_once:
+                        journal.record_finished(
+                            System._get_task_journal_key(updated_task.id_)
+                        )
 
-            with self.system.tasks_lock:
-                self.system.tasks_scheduled.remove(task.id_)
+            finally:
+                # Even if the update failed, schedule_tasks has taken the tasks
+                # out of the index and would never see them again otherwise.
+                released = []
+                with self.system.tasks_lock:
+                    if self.catch_up:
+                        released = \
+                            self.system._release_catch_up_slot_locked()
+
+                    self.system.tasks_scheduled.discard(self.task_id)
+                    for task_id in self.equivalent_task_ids:
+                        self.system.tasks_scheduled.discard(task_id)
+
+                self.system._enqueue_released_catch_up_tasks(released)
+
+                # update moves the schedule forward, put the tasks back into
+                # the index with their new next update time
+                if task is not None:
+                    self.system._update_schedule_index(task)
+                for equivalent_task in equivalent_tasks:
+                    self.system._update_schedule_index(equivalent_task)
+
+                if self.catch_up:
+                    # the rest of the backlog is due already, don't wait for
+                    # the scheduler to wake up on its own
+                    with self.system.update_wait_cond:
+                        self.system.update_wait_cond.notify_all()
+
+            for updated_task, result_id in stored:
+                self.system._enqueue_post_evaluation(updated_task, result_id)
 
         def __str__(self):
             return "Update Task '%i' with reference_datetime='%s'" \
                    % (self.task_id, self.reference_datetime)
 
+    class AsyncPostEvaluationAction(async_tools.AsyncAction):
+        """Generates artifacts of a new result, see Task.post_evaluation.
+        """
+
+        def __init__(self, system, task_id, result_id, artifacts):
+            super(System.AsyncPostEvaluationAction, self).__init__()
+
+            self.system = system
+            self.task_id = task_id
+            self.result_id = result_id
+            self.artifacts = list(artifacts)
+
+        def run(self):
+            task = None
+            with self.system.tasks_lock:
+                # may have been removed meanwhile
+                task = self.system.tasks.get(self.task_id)
+
+            if task is None:
+                return
+
+            for artifact in self.artifacts:
+                if self.cancelled:
+                    break
+
+                try:
+                    task.generate_artifact_for_result(
+                        self.result_id, self.system.config, artifact
+                    )
+
+                except Exception:
+                    # clients asking for the artifact will get the error
+                    logging.exception(
+                        "Failed to generate %s of result '%i' of task '%i'.",
+                        artifact, self.result_id, self.task_id
+                    )
+                    continue
+
+                logging.debug(
+                    "Generated %s of result '%i' of task '%i'.",
+                    artifact, self.result_id, self.task_id
+                )
+
+        def __str__(self):
+            return "Generate %s of result '%i' of Task '%i'" \
+                   % (", ".join(self.artifacts), self.result_id, self.task_id)
+
+    def _enqueue_post_evaluation(self, task, result_id):
+        if not task.post_evaluation:
+            return
+
+        action = System.AsyncPostEvaluationAction(
+            self, task.id_, result_id, task.post_evaluation
+        )
+        # oscap parses the whole result to generate reports and fixes, let
+        # the resource governor decide when that may start
+        action.resource_key = task.evaluation_spec.get_resource_key()
+        self.async_manager.enqueue(action, POST_EVALUATION_PRIORITY)
+
+    def _group_equivalent_tasks(self, tasks, reference_datetime):
+        """Splits tasks into lists of tasks with equivalent EvaluationSpec,
+        each list needs only one evaluation. Catch-up runs are never grouped,
+        they are limited separately.
+        """
+
+        if not self.config.coalesce_evaluations:
+            return [[task] for task in tasks]
+
+        ret = []
+        # Equivalent specs have the same content key, the digests of their
+        # contents are cached so this doesn't read the contents every time.
+        groups = {}
+        for task in tasks:
+            if task.schedule.is_catching_up(reference_datetime):
+                ret.append([task])
+                continue
+
+            spec = task.evaluation_spec
+            key = (spec.target, spec.result_format, spec.online_remediation,
+                   tuple(spec.cpe_hints), spec.get_content_key())
+            group = groups.get(key)
+            if group is None:
+                group = []
+                groups[key] = group
+                ret.append(group)
+
+            group.append(task)
+
+        return ret
+
+    def _enqueue_task_update_locked(self, task, reference_datetime,
+                                    equivalent_task_ids=(), resource_key=None):
+        """resource_key of the task is computed if it's not given, that may
+        hash its SCAP content.
+        """
+
+        catch_up = task.schedule.is_catching_up(reference_datetime)
+        if catch_up:
+            if self.config.catch_up_jobs > 0 and \
+               self.catch_up_running >= self.config.catch_up_jobs:
+                logging.debug(
+                    "Task '%i' is catching up on missed runs, waiting for "
+                    "a free catch-up slot.", task.id_
+                )
+                self.catch_up_pending.append((task.id_, reference_datetime))
+                return
+
+            self.catch_up_running += 1
+
+        action = System.AsyncUpdateTaskAction(
+            self,
+            task.id_,
+            reference_datetime,
+            task.evaluation_spec.target,
+            catch_up,
+            equivalent_task_ids
+        )
+        if resource_key is None:
+            resource_key = task.evaluation_spec.get_resource_key()
+        action.resource_key = resource_key
+        self.async_manager.enqueue(action, TASK_ACTION_PRIORITY)
+
+    def _release_catch_up_slot_locked(self):
+        """Frees a catch-up slot and returns (task, reference_datetime) of
+        tasks that were waiting for one. Pass them to
+        _enqueue_released_catch_up_tasks after releasing tasks_lock.
+        """
+
+        self.catch_up_running -= 1
+
+        ret = []
+        while self.catch_up_pending and \
+                (self.config.catch_up_jobs <= 0 or
+                 self.catch_up_running + len(ret) <
+                 self.config.catch_up_jobs):
+            task_id, reference_datetime = self.catch_up_pending.popleft()
+            task = self.tasks.get(task_id)
+            if task is None:
+                # removed while waiting
+                self.tasks_scheduled.discard(task_id)
+                continue
+
+            ret.append((task, reference_datetime))
+
+        return ret
+
+    def _enqueue_released_catch_up_tasks(self, released):
+        """Enqueues updates of tasks returned by
+        _release_catch_up_slot_locked. Computing their resource keys may hash
+        SCAP content, that's done without holding tasks_lock.
+        """
+
+        keyed = [(task, reference_datetime,
+                  task.evaluation_spec.get_resource_key())
+                 for task, reference_datetime in released]
+
+        with self.tasks_lock:
+            for task, reference_datetime, resource_key in keyed:
+                if self.tasks.get(task.id_) is not task:
+                    # removed meanwhile
+                    self.tasks_scheduled.discard(task.id_)
+                    continue
+
+                self._enqueue_task_update_locked(
+                    task, reference_datetime, (), resource_key
+                )
+
     def schedule_tasks(self, reference_datetime=None):
         """Evaluates all currently outstanding tasks and returns.
         Outstanding task means it's not_before is lower than reference_datetime,
@@ -529,22 +1353,167 @@ class System(object):
             str(reference_datetime)
         )
 
+        due_task_ids = self.schedule_index.pop_due(reference_datetime)
+
+        due_tasks = []
         with self.tasks_lock:
-            for task in self.tasks.values():
+            for task_id in due_task_ids:
+                task = self.tasks.get(task_id)
+                if task is None:
+                    continue
+
+                # The task is already being updated, AsyncUpdateTaskAction
+                # puts it back into the index when it's done.
                 if task.id_ in self.tasks_scheduled:
                     continue
 
                 if task.should_be_updated(reference_datetime):
+                    due_tasks.append(task)
+
+                else:
+                    self._update_schedule_index(task)
+
+        # Tasks with equivalent specs that are due together share one oscap
+        # run. Grouping parses task definitions and may hash SCAP contents,
+        # that must not block clients waiting for tasks_lock.
+        groups = [
+            (group, group[0].evaluation_spec.get_resource_key())
+            for group in self._group_equivalent_tasks(due_tasks,
+                                                      reference_datetime)
+        ]
+
+        with self.tasks_lock:
+            for group, resource_key in groups:
+                # removed or scheduled by somebody else meanwhile
+                group = [task for task in group
+                         if self.tasks.get(task.id_) is task and
+                         task.id_ not in self.tasks_scheduled]
+                if not group:
+                    continue
+
+                for task in group:
                     self.tasks_scheduled.add(task.id_)
+
+                self._enqueue_task_update_locked(
+                    group[0], reference_datetime,
+                    [task.id_ for task in group[1:]], resource_key
+                )
+
+                if len(group) > 1:
+                    logging.info(
+                        "Tasks %s have equivalent evaluation specs, "
+                        "evaluating them only once.",
+                        ", ".join(str(task.id_) for task in group)
+                    )
+
+    def resume_journal(self):
+        """Picks up work that was accepted before the daemon went down.
+        Evaluations that haven't finished are enqueued again under their old
+        tokens so that callers can still collect the results, one-off task
+        runs are scheduled again. Their work in progress directories have
+        been removed by Configuration.prepare_dirs already.
+
+        Has to be called after load_tasks.
+        """
+
+        if self.journal_resumed:
+            return
+        self.journal_resumed = True
+
+        records = self.journal.load()
+        for record, started in records:
+            key = record["key"]
+            try:
+                if record["kind"] == "evaluate_spec":
+                    spec = EvaluationSpec()
+                    spec.load_from_xml_source(record["spec"].encode("utf-8"))
                     self.async_manager.enqueue(
-                        System.AsyncUpdateTaskAction(
-                            self,
-                            task.id_,
-                            reference_datetime
-                        ),
-                        TASK_ACTION_PRIORITY
+                        System.AsyncEvaluateSpecAction(self, spec),
+                        EVALUATION_PRIORITY, None, record["token"]
                     )
 
+                elif record["kind"] == "run_task":
+                    task = None
+                    with self.tasks_lock:
+                        task = self.tasks[record["task_id"]]
+
+                    if not task.run_outside_schedule_once:
+                        task.run_outside_schedule()
+                    self._update_schedule_index(task)
+
+                else:
+                    raise RuntimeError(
+                        "Unknown kind of journal record '%s'." %
+                        (record["kind"])
+                    )
+
+            except Exception as e:
+                logging.warning(
+                    "Failed to resume '%s' from the journal, dropping it. %s",
+                    key, e
+                )
+                self.journal.record_finished(key)
+                continue
+
+            logging.info(
+                "Resumed '%s' from the journal%s.", key,
+                ", it was interrupted while running" if started else ""
+            )
+
+        if records:
+            with self.update_wait_cond:
+                self.update_wait_cond.notify_all()
+
+    def evaluate_spec(self, spec):
+        """Evaluates given spec right away and returns its results. Blobs of
+        the spec are kept until the evaluation finishes.
+        """
+
+        blobs = spec.get_blobs()
+        with self.blobs_in_use_lock:
+            self.blobs_in_use.extend(blobs)
+
+        try:
+            return spec.evaluate(self.config)
+
+        finally:
+            with self.blobs_in_use_lock:
+                for digest in blobs:
+                    self.blobs_in_use.remove(digest)
+
+    def collect_blobs(self, min_age=60 * 60):
+        """Removes embedded contents that no task and no pending evaluation
+        refers to anymore and that are older than min_age seconds. Has to be
+        called after resume_journal.
+        """
+
+        with self.blobs_in_use_lock:
+            referenced = set(self.blobs_in_use)
+
+        with self.tasks_lock:
+            tasks = list(self.tasks.values())
+
+        for task in tasks:
+            referenced.update(task.get_blobs())
+
+        for record in self.journal.get_records():
+            if "spec" not in record:
+                continue
+
+            spec = EvaluationSpec()
+            try:
+                spec.load_from_xml_source(record["spec"].encode("utf-8"))
+
+            except RuntimeError:
+                # refers to a blob that is gone already
+                continue
+
+            referenced.update(spec.get_blobs())
+
+        removed = self.blob_store.collect_garbage(referenced, min_age)
+        if removed > 0:
+            logging.info("Removed %i unreferenced blobs.", removed)
+
     def schedule_tasks_worker(self):
         while True:
             reference_datetime = datetime.now()
@@ -574,6 +1543,13 @@ class System(object):
 
             self.schedule_tasks(reference_datetime)
 
+            # We wake up at least once an hour, a good time to throw away
+            # results nobody came for.
+            self.async_eval_spec_results.evict_expired()
+            self.async_eval_cve_scanner_worker_results.evict_expired()
+            # and contents of evaluated specs and replaced task inputs
+            self.collect_blobs()
+
     def generate_guide_for_task(self, task_id):
         task = None
         with self.tasks_lock:
@@ -594,6 +1570,11 @@ class System(object):
             task = self.tasks[task_id]
 
         task.run_outside_schedule()
+        self.journal.record_enqueued(
+            System._get_task_journal_key(task_id),
+            {"kind": "run_task", "task_id": task_id}
+        )
+        self._update_schedule_index(task)
 
         with self.update_wait_cond:
             self.update_wait_cond.notify_all()
@@ -606,6 +1587,18 @@ class System(object):
         # TODO: Is this a race condition? look into task.update
         return task.list_result_ids(self.config.results_dir)
 
+    def get_task_results_metadata(self, task_id):
+        """Returns a list of (result_id, metadata) tuples of all results of
+        given task, see Task.get_results_metadata. Serves result listings
+        without opening every result.
+        """
+
+        task = None
+        with self.tasks_lock:
+            task = self.tasks[task_id]
+
+        return task.get_results_metadata(self.config.results_dir)
+
     def get_task_result_created_timestamp(self, task_id, result_id):
         task = None
         with self.tasks_lock:
@@ -620,6 +1613,68 @@ class System(object):
 
         return task.get_xml_of_result(result_id, self.config)
 
+    def read_xml_of_task_result(self, task_id, result_id, offset, length):
+        """Returns up to length bytes of XML of given result starting at
+        offset, an empty result means offset is past the end. Reading the XML
+        chunk after chunk from the start is as cheap as reading it at once,
+        even if the result is compressed.
+        """
+
+        if offset < 0 or length < 0:
+            raise ValueError(
+                "Invalid offset %i or length %i." % (offset, length)
+            )
+
+        task = None
+        with self.tasks_lock:
+            task = self.tasks[task_id]
+
+        return self.result_chunk_reader.read(
+            (task_id, int(result_id)),
+            lambda: task.open_xml_of_result(result_id, self.config),
+            offset, min(length, MAX_RESULT_CHUNK_LENGTH)
+        )
+
+    def open_xml_of_task_result(self, task_id, result_id):
+        """Returns a file descriptor the XML of given result can be read
+        from, the caller is responsible for closing it. Uncompressed results
+        are opened directly, compressed results are decompressed into a pipe
+        by a helper thread.
+        """
+
+        task = None
+        with self.tasks_lock:
+            task = self.tasks[task_id]
+
+        path = task.get_xml_path_of_result(result_id, self.config)
+        actual_path, method = compression.find(path)
+        if method == "none":
+            return os.open(actual_path, os.O_RDONLY)
+
+        stream = compression.open_file(path)
+        read_fd, write_fd = os.pipe()
+
+        def pump():
+            try:
+                with io.open(write_fd, "wb") as target:
+                    shutil.copyfileobj(stream, target, 1024 * 1024)
+
+            except (IOError, OSError) as e:
+                # the reader went away before reading everything
+                logging.debug(
+                    "Stopped decompressing result '%s' of task '%i'. %s",
+                    result_id, task_id, e
+                )
+
+            finally:
+                stream.close()
+
+        thread = threading.Thread(target=pump)
+        thread.daemon = True
+        thread.start()
+
+        return read_fd
+
     def get_stdout_of_task_result(self, task_id, result_id):
         task = None
         with self.tasks_lock:
@@ -651,6 +1706,13 @@ class System(object):
             self.config
         )
 
+    def generate_summary_for_task_result(self, task_id, result_id):
+        task = None
+        with self.tasks_lock:
+            task = self.tasks[task_id]
+
+        return task.generate_summary_for_result(result_id, self.config)
+
     def generate_fix_for_task_result(self, task_id, result_id, fix_type):
         task = None
         with self.tasks_lock:
@@ -672,28 +1734,47 @@ class System(object):
         def run(self):
             json_result = self.worker.start_application()
 
-            with self.system.async_eval_cve_scanner_worker_results_lock:
-                self.system.async_eval_cve_scanner_worker_results[self.token] = \
-                    json_result
+            if self.cancelled:
+                return
+
+            self.system.async_eval_cve_scanner_worker_results.put(
+                self.token, json_result
+            )
 
         def __str__(self):
             return "Evaluate CVE Scanner Worker '%s'" % (self.worker)
 
-    def evaluate_cve_scanner_worker_async(self, worker):
+    def evaluate_cve_scanner_worker_async(self, worker, caller=None):
+        """See evaluate_spec_async, the same limits apply.
+        """
+
         return self.async_manager.enqueue(
             System.AsyncEvaluateCVEScannerWorkerAction(
                 self,
                 worker
             ),
-            EVALUATION_PRIORITY
+            EVALUATION_PRIORITY,
+            caller
         )
 
+    def cancel_evaluate_cve_scanner_worker_async(self, token):
+        """Cancels CVE scan started by evaluate_cve_scanner_worker_async.
+        Only pending scans can be cancelled, running scans finish but their
+        results are thrown away.
+        """
+
+        action = self.async_manager.get_action(token)
+        if isinstance(action, System.AsyncEvaluateCVEScannerWorkerAction):
+            self.async_manager.cancel(token)
+
+        self.async_eval_cve_scanner_worker_results.discard(token)
+
     def get_evaluate_cve_scanner_worker_async_results(self, token):
-        with self.async_eval_cve_scanner_worker_results_lock:
-            if token not in self.async_eval_cve_scanner_worker_results:
-                raise ResultsNotAvailable()
+        try:
+            json_results = \
+                self.async_eval_cve_scanner_worker_results.take(token)
 
-            json_results = self.async_eval_cve_scanner_worker_results[token]
-            del self.async_eval_cve_scanner_worker_results[token]
+        except KeyError:
+            raise ResultsNotAvailable()
 
         return json_results
@@ -21,16 +21,24 @@
 from openscap_daemon import et_helpers
 from openscap_daemon import oscap_helpers
 from openscap_daemon import evaluation_spec
+from openscap_daemon.counter import PersistentCounter
+from openscap_daemon import results_index
+from openscap_daemon import compression
+from openscap_daemon import result_artifacts
 
 try:
     import xml.etree.cElementTree as ElementTree
 except ImportError:
     import xml.etree.ElementTree as ElementTree
 from datetime import datetime, timedelta
+import hashlib
 import os.path
+import tempfile
 import shutil
 import threading
 import logging
+import time
+import json
 import io
 
 
@@ -78,17 +86,63 @@ class SlipMode(object):
         return "unknown"
 
 
+def _total_microseconds(delta):
+    # timedelta // timedelta is not available in python2
+    return (delta.days * 24 * 60 * 60 + delta.seconds) * 1000000 + \
+        delta.microseconds
+
+
+def _link_tree(source_dir, parent_dir):
+    """Creates a uniquely named copy of source_dir in parent_dir and returns
+    its path. Files are hardlinked where possible, results are never modified
+    in place so sharing them is safe.
+    """
+
+    ret = tempfile.mkdtemp(prefix="", suffix="", dir=parent_dir)
+    for dirpath, dirnames, filenames in os.walk(source_dir):
+        target_dirpath = os.path.join(
+            ret, os.path.relpath(dirpath, source_dir)
+        )
+        for dirname in dirnames:
+            os.mkdir(os.path.join(target_dirpath, dirname))
+
+        for filename in filenames:
+            source = os.path.join(dirpath, filename)
+            target = os.path.join(target_dirpath, filename)
+            try:
+                os.link(source, target)
+
+            except OSError:
+                # different filesystems or no hardlink support
+                shutil.copy2(source, target)
+
+    return ret
+
+
 class Schedule(object):
     def __init__(self):
         self.not_before = None
         self.repeat_after = 0
         self.slip_mode = SlipMode.DROP_MISSED_ALIGNED
+        # Window in minutes the runs of this task are spread over, None means
+        # use the default from config
+        self.spread = None
+        # How many minutes not_before has been moved by because of the spread
+        self.spread_offset = 0
+        # How many missed runs of a no_slip task are run after downtime, older
+        # missed runs are coalesced into them.
+        # -1 means use the default from config
+        # -2 means run all missed runs
+        self.max_catch_up = -1
 
     def is_equivalent_to(self, other):
         return \
             self.not_before == other.not_before and \
             self.repeat_after == other.repeat_after and \
-            self.slip_mode == other.slip_mode
+            self.slip_mode == other.slip_mode and \
+            self.spread == other.spread and \
+            self.spread_offset == other.spread_offset and \
+            self.max_catch_up == other.max_catch_up
 
     def load_from_xml_element(self, element):
         schedule_not_before_attr = element.get("not_before")
@@ -113,6 +167,45 @@ class Schedule(object):
             element.get("slip_mode", "drop_missed_aligned")
         )
 
+        schedule_spread_attr = element.get("spread")
+        if schedule_spread_attr is not None:
+            self.spread = int(schedule_spread_attr)
+        else:
+            self.spread = None
+
+        self.spread_offset = int(element.get("spread_offset", "0"))
+
+        self.max_catch_up = int(element.get("max_catch_up", "-1"))
+
+    def load_from_dict(self, data):
+        """Loads the schedule from a dict made by to_dict, see TaskIndex.
+        """
+
+        not_before = data.get("not_before")
+        if not_before is not None:
+            self.not_before = datetime.strptime(not_before, "%Y-%m-%dT%H:%M")
+        else:
+            self.not_before = None
+
+        self.repeat_after = data.get("repeat_after")
+        self.slip_mode = SlipMode.from_string(
+            data.get("slip_mode", "drop_missed_aligned")
+        )
+        self.spread = data.get("spread")
+        self.spread_offset = data.get("spread_offset", 0)
+        self.max_catch_up = data.get("max_catch_up", -1)
+
+    def to_dict(self):
+        return {
+            "not_before": self.not_before.strftime("%Y-%m-%dT%H:%M")
+            if self.not_before is not None else None,
+            "repeat_after": self.repeat_after,
+            "slip_mode": SlipMode.to_string(self.slip_mode),
+            "spread": self.spread,
+            "spread_offset": self.spread_offset,
+            "max_catch_up": self.max_catch_up
+        }
+
     def to_xml_element(self):
         ret = ElementTree.Element("schedule")
         if self.not_before is not None:
@@ -120,40 +213,125 @@ class Schedule(object):
 
         ret.set("repeat_after", str(self.repeat_after))
         ret.set("slip_mode", SlipMode.to_string(self.slip_mode))
+        if self.spread is not None:
+            ret.set("spread", str(self.spread))
+        if self.spread_offset != 0:
+            ret.set("spread_offset", str(self.spread_offset))
+        if self.max_catch_up != -1:
+            ret.set("max_catch_up", str(self.max_catch_up))
 
         return ret
 
-    def next_not_before(self, reference_datetime):
+    def apply_spread(self, key, default_spread=0):
+        """Moves not_before by an offset within the spread window, so that
+        tasks created at the same time with the same schedule don't all run
+        at the same instant.
+
+        The offset is derived from a hash of key, usually the task ID, it is
+        the same every time and doesn't depend on the python version. Only
+        repeated tasks are spread and the window is clamped to repeat_after,
+        a daily task is never moved by more than a day. Returns True if the schedule has changed.
+        """
+
+        window = self.spread if self.spread is not None else default_spread
+        if self.repeat_after is None or self.repeat_after <= 0:
+            # one-off tasks run when they were asked to
+            window = 0
+        else:
+            window = min(window, self.repeat_after * 60)
+
+        offset = 0
+        if window > 0:
+            digest = hashlib.sha1(str(key).encode("utf-8")).hexdigest()
+            offset = int(digest, 16) % window
+
+        if offset == self.spread_offset:
+            return False
+
+        if self.not_before is not None:
+            self.not_before += timedelta(minutes=offset - self.spread_offset)
+
+        self.spread_offset = offset
+        return True
+
+    def is_catching_up(self, reference_datetime):
+        """Returns True if a run at reference_datetime is a catch-up run,
+        another run of this no_slip task is due right after it.
+        """
+
+        if self.slip_mode != SlipMode.NO_SLIP or self.not_before is None:
+            return False
+
+        if self.repeat_after is None or self.repeat_after <= 0:
+            return False
+
+        return self.not_before + timedelta(hours=self.repeat_after) <= \
+            reference_datetime
+
+    def next_not_before(self, reference_datetime, default_max_catch_up=-2):
         """Calculates the next schedule_not_before based on
         schedule_repeat_after and schedule_slip_mode.
+
+        With no_slip at most max_catch_up missed runs are left before
+        reference_datetime, default_max_catch_up is used if the schedule
+        doesn't set it.
         """
 
         if self.not_before is None:
             # the task is already disabled, no need to schedule next run
             return None
 
-        if self.repeat_after is None:
+        if self.repeat_after is None or self.repeat_after <= 0:
             # task repetition is disabled
             return None
 
         if self.slip_mode == SlipMode.NO_SLIP:
-            return self.not_before + timedelta(hours=self.repeat_after)
+            period = timedelta(hours=self.repeat_after)
+            ret = self.not_before + period
+
+            max_catch_up = self.max_catch_up
+            if max_catch_up == -1:
+                max_catch_up = default_max_catch_up
+            if max_catch_up >= 0 and ret <= reference_datetime:
+                # Skip the oldest missed runs, the ones we keep stay aligned.
+                elapsed = _total_microseconds(reference_datetime - ret)
+                missed = elapsed // _total_microseconds(period) + 1
+                if missed > max_catch_up:
+                    ret += period * (missed - max_catch_up)
+
+            return ret
 
         elif self.slip_mode == SlipMode.DROP_MISSED:
             return reference_datetime + timedelta(hours=self.repeat_after)
 
         elif self.slip_mode == SlipMode.DROP_MISSED_ALIGNED:
-            candidate = self.not_before + timedelta(hours=self.repeat_after)
-
-            while candidate <= reference_datetime:
-                candidate += timedelta(hours=self.repeat_after)
+            # The first slot not_before + n * repeat_after, n >= 1, that
+            # is later than reference_datetime. Computed directly, tasks that
+            # haven't run for years would need a lot of iterations otherwise.
+            period = timedelta(hours=self.repeat_after)
+            elapsed = _total_microseconds(reference_datetime - self.not_before)
+            periods = max(1, elapsed // _total_microseconds(period) + 1)
 
-            return candidate
+            return self.not_before + period * periods
 
         else:
             raise RuntimeError("Unrecognized slip_mode.")
 
 
+# Artifacts that can be generated right after a new result is stored,
+# see Task.post_evaluation
+POST_EVALUATION_ARTIFACTS = [
+    "report", "summary", "bash_fix", "ansible_fix", "puppet_fix"
+]
+
+# file names of fix scripts stored next to results, by fix type
+_FIX_ARTIFACT_NAMES = {
+    "bash": "fix.sh",
+    "ansible": "fix.yml",
+    "puppet": "fix.pp"
+}
+
+
 class Task(object):
     """This class defined input content, tailoring, profile, ..., and schedule
     for an SCAP evaluation task.
@@ -167,24 +345,42 @@ class Task(object):
     def __init__(self):
         self.id_ = None
         self.config_file = None
+        # (inode, mtime, size) of config_file when it was last loaded or
+        # saved, None if the task has never been loaded or saved
+        self.file_stat = None
         self.enabled = False
 
         self.title = None
-        self.evaluation_spec = evaluation_spec.EvaluationSpec()
+        self._evaluation_spec = evaluation_spec.EvaluationSpec()
+        # True if the task has been loaded from a summary and
+        # the evaluation spec hasn't been parsed from config_file yet
+        self._evaluation_spec_pending = False
+        # blobs referenced by the evaluation spec that hasn't been parsed yet
+        self._summary_blobs = []
+        self._evaluation_spec_lock = threading.Lock()
 
         # How many results should we keep before pruning old results
         # -1 means use the default from config
         # -2 means never prune any results
         self.max_results_to_keep = -1
 
+        # Artifacts from POST_EVALUATION_ARTIFACTS generated in the background
+        # after every evaluation, clients asking for them later don't have
+        # to wait for oscap.
+        self.post_evaluation = []
+
         self.schedule = Schedule()
         # If True, this task will be evaluated once without affecting the
-        # schedule. This feature is important for test runs. This variable does
-        # not persist because it is not saved to the config file!
+        # schedule. This feature is important for test runs. This variable is
+        # not saved to the config file, System keeps it in its journal.
         self.run_outside_schedule_once = False
 
         # Prevents multiple updates of the same task running
         self.update_lock = threading.Lock()
+        # hands out result IDs, see _get_result_id_counter
+        self._result_id_counter = None
+        # metadata of results, see _get_results_index
+        self._results_index = None
 
     def __str__(self):
         ret = "Task from config file '%s' with:\n" % (self.config_file)
@@ -199,9 +395,55 @@ class Task(object):
         ret += "  - repeat after: \t%s\n" % (self.schedule.repeat_after)
         ret += "  - slip mode: \t%s\n" %\
                (SlipMode.to_string(self.schedule.slip_mode))
+        ret += "  - spread: \t%s\n" % \
+            ("default" if self.schedule.spread is None
+             else str(self.schedule.spread))
+        ret += "  - spread offset: \t%i\n" % (self.schedule.spread_offset)
+        ret += "  - max catch up: \t%s\n" % \
+            ("default" if self.schedule.max_catch_up == -1
+             else str(self.schedule.max_catch_up))
 
         return ret
 
+    @property
+    def evaluation_spec(self):
+        """Task definitions loaded from the task index only get their
+        evaluation spec parsed once it is needed, it is the bulk of the file.
+        """
+
+        with self._evaluation_spec_lock:
+            if self._evaluation_spec_pending:
+                tree = ElementTree.parse(self.config_file)
+                spec = evaluation_spec.EvaluationSpec()
+                spec.load_from_xml_element(
+                    et_helpers.get_element(tree.getroot(), "evaluation_spec")
+                )
+                self._evaluation_spec = spec
+                self._evaluation_spec_pending = False
+
+            return self._evaluation_spec
+
+    @evaluation_spec.setter
+    def evaluation_spec(self, value):
+        with self._evaluation_spec_lock:
+            self._evaluation_spec = value
+            self._evaluation_spec_pending = False
+
+    def is_evaluation_spec_loaded(self):
+        with self._evaluation_spec_lock:
+            return not self._evaluation_spec_pending
+
+    def get_blobs(self):
+        """Returns digests of embedded contents the task keeps in the blob
+        store, without parsing the evaluation spec.
+        """
+
+        with self._evaluation_spec_lock:
+            if self._evaluation_spec_pending:
+                return list(self._summary_blobs)
+
+            return self._evaluation_spec.get_blobs()
+
     def is_valid(self):
         if not self.evaluation_spec.is_valid():
             return False
@@ -220,6 +462,11 @@ class Task(object):
             self.schedule.is_equivalent_to(other.schedule) and \
             self.run_outside_schedule_once == other.run_outside_schedule_once
 
+    @staticmethod
+    def get_file_stat(filepath):
+        stat = os.stat(filepath)
+        return (stat.st_ino, stat.st_mtime, stat.st_size)
+
     @staticmethod
     def get_task_id_from_filepath(filepath):
         filename, extension = os.path.splitext(
@@ -244,6 +491,19 @@ class Task(object):
         self.max_results_to_keep = \
             int(et_helpers.get_element_text(root, "max-results-to-keep", "-1"))
 
+        self.post_evaluation = []
+        post_evaluation_element = root.find("post-evaluation")
+        if post_evaluation_element is not None:
+            for artifact_element in \
+                    post_evaluation_element.findall("artifact"):
+                if artifact_element.text not in POST_EVALUATION_ARTIFACTS:
+                    raise RuntimeError(
+                        "Unknown post evaluation artifact '%s'." %
+                        (artifact_element.text)
+                    )
+
+                self.post_evaluation.append(artifact_element.text)
+
         self.schedule = Schedule()
         self.schedule.load_from_xml_element(
             et_helpers.get_element(root, "schedule")
@@ -251,10 +511,48 @@ class Task(object):
 
         self.config_file = config_file
 
+    def load_from_summary(self, summary, config_file):
+        """Loads everything but the evaluation spec from a summary made by
+        to_summary, the evaluation spec is parsed from config_file when it is
+        first needed.
+        """
+
+        self.id_ = Task.get_task_id_from_filepath(config_file)
+        self.enabled = summary["enabled"]
+        self.title = summary["title"]
+        self.max_results_to_keep = summary["max_results_to_keep"]
+        self.post_evaluation = list(summary["post_evaluation"])
+
+        self.schedule = Schedule()
+        self.schedule.load_from_dict(summary["schedule"])
+
+        self.config_file = config_file
+        self.file_stat = Task.get_file_stat(config_file)
+        with self._evaluation_spec_lock:
+            self._evaluation_spec = None
+            self._evaluation_spec_pending = True
+            self._summary_blobs = summary.get("blobs", [])
+
+    def to_summary(self):
+        """Returns JSON serializable scalar fields and schedule of the task,
+        see TaskIndex.
+        """
+
+        return {
+            "enabled": self.enabled,
+            "title": self.title,
+            "max_results_to_keep": self.max_results_to_keep,
+            "post_evaluation": self.post_evaluation,
+            "schedule": self.schedule.to_dict(),
+            "blobs": self.get_blobs()
+        }
+
     def load(self, config_file):
+        file_stat = Task.get_file_stat(config_file)
         tree = ElementTree.parse(config_file)
         root = tree.getroot()
         self.load_from_xml_element(root, config_file)
+        self.file_stat = file_stat
 
     def reload(self):
         if self.config_file is not None:
@@ -279,19 +577,56 @@ class Task(object):
             max_results_element.text = str(self.max_results_to_keep)
             root.append(max_results_element)
 
+        if self.post_evaluation:
+            post_evaluation_element = ElementTree.Element("post-evaluation")
+            for artifact in self.post_evaluation:
+                artifact_element = ElementTree.Element("artifact")
+                artifact_element.text = artifact
+                post_evaluation_element.append(artifact_element)
+            root.append(post_evaluation_element)
+
         schedule_element = self.schedule.to_xml_element()
         root.append(schedule_element)
 
         return root
 
     def save_as(self, config_file):
+        """Writes the task definition to config_file. The file is replaced
+        atomically, a crash leaves either the old or the new definition
+        behind, never a truncated one.
+        """
+
         root = self.to_xml_element()
         et_helpers.indent(root)
 
         xml_source = ElementTree.tostring(root, encoding="utf-8")
-        with io.open(config_file, "w", encoding="utf-8") as f:
-            f.write(u"<?xml version=\"1.0\" encoding=\"utf-8\"?>\n")
-            f.write(xml_source.decode("utf-8"))
+
+        # The temporary file has to be in the same directory, rename is only
+        # atomic within one filesystem.
+        fd, temp_path = tempfile.mkstemp(
+            prefix=".", suffix=".tmp",
+            dir=os.path.dirname(os.path.abspath(config_file))
+        )
+        try:
+            with io.open(fd, "w", encoding="utf-8") as f:
+                f.write(u"<?xml version=\"1.0\" encoding=\"utf-8\"?>\n")
+                f.write(xml_source.decode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+
+            if os.path.exists(config_file):
+                shutil.copymode(config_file, temp_path)
+            else:
+                os.chmod(temp_path, 0o644)
+
+            os.rename(temp_path, config_file)
+
+        except:
+            os.remove(temp_path)
+            raise
+
+        if config_file == self.config_file:
+            self.file_stat = Task.get_file_stat(config_file)
 
     def save(self):
         assert(self.config_file is not None)
@@ -319,9 +654,14 @@ class Task(object):
         # than 10. For example to avoid sorted lists such as:
         # ['9', '8', '10', '1'] where we wanted ['10', '9', '8', '1']
 
+        # Names starting with a dot are not results, see
+        # _get_result_id_counter
+
         return sorted(
-            os.listdir(self._get_task_results_dir(results_dir)), reverse=True,
-            key=lambda s: (len(s), s)
+            [name for name
+             in os.listdir(self._get_task_results_dir(results_dir))
+             if not name.startswith(".")],
+            reverse=True, key=lambda s: (len(s), s)
         )
 
     def get_result_created_timestamp(self, result_id, config):
@@ -336,37 +676,131 @@ class Task(object):
         timestamp = os.path.getctime(file_path)
         return timestamp
 
+    def _get_last_result_id_on_disk(self, results_dir):
+        # result_ids are guaranteed to be reverse sorted by int
+        for result_id in self.list_result_ids(results_dir):
+            try:
+                return int(result_id)
+            except ValueError:
+                pass
+
+        return 0
+
+    def _get_result_id_counter(self, results_dir):
+        """The last result ID is kept in a file next to the results, listing
+        and sorting thousands of results for every evaluation would be
+        O(n*log(n)). The counter survives removal of all results, result IDs
+        are never reused.
+        """
+
+        path = os.path.join(
+            self._get_task_results_dir(results_dir), ".last_result_id"
+        )
+        if self._result_id_counter is None or \
+           self._result_id_counter.path != path:
+            self._result_id_counter = PersistentCounter(
+                path, lambda: self._get_last_result_id_on_disk(results_dir)
+            )
+
+        return self._result_id_counter
+
     def _get_next_target_dir(self, results_dir):
-        # We may consider having a file that contains the last ID in the
-        # future. I considered that but right now I think a result with more
-        # than a few thousand results is unlikely. User will use results
-        # purging. Sorting a couple thousand results is still very quick.
-        # Having a file with the last ID makes this operation O(1) instead
-        # of O(n*log(n)).
+        counter = self._get_result_id_counter(results_dir)
+        task_results_dir = self._get_task_results_dir(results_dir)
+
+        result_id = counter.allocate()
+        while os.path.exists(os.path.join(task_results_dir, str(result_id))):
+            # The counter is behind the results, it may have been restored
+            # from an older backup. Skip to the results on disk.
+            result_id = counter.allocate(
+                self._get_last_result_id_on_disk(results_dir)
+            )
+
+        return os.path.join(task_results_dir, str(result_id))
+
+    def _get_results_index(self, results_dir):
+        """Metadata of results is kept in an index next to the results,
+        listing results with their exit codes and timestamps would otherwise
+        have to open every result dir.
+        """
+
+        path = os.path.join(
+            self._get_task_results_dir(results_dir), ".results_index"
+        )
+        if self._results_index is None or self._results_index.path != path:
+            self._results_index = results_index.ResultsIndex(path)
+
+        return self._results_index
+
+    def get_results_metadata(self, results_dir):
+        """Returns a list of (result_id, metadata) tuples of all results,
+        ordered like list_result_ids. See results_index.get_result_metadata
+        for the metadata keys.
+
+        Results missing in the index, for example results stored by older
+        versions, are added to it without rule result counts. Entries of
+        results that are no longer on disk are dropped.
+        """
+
+        index = self._get_results_index(results_dir)
+        task_results_dir = self._get_task_results_dir(results_dir)
 
-        # result_ids are guaranteed to be reverse sorted by int
         result_ids = self.list_result_ids(results_dir)
+        indexed_ids = index.get_result_ids()
 
-        last = 0
-        for last_candidate in result_ids:
+        ret = []
+        for result_id in result_ids:
             try:
-                last = int(last_candidate)
-                break
-            except:
-                pass
+                int_result_id = int(result_id)
+            except ValueError:
+                continue
+
+            indexed_ids.discard(int_result_id)
+            metadata = index.get(int_result_id)
+            if metadata is None:
+                try:
+                    metadata = results_index.get_result_metadata(
+                        os.path.join(task_results_dir, result_id),
+                        count_rules=False
+                    )
+                except (IOError, OSError, ValueError):
+                    # result is being removed or is incomplete
+                    continue
+
+                index.add(int_result_id, metadata)
+
+            ret.append((result_id, metadata))
+
+        for result_id in indexed_ids:
+            index.remove(result_id)
 
-        ret = os.path.join(
-            self._get_task_results_dir(results_dir),
-            str(last + 1)
-        )
-        assert(not os.path.exists(ret))
         return ret
 
-    def remove_results(self, config):
+    def remove_results(self, config, keep_result_ids=True):
+        """Removes all results of the task. New results won't reuse IDs of
+        the removed ones unless keep_result_ids is False, which is meant for
+        tasks that are being removed.
+        """
+
         logging.debug("Removing all results of task '%s'.", self.id_)
 
         task_results_dir = self._get_task_results_dir(config.results_dir)
-        shutil.rmtree(task_results_dir, False)
+        if not keep_result_ids:
+            for result_id in self.list_result_ids(config.results_dir):
+                result_artifacts.forget(
+                    os.path.join(task_results_dir, result_id)
+                )
+            shutil.rmtree(task_results_dir, False)
+            self._result_id_counter = None
+            self._results_index = None
+            return
+
+        for result_id in self.list_result_ids(config.results_dir):
+            result_path = os.path.join(task_results_dir, result_id)
+            shutil.rmtree(result_path, False)
+            result_artifacts.forget(result_path)
+
+        self._get_results_index(config.results_dir).clear()
 
     def remove_result(self, result_id, config):
         # todo needs refactoring - the path is used from many places
@@ -381,6 +815,12 @@ class Task(object):
         )
 
         shutil.rmtree(result_path, False)
+        result_artifacts.forget(result_path)
+        try:
+            self._get_results_index(config.results_dir).remove(int(result_id))
+        except ValueError:
+            pass
+
         logging.info(
             "Removed result '%s' of task '%i'.", str(result_id), self.id_
         )
@@ -444,51 +884,148 @@ class Task(object):
             for result_id in reversed(result_ids_to_remove):
                 self.remove_result(result_id, config)
 
-    def update(self, reference_datetime, config):
+    def _store_result(self, wip_result, reference_datetime, config,
+                      metadata=None):
+        """Moves evaluation results from wip_result into the next result dir
+        of this task, records them in the results index and moves
+        the schedule forward. metadata of the evaluation is passed when it
+        has already been gathered, see update. Expects update_lock to be held.
+
+        Returns ID of the new result.
+        """
+
+        # We already have update_lock, there is no risk of a race
+        # condition between acquiring target dir and moving the results
+        # there.
+        target_dir = self._get_next_target_dir(config.results_dir)
+        logging.debug(
+            "Moving results of task '%s' from '%s' to '%s'.",
+            self.id_, wip_result, target_dir
+        )
+
+        shutil.move(wip_result, target_dir)
+        logging.info(
+            "Evaluated task '%s', new result in '%s'.",
+            self.id_, target_dir
+        )
+
+        try:
+            # timestamps and sizes are cheap to gather again, ctime of
+            # the result changes when it is moved or linked
+            stored_metadata = results_index.get_result_metadata(
+                target_dir, count_rules=metadata is None
+            )
+            if metadata is not None:
+                for key in ["started", "finished", "duration",
+                            "rule_results"]:
+                    stored_metadata[key] = metadata[key]
+
+            self._get_results_index(config.results_dir).add(
+                int(os.path.basename(target_dir)), stored_metadata
+            )
+
+        except (IOError, OSError, ValueError):
+            # the result is still listed, the index will pick it up later
+            logging.exception(
+                "Failed to add result '%s' of task '%i' to the results "
+                "index.", target_dir, self.id_
+            )
+
+        if not self.run_outside_schedule_once:
+            self.schedule.not_before = \
+                self.schedule.next_not_before(
+                    reference_datetime, config.max_catch_up_runs
+                )
+
+            self.save()
+
+        else:
+            self.run_outside_schedule_once = False
+
+        # we have one extra result, let's prune old results
+        self.prune_old_results(config)
+
+        return int(os.path.basename(target_dir))
+
+    def update(self, reference_datetime, config, usage_callback=None,
+               equivalent_tasks=None):
         """Figures out if the task should be run right now, alters the schedule
         values accordingly.
 
+        usage_callback is passed to oscap_helpers.evaluate.
+
+        equivalent_tasks are tasks with equivalent EvaluationSpec that are due
+        at the same time, they get a copy of the results of this evaluation
+        instead of running oscap again. Nobody else is supposed to update
+        them meanwhile.
+
         reference datetime is passed mainly because of easier diagnostics.
         It prevents some tasks being run and others not even though they have
         the same not_before value.
 
         Assumption: tick is never in parallel on the same Task. It can be run
         in parallel on different tasks but at most once for 1 Task instance.
+
+        Returns a list of (task, result_id) tuples of the results stored, for
+        this task and its equivalent tasks.
         """
 
+        stored = []
         with self.update_lock:
             if not self.is_valid():
                 raise RuntimeError("Can't update an invalid Task.")
 
             if self.should_be_updated(reference_datetime, True):
-                wip_result = self.evaluation_spec.evaluate_into_dir(config)
-
-                # We already have update_lock, there is no risk of a race
-                # condition between acquiring target dir and moving the results
-                # there.
-                target_dir = self._get_next_target_dir(config.results_dir)
-                logging.debug(
-                    "Moving results of task '%s' from '%s' to '%s'.",
-                    self.id_, wip_result, target_dir
+                started = time.time()
+                wip_result = self.evaluation_spec.evaluate_into_dir(
+                    config, usage_callback=usage_callback
                 )
-
-                shutil.move(wip_result, target_dir)
-                logging.info(
-                    "Evaluated task '%s', new result in '%s'.",
-                    self.id_, target_dir
+                metadata = results_index.get_result_metadata(
+                    wip_result, started, time.time()
                 )
-
-                if not self.run_outside_schedule_once:
-                    self.schedule.not_before = \
-                        self.schedule.next_not_before(reference_datetime)
-
-                    self.save()
-
-                else:
-                    self.run_outside_schedule_once = False
-
-                # we have one extra result, let's prune old results
-                self.prune_old_results(config)
+                # before the result is shared with equivalent tasks, they
+                # link to the compressed files
+                try:
+                    compression.compress_result(
+                        wip_result, config.results_compression
+                    )
+                except (IOError, OSError, RuntimeError):
+                    logging.exception(
+                        "Failed to compress result of task '%i', storing "
+                        "it uncompressed.", self.id_
+                    )
+
+                for other in equivalent_tasks or []:
+                    with other.update_lock:
+                        if not other.should_be_updated(reference_datetime,
+                                                       True):
+                            continue
+
+                        try:
+                            stored.append((other, other._store_result(
+                                _link_tree(wip_result,
+                                           config.work_in_progress_dir),
+                                reference_datetime, config, metadata
+                            )))
+
+                        except Exception:
+                            # don't lose results of this task because of that
+                            logging.exception(
+                                "Failed to store results of task '%i' for "
+                                "equivalent task '%i'.", self.id_, other.id_
+                            )
+                            continue
+
+                        logging.info(
+                            "Task '%i' reused evaluation of equivalent task "
+                            "'%i'.", other.id_, self.id_
+                        )
+
+                stored.append((self, self._store_result(
+                    wip_result, reference_datetime, config, metadata
+                )))
+
+        return stored
 
     def generate_guide(self, config):
         return self.evaluation_spec.generate_guide(config)
@@ -512,23 +1049,37 @@ class Task(object):
             "Set task '%i' to be run once outside the schedule.", self.id_
         )
 
-    def get_xml_of_result(self, result_id, config):
+    def get_xml_path_of_result(self, result_id, config):
+        """Returns the path the XML of given result is stored under. The file
+        may be compressed, see compression.find.
+        """
+
         # TODO: This needs refactoring in the future, the secret that the file
         #       is called "results.xml" is all over the place.
-        path = os.path.join(
+        return os.path.join(
             self._get_task_results_dir(config.results_dir),
             str(result_id),
             "results.xml"
         )
 
+    def open_xml_of_result(self, result_id, config):
+        """Opens XML of given result for reading in binary mode, without
+        reading all of it into memory like get_xml_of_result does.
+        """
+
+        return compression.open_file(
+            self.get_xml_path_of_result(result_id, config)
+        )
+
+    def get_xml_of_result(self, result_id, config):
+        path = self.get_xml_path_of_result(result_id, config)
+
         logging.debug(
             "Retrieving XML of result '%i' of task '%i', expected path '%s'.",
             result_id, self.id_, path
         )
 
-        ret = ""
-        with io.open(path, "r", encoding="utf-8") as f:
-            ret = f.read()
+        ret = compression.read_text(path)
 
         logging.info(
             "Retrieved XML of result '%i' of task '%i'.",
@@ -544,11 +1095,7 @@ class Task(object):
             "stderr"
         )
 
-        ret = ""
-        with io.open(path, "r", encoding="utf-8") as f:
-            ret = f.read()
-
-        return ret
+        return compression.read_text(path)
 
     def get_stderr_of_result(self, result_id, config):
         path = os.path.join(
@@ -557,11 +1104,7 @@ class Task(object):
             "stderr"
         )
 
-        ret = ""
-        with io.open(path, "r", encoding="utf-8") as f:
-            ret = f.read()
-
-        return ret
+        return compression.read_text(path)
 
     def get_exit_code_of_result(self, result_id, config):
         path = os.path.join(
@@ -577,19 +1120,101 @@ class Task(object):
         return int(ret.strip())
 
     def generate_report_for_result(self, result_id, config):
-        return oscap_helpers.generate_report_for_result(
-            self.evaluation_spec,
-            self._get_task_results_dir(config.results_dir),
-            result_id,
-            config
+        """Reports are generated once and kept next to the result, see
+        result_artifacts.get.
+        """
+
+        results_dir = self._get_task_results_dir(config.results_dir)
+        return result_artifacts.get(
+            os.path.join(results_dir, str(result_id)),
+            "report.html",
+            lambda: oscap_helpers.generate_report_for_result(
+                self.evaluation_spec,
+                results_dir,
+                result_id,
+                config
+            ),
+            config.results_compression
         )
 
-    def generate_fix_for_result(self, result_id, config, fix_type):
+    def _generate_fix_for_result(self, result_id, config, fix_type):
         results_dir = self._get_task_results_dir(config.results_dir)
         results_path = os.path.join(results_dir, str(result_id), "results.xml")
-        return oscap_helpers.generate_fix_for_result(
-            config,
-            results_path,
-            fix_type,
-            None
+        if not compression.exists(results_path):
+            raise RuntimeError("Can't generate fix for result '%s'. Expected "
+                               "results XML at '%s' but the file doesn't "
+                               "exist." % (result_id, results_path))
+
+        with compression.uncompressed_path(
+                results_path, config.work_in_progress_dir) as path:
+            return oscap_helpers.generate_fix_for_result(
+                config,
+                path,
+                fix_type,
+                None
+            )
+
+    def generate_fix_for_result(self, result_id, config, fix_type):
+        """Fixes are generated once and kept next to the result, like
+        reports.
+        """
+
+        if fix_type not in _FIX_ARTIFACT_NAMES:
+            raise RuntimeError("Unknown fix type '%s'." % (fix_type))
+
+        return result_artifacts.get(
+            os.path.join(self._get_task_results_dir(config.results_dir),
+                         str(result_id)),
+            _FIX_ARTIFACT_NAMES[fix_type],
+            lambda: self._generate_fix_for_result(result_id, config, fix_type),
+            config.results_compression
+        )
+
+    def _generate_summary_for_result(self, result_id, config):
+        arf_path = self.get_xml_path_of_result(result_id, config)
+        if not compression.exists(arf_path):
+            raise RuntimeError("Can't generate summary for result '%s'. "
+                               "Expected results XML at '%s' but the file "
+                               "doesn't exist." % (result_id, arf_path))
+
+        rule_results = {}
+        counts = {}
+        for rule_id, result in results_index.iter_rule_results(arf_path):
+            rule_results[rule_id] = result
+            counts[result] = counts.get(result, 0) + 1
+
+        return json.dumps({
+            "exit_code": self.get_exit_code_of_result(result_id, config),
+            "counts": counts,
+            "rule_results": rule_results
+        }, indent=4, sort_keys=True)
+
+    def generate_summary_for_result(self, result_id, config):
+        """Returns JSON with the exit code, counts of rule results and
+        the result of every rule, much smaller than the ARF and report.
+        """
+
+        return result_artifacts.get(
+            os.path.join(self._get_task_results_dir(config.results_dir),
+                         str(result_id)),
+            "summary.json",
+            lambda: self._generate_summary_for_result(result_id, config),
+            config.results_compression
+        )
+
+    def generate_artifact_for_result(self, result_id, config, artifact):
+        """Generates one of POST_EVALUATION_ARTIFACTS for given result.
+        """
+
+        if artifact == "report":
+            return self.generate_report_for_result(result_id, config)
+        if artifact == "summary":
+            return self.generate_summary_for_result(result_id, config)
+        if artifact.endswith("_fix"):
+            return self.generate_fix_for_result(
+                result_id, config, artifact[:-len("_fix")]
+            )
+
+        raise RuntimeError(
+            "Unknown post evaluation artifact '%s'." % (artifact)
         )
@@ -0,0 +1,141 @@
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import io
+import json
+import time
+import threading
+import logging
+
+
+class TaskIndex(object):
+    """Snapshot of scalar fields and schedules of all tasks, keyed by name of
+    the task definition file.
+
+    Parsing thousands of task definitions with inlined SCAP content takes
+    minutes, the index lets System load tasks without touching their XML.
+    Each entry remembers mtime and size of the file it was made from, entries
+    of files that have changed since are ignored.
+
+    A file modified within the same second the index was made from it could
+    have the same mtime and size after another change, such entries are
+    treated as stale as well.
+    """
+
+    VERSION = 3
+
+    def __init__(self, path):
+        self.path = path
+        # file name -> {"mtime": ..., "size": ..., "task": summary}
+        self.entries = {}
+        # time when the entries have been loaded or made, see lookup
+        self.created = 0.0
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            self.entries = {}
+            self.created = 0.0
+            self.dirty = False
+
+            if not os.path.exists(self.path):
+                return
+
+            try:
+                with io.open(self.path, "rb") as f:
+                    data = json.loads(f.read().decode("utf-8"))
+
+                if data.get("version") != TaskIndex.VERSION:
+                    raise ValueError("unsupported version")
+
+                self.entries = data["tasks"]
+                self.created = float(data["created"])
+
+            except (IOError, OSError, ValueError, KeyError, TypeError,
+                    AttributeError) as e:
+                logging.warning(
+                    "Ignoring task index '%s', it can't be read. All task "
+                    "definitions will be parsed. %s", self.path, e
+                )
+                self.entries = {}
+                self.dirty = True
+
+    def lookup(self, filename, stat):
+        """Returns summary of the task defined in filename as stored by
+        store(), None if there is none or the file has changed since.
+        """
+
+        with self.lock:
+            entry = self.entries.get(filename)
+            if entry is None:
+                return None
+
+            if entry["mtime"] != stat.st_mtime or \
+               entry["size"] != stat.st_size or \
+               stat.st_mtime >= self.created - 1.0:
+                return None
+
+            return entry["task"]
+
+    def store(self, filename, stat, summary):
+        with self.lock:
+            self.entries[filename] = {
+                "mtime": stat.st_mtime,
+                "size": stat.st_size,
+                "task": summary
+            }
+            self.dirty = True
+
+    def prune(self, filenames):
+        """Removes entries of all files not in filenames.
+        """
+
+        with self.lock:
+            filenames = set(filenames)
+            for filename in list(self.entries.keys()):
+                if filename not in filenames:
+                    del self.entries[filename]
+                    self.dirty = True
+
+    def save(self):
+        """Writes the index if it has changed. The file is replaced
+        atomically, a crash leaves either the old or the new index behind.
+        """
+
+        with self.lock:
+            if not self.dirty:
+                return
+
+            created = time.time()
+            temp_path = self.path + ".new"
+            with io.open(temp_path, "wb") as f:
+                f.write(json.dumps({
+                    "version": TaskIndex.VERSION,
+                    "created": created,
+                    "tasks": self.entries
+                }, sort_keys=True).encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.rename(temp_path, self.path)
+            self.created = created
+            self.dirty = False
+
+
+__all__ = ["TaskIndex"]
@@ -0,0 +1,267 @@
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import time
+import errno
+import select
+import struct
+import threading
+import logging
+import ctypes
+import ctypes.util
+
+
+# see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                           use_errno=True)
+        # make sure the functions are there
+        libc.inotify_init1
+        libc.inotify_add_watch
+        return libc
+
+    except (OSError, AttributeError):
+        return None
+
+
+def _is_task_file(filename):
+    # temporary files of Task.save_as start with a dot
+    return filename.endswith(".xml") and not filename.startswith(".")
+
+
+class TaskDirWatcher(object):
+    """Watches the task definitions directory and reports changed task files.
+
+    callback is called from the watcher thread with a set of names of task
+    files that have been created, changed or removed, or with None if
+    the whole directory has to be rescanned. Bursts of changes are reported
+    together once the directory has been quiet for settle_time seconds.
+
+    Uses inotify through libc if the kernel supports it, otherwise
+    the directory is polled every poll_interval seconds.
+    """
+
+    def __init__(self, path, callback, poll_interval=30.0, settle_time=0.5):
+        self.path = path
+        self.callback = callback
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+
+        self.inotify_fd = None
+        self.thread = None
+
+    def _init_inotify(self):
+        libc = _load_libc()
+        if libc is None:
+            return False
+
+        fd = libc.inotify_init1(IN_CLOEXEC)
+        if fd < 0:
+            logging.warning(
+                "Failed to initialize inotify, polling task definitions "
+                "directory '%s' instead. %s", self.path,
+                os.strerror(ctypes.get_errno())
+            )
+            return False
+
+        path = self.path
+        if not isinstance(path, bytes):
+            path = path.encode("utf-8")
+
+        wd = libc.inotify_add_watch(
+            fd, path,
+            IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE |
+            IN_DELETE_SELF | IN_MOVE_SELF
+        )
+        if wd < 0:
+            logging.warning(
+                "Failed to watch task definitions directory '%s' using "
+                "inotify, polling it instead. %s", self.path,
+                os.strerror(ctypes.get_errno())
+            )
+            os.close(fd)
+            return False
+
+        self.inotify_fd = fd
+        return True
+
+    def _read_events(self, timeout):
+        """Returns names of task files from the events available within
+        timeout seconds, None if the directory has to be rescanned. Raises
+        EOFError if the directory can't be watched anymore.
+        """
+
+        ready, _, _ = select.select([self.inotify_fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        try:
+            buf = os.read(self.inotify_fd, 64 * 1024)
+
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                return set()
+            raise
+
+        ret = set()
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(buf):
+            _, mask, _, name_len = _EVENT_HEADER.unpack_from(buf, offset)
+            offset += _EVENT_HEADER.size
+            name = buf[offset:offset + name_len].rstrip(b"\0")
+            offset += name_len
+
+            if mask & IN_Q_OVERFLOW:
+                # events have been lost
+                return None
+
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                raise EOFError()
+
+            name = name.decode("utf-8", "replace")
+            if _is_task_file(name):
+                ret.add(name)
+
+        return ret
+
+    def _inotify_worker(self):
+        try:
+            while True:
+                changed = self._read_events(None)
+                deadline = time.time() + 10 * self.settle_time
+                while changed is not None and time.time() < deadline:
+                    more = self._read_events(self.settle_time)
+                    if more is None:
+                        changed = None
+                    elif not more:
+                        break
+                    else:
+                        changed.update(more)
+
+                if changed is None or changed:
+                    self._notify(changed)
+
+        except EOFError:
+            logging.warning(
+                "Task definitions directory '%s' has been moved or removed, "
+                "polling it instead.", self.path
+            )
+
+        finally:
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
+
+        self._poll_worker(self._snapshot() or {})
+
+    def _snapshot(self):
+        """Returns inode, mtime and size of all task files, None if
+        the directory can't be listed.
+        """
+
+        ret = {}
+        try:
+            filenames = os.listdir(self.path)
+
+        except OSError:
+            return None
+
+        for filename in filenames:
+            if not _is_task_file(filename):
+                continue
+
+            try:
+                stat = os.stat(os.path.join(self.path, filename))
+
+            except OSError:
+                continue
+
+            ret[filename] = (stat.st_ino, stat.st_mtime, stat.st_size)
+
+        return ret
+
+    def _poll_worker(self, snapshot):
+        while True:
+            time.sleep(self.poll_interval)
+
+            new_snapshot = self._snapshot()
+            if new_snapshot is None:
+                # Don't report all tasks as removed because the directory
+                # is temporarily unavailable.
+                continue
+
+            changed = set(
+                filename for filename in
+                set(snapshot.keys()) | set(new_snapshot.keys())
+                if snapshot.get(filename) != new_snapshot.get(filename)
+            )
+            snapshot = new_snapshot
+
+            if changed:
+                self._notify(changed)
+
+    def _notify(self, changed):
+        try:
+            self.callback(changed)
+
+        except Exception as e:
+            logging.exception(
+                "Failed to process changes in task definitions directory "
+                "'%s'. %s", self.path, e
+            )
+
+    def start(self):
+        """Starts watching in a daemon thread. The inotify watch is set up
+        before this returns, changes made afterwards are never missed.
+        """
+
+        if self._init_inotify():
+            logging.info(
+                "Watching task definitions directory '%s' using inotify.",
+                self.path
+            )
+            target = self._inotify_worker
+            args = ()
+
+        else:
+            logging.info(
+                "Polling task definitions directory '%s' every %.1f seconds.",
+                self.path, self.poll_interval
+            )
+            target = self._poll_worker
+            args = (self._snapshot() or {},)
+
+        self.thread = threading.Thread(target=target, args=args)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+__all__ = ["TaskDirWatcher"]
@@ -0,0 +1,286 @@
+#!/usr/bin/python2
+
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import unit_test_harness
+import subprocess
+import threading
+import time
+from openscap_daemon import async_tools
+from openscap_daemon import oscap_helpers
+
+
+class RecordingAction(async_tools.AsyncAction):
+    def __init__(self, lane, log, log_lock, duration):
+        super(RecordingAction, self).__init__()
+
+        self.lane = lane
+        self.log = log
+        self.log_lock = log_lock
+        self.duration = duration
+
+    def run(self):
+        with self.log_lock:
+            self.log.append(("start", self.lane, self.token))
+
+        time.sleep(self.duration)
+
+        with self.log_lock:
+            self.log.append(("end", self.lane, self.token))
+
+    def __str__(self):
+        return "Recording action in lane '%s'" % (self.lane)
+
+
+class NoOpAction(async_tools.AsyncAction):
+    def __init__(self, done):
+        super(NoOpAction, self).__init__()
+
+        self.done = done
+
+    def run(self):
+        self.done.release()
+
+    def __str__(self):
+        return "No-op action"
+
+
+class BlockingAction(async_tools.AsyncAction):
+    def __init__(self, started, release):
+        super(BlockingAction, self).__init__()
+
+        self.started = started
+        self.release = release
+
+    def run(self):
+        self.started.set()
+        self.release.wait()
+
+    def __str__(self):
+        return "Blocking action"
+
+
+def wait_for_actions(manager):
+    while len(manager.actions) > 0:
+        time.sleep(0.01)
+
+
+class AsyncManagerTest(unit_test_harness.APITest):
+    def test_lanes(self):
+        manager = async_tools.AsyncManager(workers=4)
+        log = []
+        log_lock = threading.Lock()
+
+        for _ in range(3):
+            manager.enqueue(RecordingAction("a", log, log_lock, 0.05))
+        manager.enqueue(RecordingAction("b", log, log_lock, 0.05))
+        wait_for_actions(manager)
+
+        # at most one action of each lane is running at any time
+        running = {}
+        for event, lane, _ in log:
+            running[lane] = running.get(lane, 0) + (1 if event == "start" else -1)
+            assert(running[lane] <= 1)
+
+        # lane "b" didn't have to wait for the whole backlog of lane "a"
+        starts = [lane for event, lane, _ in log if event == "start"]
+        assert(starts.index("b") < 2)
+        assert(len(manager.lanes) == 0)
+
+    def test_resize(self):
+        assert(self.system.get_async_workers() == 4)
+
+        manager = async_tools.AsyncManager(workers=2)
+        manager.set_workers(5)
+        assert(manager.get_workers() == 5)
+        assert(len(manager.workers) == 5)
+
+        manager.set_workers(1)
+        assert(manager.get_workers() == 1)
+        # idle workers retire as soon as they pick up the marker
+        deadline = time.time() + 5
+        while len(manager.workers) > 1 and time.time() < deadline:
+            time.sleep(0.01)
+        assert(len(manager.workers) == 1)
+
+        # the remaining worker still processes actions
+        log = []
+        manager.enqueue(RecordingAction(None, log, threading.Lock(), 0))
+        wait_for_actions(manager)
+        assert(len(log) == 2)
+
+        # invalid worker counts don't turn the adaptive mode off
+        manager.enable_adaptive(1, 2)
+        try:
+            manager.set_workers(-1)
+            assert(False)
+        except RuntimeError:
+            pass
+        assert(manager.adaptive)
+        assert(manager.get_workers() == 1)
+        manager.set_workers(2)
+        assert(not manager.adaptive)
+
+    def test_dispatch(self):
+        # many no-op actions enqueued at once are all dispatched
+        manager = async_tools.AsyncManager(workers=1)
+        done = threading.Semaphore(0)
+        count = 2000
+
+        for _ in range(count):
+            manager.enqueue(NoOpAction(done))
+        for _ in range(count):
+            done.acquire()
+
+        # the optional rate limiter spaces out action starts
+        manager.max_actions_per_second = 100
+        start = time.time()
+        for _ in range(10):
+            manager.enqueue(NoOpAction(done))
+        for _ in range(10):
+            done.acquire()
+        assert(time.time() - start >= 0.08)
+
+    def test_cancel(self):
+        manager = async_tools.AsyncManager(workers=1)
+        log = []
+        log_lock = threading.Lock()
+
+        manager.enqueue(RecordingAction("a", log, log_lock, 0.2))
+        pending = manager.enqueue(RecordingAction("a", log, log_lock, 0))
+        assert(manager.cancel(pending))
+        assert(manager.get_action(pending) is None)
+        wait_for_actions(manager)
+        time.sleep(0.1)
+
+        # only the first action ever ran
+        assert(len(log) == 2)
+        assert(len(manager.lanes) == 0)
+        assert(not manager.cancel(pending))
+
+        # child processes get terminated
+        process = subprocess.Popen(["sleep", "60"])
+        start = time.time()
+        oscap_helpers.terminate_process(process)
+        assert(process.poll() is not None)
+        assert(time.time() - start < 5)
+
+    def _run_blocked(self, manager, enqueue_func):
+        """Occupies the only worker of manager, calls enqueue_func and returns
+        order in which tokens of the enqueued actions started.
+        """
+
+        started = threading.Event()
+        release = threading.Event()
+        manager.enqueue(BlockingAction(started, release))
+        started.wait()
+
+        log = []
+        enqueue_func(log)
+        release.set()
+        wait_for_actions(manager)
+
+        return [token for event, _, token in log if event == "start"]
+
+    def test_ordering(self):
+        log_lock = threading.Lock()
+
+        # equal priorities are processed in FIFO order
+        manager = async_tools.AsyncManager(workers=1)
+        tokens = []
+
+        def enqueue_same_priority(log):
+            for _ in range(5):
+                tokens.append(manager.enqueue(
+                    RecordingAction(None, log, log_lock, 0), 10
+                ))
+
+        assert(self._run_blocked(manager, enqueue_same_priority) == tokens)
+
+        # without aging more important actions always go first
+        manager = async_tools.AsyncManager(workers=1, priority_aging=0)
+        tokens = []
+
+        def enqueue_aged(log):
+            tokens.append(manager.enqueue(
+                RecordingAction(None, log, log_lock, 0), 10
+            ))
+            time.sleep(0.3)
+            tokens.append(manager.enqueue(
+                RecordingAction(None, log, log_lock, 0), 0
+            ))
+
+        assert(self._run_blocked(manager, enqueue_aged) == tokens[::-1])
+
+        # with aging, waiting long enough beats priority
+        manager = async_tools.AsyncManager(workers=1, priority_aging=0.02)
+        tokens = []
+        assert(self._run_blocked(manager, enqueue_aged) == tokens)
+        assert(abs(manager.get_max_queue_delay(10) - 0.2) < 0.0001)
+
+    def test_admission(self):
+        manager = async_tools.AsyncManager(workers=1)
+        manager.set_max_pending(0, 3)
+        manager.max_pending_per_caller = 2
+        log = []
+        log_lock = threading.Lock()
+
+        started = threading.Event()
+        release = threading.Event()
+        manager.enqueue(BlockingAction(started, release), 0, "a")
+        started.wait()
+
+        # the running action doesn't count, pending ones do
+        pending = [manager.enqueue(RecordingAction(None, log, log_lock, 0),
+                                   0, "a")
+                   for _ in range(2)]
+        try:
+            manager.enqueue(RecordingAction(None, log, log_lock, 0), 0, "a")
+            assert(False)
+        except async_tools.QueueFull as e:
+            assert(e.retry_after >= 1)
+
+        manager.enqueue(RecordingAction(None, log, log_lock, 0), 0, "b")
+        try:
+            manager.enqueue(RecordingAction(None, log, log_lock, 0), 0, "c")
+            assert(False)
+        except async_tools.QueueFull:
+            pass
+
+        # other priorities and cancelled actions don't count
+        manager.enqueue(RecordingAction(None, log, log_lock, 0), 10)
+        manager.cancel(pending[0])
+        manager.enqueue(RecordingAction(None, log, log_lock, 0), 0, "a")
+
+        release.set()
+        wait_for_actions(manager)
+        assert(len(manager.pending_by_priority) == 0)
+        assert(len(manager.pending_by_caller) == 0)
+
+    def test(self):
+        super(AsyncManagerTest, self).test()
+
+        self.test_lanes()
+        self.test_resize()
+        self.test_dispatch()
+        self.test_cancel()
+        self.test_ordering()
+        self.test_admission()
+
+
+if __name__ == "__main__":
+    AsyncManagerTest.run()
@@ -40,6 +40,10 @@ class BasicUpdateTest(unit_test_harness.APITest):
         while len(self.system.async_manager.actions) > 0:
             time.sleep(1)
 
+        # the task is scheduled again whether the update succeeded or not
+        assert(1 not in self.system.tasks_scheduled)
+        assert(1 in self.system.schedule_index.entries)
+
 
 if __name__ == "__main__":
     BasicUpdateTest.run()
@@ -0,0 +1,86 @@
+#!/usr/bin/python2
+
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import unit_test_harness
+import io
+import os
+import os.path
+from openscap_daemon.task import Task
+
+
+class BlobStoreTest(unit_test_harness.APITest):
+    def setup_data(self):
+        super(BlobStoreTest, self).setup_data()
+        self.copy_to_data("tasks/1.xml")
+
+    def test(self):
+        super(BlobStoreTest, self).test()
+
+        self.system.config.task_save_delay = 0
+        self.system.load_tasks()
+        blob_store = self.system.blob_store
+
+        # embedded contents of the task are put to the blob store
+        task = self.system.tasks[1]
+        [digest] = task.get_blobs()
+        assert(digest in blob_store)
+        assert(task.evaluation_spec.input_.file_path ==
+               blob_store.get_path(digest))
+        contents = task.evaluation_spec.input_.get_xml_source()
+
+        # identical contents are stored once
+        task_id = self.system.create_task()
+        self.system.set_task_input(task_id, contents)
+        other_task = self.system.tasks[task_id]
+        assert(other_task.get_blobs() == [digest])
+        assert(other_task.evaluation_spec.input_.is_bundled())
+
+        # the definition references the contents instead of inlining them
+        with io.open(other_task.config_file, "r", encoding="utf-8") as f:
+            definition = f.read()
+        assert(digest in definition)
+        assert(len(definition) < len(contents))
+
+        loaded_task = Task()
+        loaded_task.load(other_task.config_file)
+        assert(loaded_task.evaluation_spec.input_.blob == digest)
+        assert(loaded_task.evaluation_spec.input_.get_xml_source() ==
+               contents)
+
+        # only unreferenced blobs are collected
+        unreferenced = blob_store.put(b"<unreferenced/>")
+        assert(blob_store.put(b"<unreferenced/>") == unreferenced)
+        self.system.collect_blobs()
+        assert(unreferenced in blob_store)
+        assert(blob_store.collect_garbage(set([digest]), 0) == 1)
+        assert(unreferenced not in blob_store)
+        assert(digest in blob_store)
+
+        # blobs of specs that are being evaluated are kept
+        in_use = blob_store.put(b"<in-use/>")
+        self.system.blobs_in_use.append(in_use)
+        self.system.collect_blobs(0)
+        assert(in_use in blob_store)
+        self.system.blobs_in_use.remove(in_use)
+        self.system.collect_blobs(0)
+        assert(in_use not in blob_store)
+        assert(digest in blob_store)
+
+
+if __name__ == "__main__":
+    BlobStoreTest.run()
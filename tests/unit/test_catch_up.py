@@ -0,0 +1,90 @@
+#!/usr/bin/python2
+
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import unit_test_harness
+import time
+from datetime import datetime, timedelta
+from openscap_daemon.task import Schedule, SlipMode
+
+
+class CatchUpTest(unit_test_harness.APITest):
+    def setup_data(self):
+        super(CatchUpTest, self).setup_data()
+        self.copy_to_data("tasks/1.xml")
+
+    def test(self):
+        super(CatchUpTest, self).test()
+
+        now = datetime(2020, 1, 2, 0, 30)
+
+        # the daemon was down for a day, 24 hourly runs were missed
+        schedule = Schedule()
+        schedule.not_before = datetime(2020, 1, 1, 0, 0)
+        schedule.repeat_after = 1
+        schedule.slip_mode = SlipMode.NO_SLIP
+        assert(schedule.is_catching_up(now))
+        assert(schedule.next_not_before(now) == datetime(2020, 1, 1, 1, 0))
+        assert(schedule.next_not_before(now, 3) ==
+               datetime(2020, 1, 1, 22, 0))
+        # 0 coalesces all missed runs into the one being run
+        assert(schedule.next_not_before(now, 0) == datetime(2020, 1, 2, 1, 0))
+        schedule.max_catch_up = -2
+        assert(schedule.next_not_before(now, 0) == datetime(2020, 1, 1, 1, 0))
+
+        schedule.not_before = datetime(2020, 1, 2, 0, 0)
+        assert(not schedule.is_catching_up(now))
+        assert(schedule.next_not_before(now, 0) == datetime(2020, 1, 2, 1, 0))
+
+        # catch-up runs wait for a free slot of the global budget
+        self.system.load_tasks()
+        task = self.system.tasks[1]
+        task.schedule.slip_mode = SlipMode.NO_SLIP
+        self.system.config.catch_up_jobs = 1
+        self.system.catch_up_running = 1
+
+        self.system.schedule_tasks(now)
+        assert(list(self.system.catch_up_pending) == [(1, now)])
+        assert(len(self.system.async_manager.actions) == 0)
+
+        # resource keys of released tasks are computed without tasks_lock
+        get_resource_key = task.evaluation_spec.get_resource_key
+        lock_free = []
+
+        def checked_get_resource_key():
+            locked = self.system.tasks_lock.acquire(False)
+            if locked:
+                self.system.tasks_lock.release()
+            lock_free.append(locked)
+            return get_resource_key()
+
+        task.evaluation_spec.get_resource_key = checked_get_resource_key
+
+        with self.system.tasks_lock:
+            released = self.system._release_catch_up_slot_locked()
+        assert(released == [(task, now)])
+        assert(len(self.system.catch_up_pending) == 0)
+        self.system._enqueue_released_catch_up_tasks(released)
+        assert(lock_free == [True])
+
+        while len(self.system.async_manager.actions) > 0:
+            time.sleep(0.1)
+        assert(self.system.catch_up_running == 0)
+
+
+if __name__ == "__main__":
+    CatchUpTest.run()
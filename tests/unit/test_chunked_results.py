@@ -0,0 +1,77 @@
+#!/usr/bin/python2
+
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import unit_test_harness
+from openscap_daemon import compression
+import io
+import os
+import os.path
+
+
+class ChunkedResultsTest(unit_test_harness.APITest):
+    def setup_data(self):
+        super(ChunkedResultsTest, self).setup_data()
+        self.copy_to_data("tasks/1.xml")
+
+    def read_chunks(self, result_id, length):
+        ret = b""
+        while True:
+            chunk = self.system.read_xml_of_task_result(
+                1, result_id, len(ret), length
+            )
+            if not chunk:
+                return ret
+            ret += chunk
+
+    def test(self):
+        super(ChunkedResultsTest, self).test()
+
+        self.system.load_tasks()
+        config = self.system.config
+
+        arf = b"<arf>" + b"0123456789" * 10000 + b"</arf>"
+        for result_id, method in [(1, "none"), (2, "gzip")]:
+            result_dir = os.path.join(config.results_dir, "1", str(result_id))
+            os.makedirs(result_dir)
+            with io.open(os.path.join(result_dir, "results.xml"), "wb") as f:
+                f.write(arf)
+            compression.compress_result(result_dir, method)
+
+        for result_id in [1, 2]:
+            assert(self.read_chunks(result_id, 4096) == arf)
+
+            # random access works too
+            assert(self.system.read_xml_of_task_result(1, result_id, 5, 10) ==
+                   b"0123456789")
+            assert(self.system.read_xml_of_task_result(1, result_id, 0, 5) ==
+                   b"<arf>")
+            assert(self.system.read_xml_of_task_result(
+                1, result_id, len(arf), 10) == b"")
+
+            fd = self.system.open_xml_of_task_result(1, result_id)
+            with os.fdopen(fd, "rb") as f:
+                assert(f.read() == arf)
+
+        # streams are bounded and closed with their results
+        assert(len(self.system.result_chunk_reader.streams) <= 2)
+        self.system.remove_task_result(1, 2)
+        assert((1, 2) not in self.system.result_chunk_reader.streams)
+
+
+if __name__ == "__main__":
+    ChunkedResultsTest.run()
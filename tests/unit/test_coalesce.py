@@ -0,0 +1,91 @@
+#!/usr/bin/python2
+
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import unit_test_harness
+import io
+import os
+import os.path
+import shutil
+import stat
+import time
+from datetime import datetime
+
+
+class CoalesceTest(unit_test_harness.APITest):
+    def setup_data(self):
+        super(CoalesceTest, self).setup_data()
+        self.copy_to_data("tasks/1.xml")
+        shutil.copy(
+            os.path.join(self.data_dir_path, "tasks", "1.xml"),
+            os.path.join(self.data_dir_path, "tasks", "2.xml")
+        )
+
+        # stands in for oscap, records its runs and writes some results
+        self.oscap_path = os.path.join(self.data_dir_path, "oscap")
+        self.runs_path = os.path.join(self.data_dir_path, "runs")
+        with io.open(self.oscap_path, "w", encoding="utf-8") as f:
+            f.write(u"#!/bin/sh\necho run >> '%s'\n"
+                    u"echo '<arf/>' > results.xml\n" % (self.runs_path))
+        os.chmod(self.oscap_path, stat.S_IRWXU)
+
+    def test(self):
+        super(CoalesceTest, self).test()
+
+        self.system.config.oscap_path = self.oscap_path
+        self.system.load_tasks()
+        assert(len(self.system.tasks) == 2)
+
+        # grouping hashes contents, it doesn't hold tasks_lock meanwhile
+        group_equivalent_tasks = self.system._group_equivalent_tasks
+        lock_free = []
+
+        def checked_group_equivalent_tasks(*args):
+            locked = self.system.tasks_lock.acquire(False)
+            if locked:
+                self.system.tasks_lock.release()
+            lock_free.append(locked)
+            return group_equivalent_tasks(*args)
+
+        self.system._group_equivalent_tasks = checked_group_equivalent_tasks
+
+        self.system.schedule_tasks(datetime(2020, 1, 1))
+        assert(lock_free == [True])
+        while len(self.system.async_manager.actions) > 0:
+            time.sleep(0.1)
+
+        with io.open(self.runs_path, "r", encoding="utf-8") as f:
+            assert(len(f.readlines()) == 1)
+
+        results = []
+        for task_id in [1, 2]:
+            assert(self.system.get_task_result_ids(task_id) == ["1"])
+            results.append(os.stat(os.path.join(
+                self.system.config.results_dir, str(task_id), "1",
+                "results.xml"
+            )))
+            # both tasks moved on to their next slot
+            assert(self.system.tasks[task_id].schedule.not_before >
+                   datetime(2020, 1, 1))
+            assert(task_id not in self.system.tasks_scheduled)
+
+        # results are shared, not copied
+        assert(results[0].st_ino == results[1].st_ino)
+
+
+if __name__ == "__main__":
+    CoalesceTest.run()
@@ -0,0 +1,76 @@
+#!/usr/bin/python2
+
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import unit_test_harness
+from openscap_daemon import compression
+import io
+import os
+import os.path
+
+
+class CompressionTest(unit_test_harness.APITest):
+    def setup_data(self):
+        super(CompressionTest, self).setup_data()
+        self.copy_to_data("tasks/1.xml")
+
+    def test(self):
+        super(CompressionTest, self).test()
+
+        self.system.load_tasks()
+        config = self.system.config
+        task = self.system.tasks[1]
+
+        arf = u"<arf>%s</arf>" % (u"x" * 100000)
+        wip_files = os.listdir(config.work_in_progress_dir)
+        for method in compression.METHODS:
+            if not compression.is_available(method):
+                continue
+
+            result_dir = os.path.join(config.results_dir, "1", method)
+            os.makedirs(result_dir)
+            path = os.path.join(result_dir, "results.xml")
+            with io.open(path, "w", encoding="utf-8") as f:
+                f.write(arf)
+
+            compression.compress_result(result_dir, method)
+            actual_path, actual_method = compression.find(path)
+            assert(actual_method == method)
+            assert(len(os.listdir(result_dir)) == 1)
+            if method != "none":
+                assert(os.path.getsize(actual_path) < len(arf) // 10)
+
+            assert(compression.read_text(path) == arf)
+            with compression.uncompressed_path(
+                    path, config.work_in_progress_dir) as plain_path:
+                with io.open(plain_path, "r", encoding="utf-8") as f:
+                    assert(f.read() == arf)
+
+            # temporary copies are removed
+            assert(os.listdir(config.work_in_progress_dir) == wip_files)
+
+        # results read through the task are decompressed transparently
+        os.rename(os.path.join(config.results_dir, "1", "gzip"),
+                  os.path.join(config.results_dir, "1", "1"))
+        assert(task.get_xml_of_result(1, config) == arf)
+        assert(not compression.exists(
+            os.path.join(config.results_dir, "1", "1", "stdout")
+        ))
+
+
+if __name__ == "__main__":
+    CompressionTest.run()
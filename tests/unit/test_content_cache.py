@@ -0,0 +1,86 @@
+#!/usr/bin/python2
+
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import unit_test_harness
+import io
+import os
+import os.path
+from openscap_daemon.content_cache import LRUCache, get_file_digest
+from openscap_daemon.evaluation_spec import SCAPInput
+from openscap_daemon import oscap_helpers
+
+
+class ContentCacheTest(unit_test_harness.APITest):
+    def setup_data(self):
+        super(ContentCacheTest, self).setup_data()
+        self.copy_to_data("tasks/1.xml")
+
+    def write(self, name, contents):
+        path = os.path.join(self.data_dir_path, name)
+        with io.open(path, "w", encoding="utf-8") as f:
+            f.write(contents)
+
+        return path
+
+    def test(self):
+        super(ContentCacheTest, self).test()
+
+        # least recently used entries are evicted first
+        cache = LRUCache(2, 10)
+        cache.put("a", "aaa", 3)
+        cache.put("b", "bbb", 3)
+        assert(cache.get("a") == "aaa")
+        cache.put("c", "ccc", 3)
+        assert("b" not in cache)
+        cache.put("d", "dddddd", 6)
+        assert(cache.size == 9 and "a" not in cache and "c" in cache)
+        cache.put("e", "e" * 11, 11)
+        assert("e" not in cache and "d" in cache)
+
+        # digests follow changes of the file
+        path = self.write("a.xml", u"<a/>")
+        digest = get_file_digest(path)
+        assert(get_file_digest(path) == digest)
+        os.utime(path, (0, 0))
+        self.write("a.xml", u"<b/>")
+        assert(get_file_digest(path) != digest)
+
+        # equivalence only depends on the contents
+        first = SCAPInput()
+        first.set_file_path(self.write("first.xml", u"<same/>"))
+        second = SCAPInput()
+        second.set_file_path(self.write("second.xml", u"<same/>"))
+        assert(first.is_equivalent_to(second))
+        second.set_file_path(self.write("third.xml", u"<other/>"))
+        assert(not first.is_equivalent_to(second))
+
+        # profile choices are cached by the digest of the content
+        self.system.load_tasks()
+        contents = self.system.tasks[1].evaluation_spec.input_.get_xml_source()
+        choices = oscap_helpers.get_profile_choices_for_input(
+            self.write("ds1.xml", contents), None, None
+        )
+        cached_count = len(oscap_helpers._profile_choices_cache)
+        assert(oscap_helpers.get_profile_choices_for_input(
+            self.write("ds2.xml", contents), None, None
+        ) == choices)
+        assert(len(oscap_helpers._profile_choices_cache) == cached_count)
+
+
+if __name__ == "__main__":
+    ContentCacheTest.run()
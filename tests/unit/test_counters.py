@@ -0,0 +1,77 @@
+#!/usr/bin/python2
+
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import unit_test_harness
+import io
+import os
+import os.path
+import shutil
+
+
+class CountersTest(unit_test_harness.APITest):
+    def setup_data(self):
+        super(CountersTest, self).setup_data()
+        self.copy_to_data("tasks/1.xml")
+
+    def test(self):
+        super(CountersTest, self).test()
+
+        self.system.load_tasks()
+        results_dir = self.system.config.results_dir
+        task = self.system.tasks[1]
+
+        # result IDs come from the counter, it is recovered from disk first
+        os.makedirs(os.path.join(results_dir, "1", "7"))
+        target = task._get_next_target_dir(results_dir)
+        assert(os.path.basename(target) == "8")
+        os.mkdir(target)
+        assert(task.list_result_ids(results_dir) == ["8", "7"])
+
+        # IDs are not reused after the results have been removed
+        task.remove_results(self.system.config)
+        assert(task.list_result_ids(results_dir) == [])
+        assert(os.path.basename(task._get_next_target_dir(results_dir)) == "9")
+
+        # a corrupted counter is recovered from the results on disk
+        os.mkdir(os.path.join(results_dir, "1", "12"))
+        with io.open(os.path.join(results_dir, "1", ".last_result_id"),
+                     "w", encoding="utf-8") as f:
+            f.write(u"garbage")
+        task._result_id_counter = None
+        assert(os.path.basename(task._get_next_target_dir(results_dir)) ==
+               "13")
+
+        # a counter that is behind the results skips them
+        task._result_id_counter.last = 11
+        assert(os.path.basename(task._get_next_target_dir(results_dir)) ==
+               "13")
+
+        # task IDs are never reused
+        task_id = self.system.create_task()
+        assert(task_id == 2)
+        self.system.remove_task(task_id, True)
+        assert(self.system.create_task() == 3)
+
+        # definitions dropped in by other tools are skipped
+        shutil.copy(os.path.join(self.system.config.tasks_dir, "1.xml"),
+                    os.path.join(self.system.config.tasks_dir, "4.xml"))
+        assert(self.system.create_task() == 5)
+
+
+if __name__ == "__main__":
+    CountersTest.run()
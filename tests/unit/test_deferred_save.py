@@ -0,0 +1,83 @@
+#!/usr/bin/python2
+
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import unit_test_harness
+import os
+import os.path
+import time
+from openscap_daemon.task import Task
+
+
+class DeferredSaveTest(unit_test_harness.APITest):
+    def init_system(self):
+        super(DeferredSaveTest, self).init_system()
+        self.system.config.task_save_delay = 0.5
+
+    def test(self):
+        super(DeferredSaveTest, self).test()
+
+        self.system.load_tasks()
+        task_id = self.system.create_task()
+        path = self.system.tasks[task_id].config_file
+
+        # changes in a row are written once, after the delay
+        self.system.set_task_input(task_id, "/usr/share/xml/scap/ds.xml")
+        self.system.set_task_title(task_id, "Deferred")
+        self.system.set_task_profile_id(task_id, "xccdf_profile")
+        self.system.set_task_schedule_repeat_after(task_id, 24)
+        assert(not os.path.exists(path))
+
+        deadline = time.time() + 10
+        while not os.path.exists(path) and time.time() < deadline:
+            time.sleep(0.1)
+        assert(os.path.exists(path))
+
+        task = Task()
+        task.load(path)
+        assert(task.title == "Deferred")
+        assert(task.evaluation_spec.profile_id == "xccdf_profile")
+        assert(task.schedule.repeat_after == 24)
+
+        # no temporary files are left behind
+        assert(not [name for name in os.listdir(self.system.config.tasks_dir)
+                    if name.endswith(".tmp")])
+
+        # flushing writes pending changes right away
+        self.system.set_task_title(task_id, "Flushed")
+        self.system.flush_task_saves()
+        task.load(path)
+        assert(task.title == "Flushed")
+
+        # timestamps are available before the delay is over
+        task_id = self.system.create_task()
+        self.system.set_task_title(task_id, "Timestamps")
+        assert(self.system.get_task_created_timestamp(task_id) > 0)
+        assert(self.system.get_task_modified_timestamp(task_id) > 0)
+        self.system.remove_task(task_id, True)
+
+        # pending changes of removed tasks are dropped
+        task_id = self.system.create_task()
+        self.system.set_task_title(task_id, "Removed")
+        self.system.remove_task(task_id, False)
+        self.system.flush_task_saves()
+        assert(task_id not in self.system.tasks)
+        assert(not os.path.exists(self.system._get_task_file_path(task_id)))
+
+
+if __name__ == "__main__":
+    DeferredSaveTest.run()
@@ -0,0 +1,95 @@
+#!/usr/bin/python2
+
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import unit_test_harness
+import io
+import os
+import os.path
+import stat
+import time
+from openscap_daemon.journal import Journal
+from openscap_daemon import System
+
+
+class JournalTest(unit_test_harness.APITest):
+    def setup_data(self):
+        super(JournalTest, self).setup_data()
+        self.copy_to_data("tasks/1.xml")
+
+    def test(self):
+        super(JournalTest, self).test()
+
+        path = os.path.join(self.data_dir_path, "test_journal")
+        journal = Journal(path)
+        journal.record_enqueued("a", {"value": 1})
+        journal.record_enqueued("b", {"value": 2})
+        journal.record_enqueued("c", {"value": 3})
+        journal.record_started("a")
+        journal.record_started("b")
+        journal.record_finished("b")
+        journal.close()
+
+        # a crash in the middle of a write
+        with io.open(path, "ab") as f:
+            f.write(b'{"event": "fin')
+
+        journal = Journal(path)
+        records = journal.load()
+        assert([(record["key"], record["value"], started)
+                for record, started in records] ==
+               [("a", 1, True), ("c", 3, False)])
+        journal.close()
+
+        # the file has been compacted, loading it again gives the same
+        journal = Journal(path)
+        assert(len(journal.load()) == 2)
+        journal.close()
+
+        # pending evaluations and one-off runs survive a restart
+        wip_dir = self.system.config.work_in_progress_dir
+        self.system.load_tasks()
+        self.system.run_task_outside_schedule(1)
+        self.system.async_manager.set_workers(1)
+        spec = self.system.tasks[1].evaluation_spec
+        self.system.journal.record_enqueued(
+            "spec-1000", {"kind": "evaluate_spec", "token": 1000,
+                          "spec": spec.to_xml_source().decode("utf-8")}
+        )
+        os.mkdir(os.path.join(wip_dir, "stale"))
+        with open(os.path.join(wip_dir, "journal.new"), "w") as f:
+            f.write("stale")
+        self.system.journal.close()
+
+        system = System(os.path.join(self.data_dir_path, "config.ini"))
+        system.load_tasks()
+        system.resume_journal()
+        assert(not os.path.exists(os.path.join(wip_dir, "stale")))
+        assert(not os.path.exists(os.path.join(wip_dir, "journal.new")))
+        assert(os.path.exists(os.path.join(wip_dir, "journal")))
+        assert(system.tasks[1].run_outside_schedule_once)
+        assert(system.async_manager.last_token >= 1000)
+
+        # the oscap tool isn't available here, the evaluation fails quickly
+        while len(system.async_manager.actions) > 0:
+            time.sleep(0.1)
+        assert("spec-1000" not in system.journal)
+        assert("task-1" in system.journal)
+
+
+if __name__ == "__main__":
+    JournalTest.run()
@@ -0,0 +1,95 @@
+#!/usr/bin/python2
+
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import unit_test_harness
+from openscap_daemon.task import Task
+import io
+import os
+import os.path
+import json
+import time
+
+
+ARF = u"""<?xml version="1.0" encoding="UTF-8"?>
+<TestResult xmlns="http://checklists.nist.gov/xccdf/1.2">
+  <rule-result idref="a"><result>pass</result></rule-result>
+  <rule-result idref="b"><result>fail</result></rule-result>
+</TestResult>
+"""
+
+
+class PostEvaluationTest(unit_test_harness.APITest):
+    def setup_data(self):
+        super(PostEvaluationTest, self).setup_data()
+        self.copy_to_data("tasks/1.xml")
+
+    def test(self):
+        super(PostEvaluationTest, self).test()
+
+        self.system.load_tasks()
+        config = self.system.config
+        task = self.system.tasks[1]
+
+        try:
+            self.system.set_task_post_evaluation(1, ["summary", "nonsense"])
+            assert(False)
+        except RuntimeError:
+            pass
+
+        # the setting is saved with the task
+        self.system.set_task_post_evaluation(1, ["summary"])
+        self.system.flush_task_saves()
+        loaded = Task()
+        loaded.load(task.config_file)
+        assert(loaded.post_evaluation == ["summary"])
+
+        result_dir = os.path.join(config.results_dir, "1", "1")
+        os.makedirs(result_dir)
+        with io.open(os.path.join(result_dir, "exit_code"), "w",
+                     encoding="utf-8") as f:
+            f.write(u"2")
+        with io.open(os.path.join(result_dir, "results.xml"), "w",
+                     encoding="utf-8") as f:
+            f.write(ARF)
+
+        # artifacts are generated in the background, governed like the
+        # evaluation of the task
+        enqueued = []
+        enqueue = self.system.async_manager.enqueue
+
+        def recording_enqueue(action, *args):
+            enqueued.append(action)
+            return enqueue(action, *args)
+
+        self.system.async_manager.enqueue = recording_enqueue
+        self.system._enqueue_post_evaluation(task, 1)
+        self.system.async_manager.enqueue = enqueue
+        assert(enqueued[0].resource_key ==
+               task.evaluation_spec.get_resource_key())
+        while len(self.system.async_manager.actions) > 0:
+            time.sleep(0.1)
+
+        assert(os.path.exists(os.path.join(result_dir, "summary.json")))
+        summary = json.loads(self.system.generate_summary_for_task_result(1, 1))
+        assert(summary["exit_code"] == 2)
+        assert(summary["counts"] == {"pass": 1, "fail": 1})
+        assert(summary["rule_results"] == {"a": "pass", "b": "fail"})
+
+
+if __name__ == "__main__":
+    PostEvaluationTest.run()
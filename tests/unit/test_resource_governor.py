@@ -0,0 +1,139 @@
+#!/usr/bin/python2
+
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import unit_test_harness
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from openscap_daemon import oscap_helpers
+from openscap_daemon import compat
+from openscap_daemon import resource_governor
+from openscap_daemon import async_tools
+
+
+class RecordingAction(async_tools.AsyncAction):
+    def __init__(self, resource_key):
+        super(RecordingAction, self).__init__()
+        self.resource_key = resource_key
+        self.lane = "localhost"
+        self.ran = False
+
+    def run(self):
+        self.ran = True
+
+    def interrupt(self):
+        return True
+
+
+class ResourceGovernorTest(unit_test_harness.APITest):
+    def test(self):
+        super(ResourceGovernorTest, self).test()
+
+        # peak memory of child processes is measured
+        process = subprocess.Popen(
+            [sys.executable, "-c", "x = 'a' * (64 * 1024 * 1024)"]
+        )
+        exit_code, peak_memory = oscap_helpers._wait_for_process(process)
+        assert(exit_code == 0)
+        assert(process.poll() == 0)
+        assert(peak_memory is None or peak_memory >= 64 * 1024 * 1024)
+
+        # terminating a process somebody waits for leaves reaping to them
+        process = subprocess.Popen(["sleep", "60"],
+                                   **compat.new_session_popen_kwargs)
+        waited = []
+        waiter = threading.Thread(
+            target=lambda: waited.append(
+                oscap_helpers._wait_for_process(process)
+            )
+        )
+        waiter.start()
+        time.sleep(0.1)
+        oscap_helpers.terminate_process(process)
+        waiter.join()
+        assert(waited[0][0] == -signal.SIGTERM)
+        assert(waited[0][1] is not None or not hasattr(os, "wait4"))
+        assert(process.returncode == -signal.SIGTERM)
+        # signalling a reaped process is a no-op, its pid may be reused
+        oscap_helpers._signal_process(process, signal.SIGTERM)
+
+        available = resource_governor.read_available_memory()
+        if available is None:
+            return
+
+        # the memory check is off by default
+        governor = resource_governor.ResourceGovernor(poll_interval=0.05)
+        governor.record_footprint("huge", 2 * available)
+        governor.acquire("small")
+        governor.acquire("huge")
+        governor.release("huge")
+        governor.release("small")
+
+        governor = resource_governor.ResourceGovernor(poll_interval=0.05,
+                                                      check_memory=True)
+        # nothing is running, the first action always starts
+        governor.acquire("small")
+        governor.acquire("small")
+        governor.release("small", 1024)
+        governor.release("small", 2048)
+        assert(governor.get_footprint("small") == 2048)
+
+        # content that doesn't fit next to a running action has to wait
+        governor.record_footprint("huge", 2 * available)
+        governor.acquire("small")
+        started = threading.Event()
+
+        def start_huge():
+            governor.acquire("huge")
+            started.set()
+
+        huge_thread = threading.Thread(target=start_huge)
+        huge_thread.start()
+        time.sleep(0.2)
+        assert(not started.is_set())
+
+        governor.release("small")
+        huge_thread.join(5)
+        assert(started.is_set())
+        governor.release("huge", 1024)
+        # footprints decay slowly
+        assert(governor.get_footprint("huge") == (2 * available + 1024) // 2)
+
+        # actions cancelled while waiting for the governor never run and
+        # release their lane
+        manager = async_tools.AsyncManager(1)
+        manager.governor = governor
+        governor.acquire("small")
+        action = RecordingAction("huge")
+        token = manager.enqueue(action)
+        time.sleep(0.2)
+        assert(action.status == async_tools.Status.PROCESSING)
+        assert(manager.cancel(token))
+        governor.release("small")
+        manager.queue.join()
+        assert(not action.ran)
+        assert(manager.lanes == {})
+        assert(manager.get_action(token) is None)
+        assert(governor.running == [])
+
+
+if __name__ == "__main__":
+    ResourceGovernorTest.run()
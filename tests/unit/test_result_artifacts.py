@@ -0,0 +1,80 @@
+#!/usr/bin/python2
+
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import unit_test_harness
+from openscap_daemon import result_artifacts
+import os
+import os.path
+import threading
+import time
+
+
+class ResultArtifactsTest(unit_test_harness.APITest):
+    def test(self):
+        super(ResultArtifactsTest, self).test()
+
+        result_dir = os.path.join(self.data_dir_path, "results", "1", "1")
+        os.makedirs(result_dir)
+
+        calls = []
+
+        def generate():
+            calls.append(None)
+            # long enough for the other threads to pile up
+            time.sleep(0.2)
+            return u"<html>report</html>"
+
+        # concurrent requests share one generation
+        reports = []
+        threads = [
+            threading.Thread(target=lambda: reports.append(
+                result_artifacts.get(result_dir, "report.html", generate,
+                                     "gzip")
+            ))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert(len(calls) == 1)
+        assert(reports == [u"<html>report</html>"] * 4)
+        assert(os.listdir(result_dir) == ["report.html.gz"])
+
+        # the stored report is used once it's gone from memory
+        result_artifacts.forget(result_dir)
+        assert(result_artifacts.get(result_dir, "report.html", generate) ==
+               u"<html>report</html>")
+        assert(len(calls) == 1)
+
+        # failures are not cached
+        def fail():
+            raise RuntimeError("oscap failed")
+
+        for _ in range(2):
+            try:
+                result_artifacts.get(result_dir, "fix.sh", fail)
+                assert(False)
+            except RuntimeError:
+                pass
+        assert(not os.path.exists(os.path.join(result_dir, "fix.sh")))
+
+
+if __name__ == "__main__":
+    ResultArtifactsTest.run()
@@ -0,0 +1,127 @@
+#!/usr/bin/python2
+
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import unit_test_harness
+import os
+import os.path
+import time
+from openscap_daemon.result_store import MemoryBudget, AsyncResultStore
+
+
+class ResultStoreTest(unit_test_harness.APITest):
+    def test(self):
+        super(ResultStoreTest, self).test()
+
+        spill_dir = os.path.join(self.data_dir_path, "spill")
+        store = AsyncResultStore(spill_dir, memory_budget=100,
+                                 spill_threshold=50, ttl=0)
+
+        # small results stay in memory
+        store.put(1, ("arf", "stdout", "stderr", 0))
+        assert(not os.path.exists(spill_dir))
+
+        # large results go to disk
+        large = ("a" * 60, "stdout", "stderr", 2)
+        store.put(2, large)
+        assert(len(os.listdir(spill_dir)) == 1)
+
+        # so do results that don't fit into the memory budget
+        for token in range(3, 6):
+            store.put(token, ("b" * 40, "", "", 0))
+        assert(store.memory_used <= 100)
+        assert(len(os.listdir(spill_dir)) == 3)
+
+        assert(store.take(1) == ("arf", "stdout", "stderr", 0))
+        assert(tuple(store.take(2)) == large)
+        assert(len(os.listdir(spill_dir)) == 2)
+        try:
+            store.take(2)
+            assert(False)
+        except KeyError:
+            pass
+
+        store.discard(4)
+        store.discard(5)
+        assert(len(os.listdir(spill_dir)) == 0)
+
+        # results that nobody collects expire
+        store.ttl = 1
+        store.put(6, large)
+        store.put(7, "small")
+        time.sleep(1.1)
+        store.evict_expired()
+        assert(len(store) == 0)
+        assert(store.memory_used == 0)
+        assert(len(os.listdir(spill_dir)) == 0)
+
+        # results discarded or replaced while being spilled don't stay around
+        store.ttl = 0
+        spill = store._spill
+
+        def discarding_spill(value):
+            store.discard(8)
+            return spill(value)
+
+        store._spill = discarding_spill
+        store.put(8, large)
+        assert(8 not in store)
+        assert(len(os.listdir(spill_dir)) == 0)
+
+        def replacing_spill(value):
+            store._spill = spill
+            store.put(9, large)
+            return spill(value)
+
+        store._spill = replacing_spill
+        store.put(9, large)
+        assert(len(os.listdir(spill_dir)) == 1)
+        store.discard(9)
+        assert(len(os.listdir(spill_dir)) == 0)
+
+        # a failed spill leaves nothing behind
+        def failing_spill(value):
+            raise IOError("disk full")
+
+        store._spill = failing_spill
+        try:
+            store.put(10, large)
+            assert(False)
+        except IOError:
+            pass
+        store._spill = spill
+        assert(10 not in store)
+        assert(store.spilling == {})
+
+        # stores can share one memory budget
+        budget = MemoryBudget(100)
+        first = AsyncResultStore(spill_dir, budget, 50, 0)
+        second = AsyncResultStore(spill_dir, budget, 50, 0)
+        first.put(1, "c" * 40)
+        second.put(1, "c" * 40)
+        second.put(2, "c" * 40)
+        assert(budget.used == 80)
+        assert(len(os.listdir(spill_dir)) == 1)
+        first.take(1)
+        second.discard(1)
+        second.discard(2)
+        assert(budget.used == 0)
+        assert(len(os.listdir(spill_dir)) == 0)
+
+
+if __name__ == "__main__":
+    ResultStoreTest.run()
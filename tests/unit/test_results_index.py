@@ -0,0 +1,102 @@
+#!/usr/bin/python2
+
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import unit_test_harness
+from openscap_daemon import results_index
+from datetime import datetime
+import io
+import os
+import os.path
+
+
+ARF = u"""<?xml version="1.0" encoding="UTF-8"?>
+<TestResult xmlns="http://checklists.nist.gov/xccdf/1.2">
+  <rule-result idref="a"><result>pass</result></rule-result>
+  <rule-result idref="b"><result>fail</result></rule-result>
+  <rule-result idref="c"><result>pass</result></rule-result>
+</TestResult>
+"""
+
+
+class ResultsIndexTest(unit_test_harness.APITest):
+    def setup_data(self):
+        super(ResultsIndexTest, self).setup_data()
+        self.copy_to_data("tasks/1.xml")
+
+    def make_result(self, path, exit_code):
+        os.mkdir(path)
+        with io.open(os.path.join(path, "exit_code"), "w",
+                     encoding="utf-8") as f:
+            f.write(u"%i" % (exit_code))
+        with io.open(os.path.join(path, "results.xml"), "w",
+                     encoding="utf-8") as f:
+            f.write(ARF)
+
+    def test(self):
+        super(ResultsIndexTest, self).test()
+
+        self.system.load_tasks()
+        config = self.system.config
+        task = self.system.tasks[1]
+
+        # a result stored by the daemon is indexed with everything we know
+        wip_result = os.path.join(config.work_in_progress_dir, "wip")
+        self.make_result(wip_result, 2)
+        metadata = results_index.get_result_metadata(wip_result, 10.0, 25.0)
+        assert(metadata["rule_results"] == {"pass": 2, "fail": 1})
+        task._store_result(wip_result, datetime.now(), config, metadata)
+
+        # a result the index doesn't know about is picked up when listing
+        self.make_result(
+            os.path.join(config.results_dir, "1", "2"), 0
+        )
+
+        listing = task.get_results_metadata(config.results_dir)
+        assert([result_id for result_id, _ in listing] == ["2", "1"])
+        assert(listing[0][1]["exit_code"] == 0)
+        assert(listing[0][1]["rule_results"] is None)
+        assert(listing[1][1]["exit_code"] == 2)
+        assert(listing[1][1]["duration"] == 15.0)
+        assert(listing[1][1]["rule_results"] == {"pass": 2, "fail": 1})
+        assert(listing[1][1]["size"] > len(ARF))
+
+        # the index survives restarts and follows removals
+        task.remove_result("1", config)
+        index = results_index.ResultsIndex(
+            os.path.join(config.results_dir, "1", ".results_index")
+        )
+        assert(index.get_result_ids() == set([2]))
+
+        task.remove_results(config)
+        assert(task.get_results_metadata(config.results_dir) == [])
+
+        # rule results nested deep in the ARF next to other reports are found
+        arf_path = os.path.join(config.work_in_progress_dir, "nested.xml")
+        with io.open(arf_path, "w", encoding="utf-8") as f:
+            f.write(
+                u"<asset-report-collection><reports><report><content>" +
+                u"<oval_results>%s</oval_results>" % (u"<item/>" * 1000) +
+                ARF[ARF.index(u"<TestResult"):] +
+                u"</content></report></reports></asset-report-collection>"
+            )
+        assert(list(results_index.iter_rule_results(arf_path)) ==
+               [("a", "pass"), ("b", "fail"), ("c", "pass")])
+
+
+if __name__ == "__main__":
+    ResultsIndexTest.run()
@@ -0,0 +1,86 @@
+#!/usr/bin/python2
+
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import unit_test_harness
+from datetime import datetime, timedelta
+from openscap_daemon.schedule_index import ScheduleIndex
+from openscap_daemon.task import Schedule, SlipMode
+
+
+class ScheduleIndexTest(unit_test_harness.APITest):
+    def setup_data(self):
+        super(ScheduleIndexTest, self).setup_data()
+        self.copy_to_data("tasks/1.xml")
+
+    def test(self):
+        super(ScheduleIndexTest, self).test()
+
+        now = datetime(2020, 1, 1, 12, 0)
+        index = ScheduleIndex()
+        assert(index.peek() is None)
+
+        index.update(1, now + timedelta(hours=3))
+        index.update(2, now + timedelta(hours=1))
+        index.update(3, now + timedelta(hours=2))
+        assert(index.peek() == (now + timedelta(hours=1), 2))
+
+        # the old entry of task 2 is stale now and has to be skipped
+        index.update(2, now + timedelta(hours=5))
+        assert(index.peek() == (now + timedelta(hours=2), 3))
+
+        index.remove(3)
+        assert(index.peek() == (now + timedelta(hours=3), 1))
+        assert(len(index) == 2)
+
+        assert(index.pop_due(now + timedelta(hours=2)) == [])
+        assert(index.pop_due(now + timedelta(hours=5)) == [1, 2])
+        assert(index.peek() is None)
+
+        index.update_many([(1, now), (2, None), (3, now - timedelta(hours=1))])
+        assert(index.peek() == (now - timedelta(hours=1), 3))
+        assert(index.pop_due(now) == [3, 1])
+
+        # aligned slots are computed directly, even for ancient schedules
+        schedule = Schedule()
+        schedule.not_before = datetime(2000, 1, 1, 0, 30)
+        schedule.repeat_after = 1
+        schedule.slip_mode = SlipMode.DROP_MISSED_ALIGNED
+        assert(schedule.next_not_before(now) == datetime(2020, 1, 1, 12, 30))
+        assert(schedule.next_not_before(datetime(2020, 1, 1, 12, 30)) ==
+               datetime(2020, 1, 1, 13, 30))
+        assert(schedule.next_not_before(datetime(1999, 1, 1)) ==
+               datetime(2000, 1, 1, 1, 30))
+        schedule.repeat_after = 0
+        assert(schedule.next_not_before(now) is None)
+
+        # the schedule of a task loaded from disk ends up in the index
+        self.system.load_tasks()
+        task = self.system.tasks[1]
+        assert(self.system.get_closest_datetime(now) ==
+               task.schedule.not_before)
+
+        self.system.set_task_enabled(1, False)
+        assert(self.system.get_closest_datetime(now) is None)
+
+        self.system.set_task_enabled(1, True)
+        self.system.set_task_schedule_not_before(1, now)
+        assert(self.system.get_closest_datetime(now) == now)
+
+
+if __name__ == "__main__":
+    ScheduleIndexTest.run()
@@ -0,0 +1,85 @@
+#!/usr/bin/python2
+
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import unit_test_harness
+from datetime import datetime, timedelta
+from openscap_daemon.task import Schedule
+
+
+class ScheduleSpreadTest(unit_test_harness.APITest):
+    def setup_data(self):
+        super(ScheduleSpreadTest, self).setup_data()
+        self.copy_to_data("tasks/1.xml")
+
+    def test(self):
+        super(ScheduleSpreadTest, self).test()
+
+        base = datetime(2020, 1, 1, 1, 0)
+
+        # tasks with the same daily schedule end up in different slots
+        offsets = set()
+        for task_id in range(1, 101):
+            schedule = Schedule()
+            schedule.not_before = base
+            schedule.repeat_after = 24
+            assert(schedule.apply_spread(task_id, 4 * 60) or
+                   schedule.spread_offset == 0)
+            assert(0 <= schedule.spread_offset < 4 * 60)
+            assert(schedule.not_before ==
+                   base + timedelta(minutes=schedule.spread_offset))
+            # applying the same spread again doesn't move the task
+            assert(not schedule.apply_spread(task_id, 4 * 60))
+            offsets.add(schedule.spread_offset)
+        assert(len(offsets) > 50)
+
+        # the window is clamped to the period, one-off tasks aren't spread
+        schedule = Schedule()
+        schedule.not_before = base
+        schedule.repeat_after = 1
+        schedule.spread = 24 * 60
+        schedule.apply_spread(1)
+        assert(schedule.spread_offset < 60)
+        schedule.repeat_after = 0
+        schedule.apply_spread(1)
+        assert(schedule.spread_offset == 0)
+        assert(schedule.not_before == base)
+
+        # the offset is persisted with the schedule
+        self.system.load_tasks()
+        self.system.set_task_schedule_spread(1, 30)
+        task = self.system.tasks[1]
+        offset = task.schedule.spread_offset
+        not_before = task.schedule.not_before
+        assert(self.system.get_closest_datetime(base) == not_before)
+
+        self.system.flush_task_saves()
+        task.load(task.config_file)
+        assert(task.schedule.spread == 30)
+        assert(task.schedule.spread_offset == offset)
+        assert(task.schedule.not_before == not_before)
+
+        self.system.set_task_schedule_not_before(1, base)
+        assert(task.schedule.not_before == base + timedelta(minutes=offset))
+
+        self.system.set_task_schedule_spread(1, -1)
+        assert(self.system.get_task_schedule_spread(1) == -1)
+        assert(task.schedule.not_before == base)
+
+
+if __name__ == "__main__":
+    ScheduleSpreadTest.run()
@@ -0,0 +1,67 @@
+#!/usr/bin/python2
+
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import unit_test_harness
+import os
+import os.path
+import time
+from openscap_daemon import System
+
+
+class TaskIndexTest(unit_test_harness.APITest):
+    def setup_data(self):
+        super(TaskIndexTest, self).setup_data()
+        self.copy_to_data("tasks/1.xml")
+
+    def init_system(self):
+        # make sure the task definition is older than the index
+        path = os.path.join(self.data_dir_path, "tasks", "1.xml")
+        past = time.time() - 60
+        os.utime(path, (past, past))
+
+        super(TaskIndexTest, self).init_system()
+
+    def test(self):
+        super(TaskIndexTest, self).test()
+
+        self.system.load_tasks()
+        task = self.system.tasks[1]
+        assert(task.is_evaluation_spec_loaded())
+        assert(os.path.exists(self.system.task_index.path))
+
+        # tasks are loaded from the index, the XML is parsed when needed
+        system = System(os.path.join(self.data_dir_path, "config.ini"))
+        system.load_tasks()
+        indexed_task = system.tasks[1]
+        assert(not indexed_task.is_evaluation_spec_loaded())
+        assert(indexed_task.title == task.title)
+        assert(indexed_task.schedule.is_equivalent_to(task.schedule))
+        assert(indexed_task.is_equivalent_to(task))
+        assert(indexed_task.is_evaluation_spec_loaded())
+
+        # changed task definitions are parsed again
+        task.title = "Changed title"
+        task.save()
+        system = System(os.path.join(self.data_dir_path, "config.ini"))
+        system.load_tasks()
+        assert(system.tasks[1].title == "Changed title")
+        assert(system.tasks[1].is_evaluation_spec_loaded())
+
+
+if __name__ == "__main__":
+    TaskIndexTest.run()
@@ -0,0 +1,75 @@
+#!/usr/bin/python2
+
+# Copyright 2015 Red Hat Inc., Durham, North Carolina.
+# All Rights Reserved.
+#
+# openscap-daemon is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# openscap-daemon is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with openscap-daemon.  If not, see <http://www.gnu.org/licenses/>.
+
+import unit_test_harness
+import os
+import os.path
+import shutil
+import time
+from openscap_daemon.task import Task
+
+
+class TaskWatcherTest(unit_test_harness.APITest):
+    def setup_data(self):
+        super(TaskWatcherTest, self).setup_data()
+        self.copy_to_data("tasks/1.xml")
+
+    def wait_for(self, condition):
+        deadline = time.time() + 30
+        while not condition() and time.time() < deadline:
+            time.sleep(0.1)
+
+        assert(condition())
+
+    def test(self):
+        super(TaskWatcherTest, self).test()
+
+        self.system.config.tasks_dir_poll_interval = 0.5
+        self.system.load_tasks()
+        self.system.watch_tasks_dir()
+        tasks_dir = self.system.config.tasks_dir
+
+        # new definitions are loaded
+        shutil.copy(os.path.join(tasks_dir, "1.xml"),
+                    os.path.join(tasks_dir, "2.xml"))
+        self.wait_for(lambda: 2 in self.system.tasks)
+
+        # changed definitions are reloaded
+        task = Task()
+        task.load(os.path.join(tasks_dir, "2.xml"))
+        task.title = "Changed by config management"
+        task.save_as(os.path.join(tasks_dir, "2.xml"))
+        self.wait_for(lambda: self.system.get_task_title(2) ==
+                      "Changed by config management")
+
+        # removed definitions are forgotten
+        os.remove(os.path.join(tasks_dir, "2.xml"))
+        self.wait_for(lambda: 2 not in self.system.tasks)
+        assert(1 in self.system.tasks)
+
+        # a full rescan only touches what has changed
+        task_1 = self.system.tasks[1]
+        shutil.copy(os.path.join(tasks_dir, "1.xml"),
+                    os.path.join(tasks_dir, "3.xml"))
+        self.system.reload_task_files()
+        assert(3 in self.system.tasks)
+        assert(self.system.tasks[1] is task_1)
+
+
+if __name__ == "__main__":
+    TaskWatcherTest.run()